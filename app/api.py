@@ -139,6 +139,10 @@ def on_startup():
     try:
         logger.info("Инициализация базы данных...")
         init_db(demostart = False)
+        # Фоновое предвычисление подборок для дискретной части анкеты
+        from database.database import engine
+        from services.recommendation import start_recommendation_precompute
+        start_recommendation_precompute(engine)
         logger.info("Запуск приложения успешно завершен")
     except Exception as e:
         logger.error(f"Ошибка при запуске: {str(e)}")
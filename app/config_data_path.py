@@ -4,6 +4,7 @@
     о фестиваля: транзакции, концерты, артисты, программы, маршруты
     и т.д.
 """
+import os
 
 ############################################################################
 ####            Базовые параметры фестиваля                            #####
@@ -35,6 +36,14 @@ HALLS_LIST_PATH = 'data/HallList-good.xlsx'
 ## Размеченные маршруты фестиваля
 ROUTES_PATH = 'data/RouteRange_with_GMM-.csv'
 
+## Колоночный каталог маршрутов (файлы .npy, общие для всех процессов через mmap).
+## Путь абсолютный: API (WORKDIR /app) и воркер (WORKDIR /) должны видеть одну папку.
+## В docker-compose задаётся переменной ROUTE_CATALOG_DIR на общем томе
+ROUTE_CATALOG_DIR = os.environ.get(
+    'ROUTE_CATALOG_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'route_catalog')
+)
+
 ## Таблица переходов между залами
 HALLS_TRANSITIONS_PATH = 'data/HallsTime-good.xlsx'
 
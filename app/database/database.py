@@ -105,6 +105,11 @@ def init_db(demostart = None):
             from services.crud.data_loader import init_routes_count_cache
             init_routes_count_cache(session)
             
+            # Столбцы и индексы таблиц маршрутов для уже существующей базы
+            route_service.ensure_route_sostav_ids(session)
+            route_service.ensure_route_indexes(session)
+            route_service.ensure_route_concert_links(session)
+            
             # Проверяем и инициализируем AvailableRoute, если нужно
             try:
                 route_service.ensure_available_routes_exist(session)
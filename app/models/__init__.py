@@ -5,7 +5,7 @@ from .artist import Artist, ConcertArtistLink
 from .composition import Composition, Author, ConcertCompositionLink
 from .genre import Genre, ConcertGenreLink
 from .purchase import Purchase
-from .route import Route, AvailableRoute
+from .route import Route, AvailableRoute, RouteConcertLink
 from .statistics import Statistics
 from .festival_day import FestivalDay
 from .customer_route_match import CustomerRouteMatch
@@ -27,6 +27,7 @@ __all__ = [
     "User",
     "Route",
     "AvailableRoute",
+    "RouteConcertLink",
     "Statistics",
     "FestivalDay",
     "CustomerRouteMatch",
@@ -5,7 +5,7 @@ from datetime import datetime
 
 class CustomerRouteMatch(SQLModel, table=True, extend_existing=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_external_id: str = Field(index=True, description="Внешний ID покупателя")
+    user_external_id: str = Field(index=True, unique=True, description="Внешний ID покупателя")
     
     # Результат сопоставления
     found: bool = Field(description="Найдено ли соответствие")
@@ -1,10 +1,24 @@
-from typing import Optional
+from typing import List, Optional
 from sqlmodel import SQLModel, Field
+from sqlalchemy import BigInteger, Column, Index, Integer, JSON
+from sqlalchemy.dialects.postgresql import ARRAY
 from datetime import datetime
 
+
+def _sostav_ids_column() -> Column:
+    # Состав маршрута как int[] (в SQLite, используемом в тестах, — JSON)
+    return Column("SostavIds", ARRAY(Integer).with_variant(JSON(none_as_null=True), "sqlite"), nullable=True)
+
+
 class Route(SQLModel, table=True, extend_existing=True):
+    __table_args__ = (
+        Index("ix_route_sostavids_gin", "SostavIds", postgresql_using="gin"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    Sostav: str
+    Sostav: str = Field(unique=True, index=True)  # Канонический состав — ключ маршрута при импорте
+    SostavIds: Optional[List[int]] = Field(default=None, sa_column=_sostav_ids_column())
+    RowHash: Optional[int] = Field(default=None, sa_column=Column("RowHash", BigInteger, nullable=True))  # Отпечаток строки файла маршрутов
     Days: int
     Concerts: int
     Halls: int
@@ -52,6 +66,8 @@ class AvailableRoute(SQLModel, table=True, extend_existing=True):
     # Все поля из Route (копия структуры)
     id: Optional[int] = Field(default=None, primary_key=True)
     Sostav: str
+    SostavIds: Optional[List[int]] = Field(default=None, sa_column=_sostav_ids_column())
+    RowHash: Optional[int] = Field(default=None, sa_column=Column("RowHash", BigInteger, nullable=True))  # Отпечаток строки файла маршрутов
     Days: int
     Concerts: int
     Halls: int
@@ -95,5 +111,11 @@ class AvailableRoute(SQLModel, table=True, extend_existing=True):
     GMM_Cluster: Optional[int] = None
     
     # Дополнительные поля для отслеживания
-    original_route_id: Optional[int] = Field(default=None)  # Ссылка на оригинал
-    last_availability_check: Optional[datetime] = Field(default=None) 
\ No newline at end of file
+    original_route_id: Optional[int] = Field(default=None, index=True)  # Ссылка на оригинал
+    last_availability_check: Optional[datetime] = Field(default=None) 
+
+
+class RouteConcertLink(SQLModel, table=True, extend_existing=True):
+    # Состав маршрута в виде, пригодном для JOIN (одна строка на концерт маршрута)
+    route_id: int = Field(foreign_key="route.id", primary_key=True)
+    concert_id: int = Field(primary_key=True, index=True)  # Concert.external_id
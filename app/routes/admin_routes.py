@@ -5,6 +5,7 @@ from database.database import get_session
 from database.config import get_settings
 from services.crud import user as UsersService
 from services.crud.purchase import get_festival_summary_stats
+from services.route_index import route_concert_ids
 from config_data_path import ROUTES_PATH
 import shutil
 import os
@@ -104,12 +105,13 @@ async def upload_routes(request: Request, file: UploadFile = File(...), session=
             result = load_routes_from_csv(session, path, status_dict=route_upload_status)
             route_upload_status["added"] = result["added"]
             route_upload_status["updated"] = result["updated"]
-            process_available_routes_check(session)
+            # Загрузчик уже обновил AvailableRoute: перестроил или обновил изменившиеся маршруты
+            process_available_routes_check(session, refresh=False)
         except Exception as e:
             route_upload_status["error"] = str(e)
         finally:
             route_upload_status["in_progress"] = False
-    def process_available_routes_check(session):
+    def process_available_routes_check(session, refresh=True):
         global available_routes_status
         try:
             available_routes_status["in_progress"] = True
@@ -121,11 +123,16 @@ async def upload_routes(request: Request, file: UploadFile = File(...), session=
             from services.crud import route_service
             from models import Route, AvailableRoute
             from sqlmodel import select
-            total_routes = len(session.exec(select(Route)).all())
+            from sqlalchemy import func
+            total_routes = session.exec(select(func.count(Route.id))).one()
             available_routes_status["total_routes"] = total_routes
             available_routes_status["total"] = total_routes
-            existing_count = len(session.exec(select(AvailableRoute)).all())
-            if existing_count == 0:
+            existing_count = session.exec(select(func.count(AvailableRoute.id))).one()
+            if not refresh:
+                stats = route_service.get_available_routes_stats(session)
+                available_routes_status["available_count"] = stats["available_routes"]
+                available_routes_status["availability_percentage"] = stats["availability_percentage"]
+            elif existing_count == 0:
                 result = route_service.init_available_routes(session, status_dict=available_routes_status)
                 available_routes_status["available_count"] = result["available_routes"]
                 available_routes_status["availability_percentage"] = result.get("availability_percentage", 0)
@@ -139,6 +146,9 @@ async def upload_routes(request: Request, file: UploadFile = File(...), session=
             logging.error(f"Ошибка при проверке AvailableRoute: {e}")
         finally:
             available_routes_status["in_progress"] = False
+            # Маршруты или их доступность могли измениться — пересчитываем предвычисленные подборки
+            from services.recommendation import schedule_recommendation_precompute
+            schedule_recommendation_precompute()
     thread = threading.Thread(target=process_routes_upload, args=(session, ROUTES_PATH))
     thread.start()
     return JSONResponse({"success": True, "message": "Загрузка маршрутов запущена"})
@@ -272,7 +282,7 @@ async def admin_routes_view(request: Request, session=Depends(get_session)):
     available_routes = total_routes[offset:offset + per_page]
     routes_data = []
     for route in available_routes:
-        concert_ids = sorted([int(x.strip()) for x in route.Sostav.split(',') if x.strip()])
+        concert_ids = route_concert_ids(route)
         concert_ids_str = [str(x) for x in concert_ids]
         routes_data.append({
             'id': route.id,
@@ -402,7 +412,7 @@ async def get_routes_api(request: Request, session=Depends(get_session)):
     available_routes = total_routes[offset:end_offset]
     routes_data = []
     for route in available_routes:
-        concert_ids = sorted([int(x.strip()) for x in route.Sostav.split(',') if x.strip()])
+        concert_ids = route_concert_ids(route)
         concert_ids_str = [str(x) for x in concert_ids]
         routes_data.append({
             'id': route.id,
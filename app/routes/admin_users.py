@@ -74,10 +74,12 @@ async def admin_users(request: Request, session=Depends(get_session)):
     route_matches = {}
     try:
         from models import CustomerRouteMatch, Route
-        routes = session.exec(select(Route)).all()
-        routes_by_id = {getattr(route, 'id', None): route for route in routes if getattr(route, 'id', None) is not None}
         matches = session.exec(select(CustomerRouteMatch)).all()
         logging.info(f"Найдено {len(matches)} записей в CustomerRouteMatch")
+        # Загружаем только маршруты, на которые ссылаются сопоставления
+        best_route_ids = {match.best_route_id for match in matches if match.found and match.best_route_id}
+        routes = session.exec(select(Route).where(Route.id.in_(best_route_ids))).all() if best_route_ids else []
+        routes_by_id = {route.id: route for route in routes}
         found_matches = 0
         for match in matches:
             best_route = None
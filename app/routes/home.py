@@ -8,6 +8,7 @@ from database.config import get_settings
 from database.database import get_session
 from services.crud import user as UsersService
 from services.crud.purchase import get_festival_summary_stats
+from services.route_index import route_concert_ids
 import pandas as pd
 from typing import Dict
 from sqlalchemy import select, func
@@ -94,7 +95,8 @@ def process_routes_upload(session, path):
         route_upload_status["updated"] = result["updated"]
         
         # После загрузки маршрутов запускаем проверку AvailableRoute
-        process_available_routes_check(session)
+        # (загрузчик уже обновил AvailableRoute: перестроил или обновил изменившиеся маршруты)
+        process_available_routes_check(session, refresh=False)
         
     except Exception as e:
         route_upload_status["error"] = str(e)
@@ -102,7 +104,7 @@ def process_routes_upload(session, path):
         route_upload_status["in_progress"] = False
 
 
-def process_available_routes_check(session):
+def process_available_routes_check(session, refresh=True):
     global available_routes_status
     try:
         available_routes_status["in_progress"] = True
@@ -116,16 +118,22 @@ def process_available_routes_check(session):
         from services.crud import route_service
         from models import Route, AvailableRoute
         from sqlmodel import select
+        from sqlalchemy import func
         
         # Получаем общее количество маршрутов
-        total_routes = len(session.exec(select(Route)).all())
+        total_routes = session.exec(select(func.count(Route.id))).one()
         available_routes_status["total_routes"] = total_routes
         available_routes_status["total"] = total_routes
         
         # Проверяем, есть ли уже AvailableRoute
-        existing_count = len(session.exec(select(AvailableRoute)).all())
+        existing_count = session.exec(select(func.count(AvailableRoute.id))).one()
         
-        if existing_count == 0:
+        if not refresh:
+            # AvailableRoute уже обновлены загрузчиком, только читаем статистику
+            stats = route_service.get_available_routes_stats(session)
+            available_routes_status["available_count"] = stats["available_routes"]
+            available_routes_status["availability_percentage"] = stats["availability_percentage"]
+        elif existing_count == 0:
             # Если AvailableRoute нет, инициализируем их
             logging.info("AvailableRoute не найдены, начинаем инициализацию...")
             result = route_service.init_available_routes(session, status_dict=available_routes_status)
@@ -145,6 +153,9 @@ def process_available_routes_check(session):
         logging.error(f"Ошибка при проверке AvailableRoute: {e}")
     finally:
         available_routes_status["in_progress"] = False
+        # Маршруты или их доступность могли измениться — пересчитываем предвычисленные подборки
+        from services.recommendation import schedule_recommendation_precompute
+        schedule_recommendation_precompute()
 
 
 def get_user_field(u, field):
@@ -656,8 +667,8 @@ async def admin_routes_view(request: Request, session=Depends(get_session)):
     # Подготавливаем данные для таблицы
     routes_data = []
     for route in available_routes:
-        # Парсим состав маршрута для отображения и сортируем номера
-        concert_ids = sorted([int(x.strip()) for x in route.Sostav.split(',') if x.strip()])
+        # Состав маршрута для отображения (номера концертов по возрастанию)
+        concert_ids = route_concert_ids(route)
         concert_ids_str = [str(x) for x in concert_ids]
         
         routes_data.append({
@@ -870,7 +881,7 @@ async def get_routes_api(request: Request, session=Depends(get_session)):
     # Подготавливаем данные
     routes_data = []
     for route in available_routes:
-        concert_ids = sorted([int(x.strip()) for x in route.Sostav.split(',') if x.strip()])
+        concert_ids = route_concert_ids(route)
         concert_ids_str = [str(x) for x in concert_ids]
         
         routes_data.append({
@@ -1593,6 +1604,32 @@ async def get_recommendations_api(
         return {"success": False, "message": str(e)}
 
 
+@home_route.get("/api/recommendations/complete-route")
+async def get_complete_route_recommendations_api(
+    request: Request,
+    metric: str = "balanced",
+    top_n: int = 10,
+    session=Depends(get_session)
+):
+    """API для подбора маршрутов, дополняющих уже купленные пользователем концерты"""
+    token = request.cookies.get(settings.COOKIE_NAME)
+    current_user = None
+    if token:
+        try:
+            user_email = await authenticate_cookie(token)
+            current_user = UsersService.get_user_by_email(user_email, session)
+        except Exception:
+            pass  # Пользователь не авторизован
+    if not current_user or not current_user.external_id:
+        return {"success": False, "message": "Требуется авторизация покупателя"}
+
+    from services import recommendation
+    result = recommendation.complete_route_recommendations(
+        session, user_external_id=str(current_user.external_id), metric=metric, top_n=max(1, min(top_n, 50))
+    )
+    return {"success": True, "recommendations": result}
+
+
 @home_route.get("/admin/api/dashboard-stats")
 async def get_dashboard_stats(request: Request, session=Depends(get_session)):
     """API для получения статистики дашборда"""
@@ -1650,6 +1687,32 @@ async def get_dashboard_stats(request: Request, session=Depends(get_session)):
         raise HTTPException(status_code=500, detail="Ошибка получения статистики")
 
 
+@home_route.get("/admin/api/recommendations/cache-stats")
+async def get_recommendation_cache_stats(request: Request, session=Depends(get_session)):
+    """API для получения счётчиков кэша подборок маршрутов"""
+    # Проверяем авторизацию
+    token = request.cookies.get(settings.COOKIE_NAME)
+    if token:
+        user = await authenticate_cookie(token)
+    else:
+        user = None
+
+    user_obj = None
+    if user:
+        user_obj = UsersService.get_user_by_email(user, session)
+    if not user_obj or not getattr(user_obj, 'is_superuser', False):
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+    from services.recommendation import get_recommendation_cache_stats as recommendation_cache_stats
+    from services.recommendation import get_precompute_status
+    from services.crud.route_service import get_route_data_version
+
+    stats = recommendation_cache_stats()
+    stats["data_version"] = get_route_data_version(session)
+    stats["precomputed"] = get_precompute_status()
+    return stats
+
+
 @home_route.get("/admin/api/alerts")
 async def get_alerts(request: Request, session=Depends(get_session)):
     """API для получения алертов"""
@@ -788,87 +788,39 @@ def get_user_route_sheet(session, user_external_id: str, concerts_data: list, fe
                         "intellect_category": best_route.IntellectCategory
                     }
         else:
-            # Ищем соответствие среди всех маршрутов
-            all_routes = session.exec(select(Route)).all()
+            # Ищем соответствие по общему индексу составов маршрутов: загружается только лучший маршрут
+            from services.crud.customer_match import find_superset_routes
+            found_routes = find_superset_routes(session, user_concert_ids, top_k=1)
             
-            exact_matches = []
-            partial_matches = []
-            
-            for route in all_routes:
-                try:
-                    # Парсим состав маршрута
-                    route_concert_ids = sorted([int(x.strip()) for x in route.Sostav.split(',') if x.strip()])
-                    
-                    # Проверяем точное совпадение
-                    if route_concert_ids == sorted(user_concert_ids):
-                        exact_matches.append({
-                            "id": route.id,
-                            "composition": route.Sostav,
-                            "days": route.Days,
-                            "concerts": route.Concerts,
-                            "halls": route.Halls,
-                            "genre": route.Genre,
-                            "show_time": route.ShowTime,
-                            "trans_time": route.TransTime,
-                            "wait_time": route.WaitTime,
-                            "costs": route.Costs,
-                            "comfort_score": route.ComfortScore,
-                            "comfort_level": route.ComfortLevel,
-                            "intellect_score": route.IntellectScore,
-                            "intellect_category": route.IntellectCategory
-                        })
-                    
-                    # Проверяем частичное совпадение (если есть хотя бы 2 концерта)
-                    if len(user_concert_ids) >= 2:
-                        common_concerts = set(route_concert_ids) & set(user_concert_ids)
-                        if len(common_concerts) >= 2:
-                            match_percentage = len(common_concerts) / len(user_concert_ids) * 100
-                        partial_matches.append({
-                            "id": route.id,
-                            "composition": route.Sostav,
-                            "days": route.Days,
-                            "concerts": route.Concerts,
-                            "halls": route.Halls,
-                            "genre": route.Genre,
-                            "show_time": route.ShowTime,
-                            "trans_time": route.TransTime,
-                            "wait_time": route.WaitTime,
-                            "costs": route.Costs,
-                            "comfort_score": route.ComfortScore,
-                            "comfort_level": route.ComfortLevel,
-                            "intellect_score": route.IntellectScore,
-                            "intellect_category": route.IntellectCategory,
-                            "match_percentage": match_percentage,
-                                "common_concerts": list(common_concerts)
-                        })
-                        
-                except Exception as e:
-                    logger.warning(f"Ошибка при анализе маршрута {route.id}: {e}")
-                    continue
-            
-            # Определяем тип соответствия
-            if exact_matches:
-                match_data = {
-                    "found": True,
-                    "match_type": "exact",
-                    "reason": f"Найдено {len(exact_matches)} точных совпадений",
-                    "match_percentage": 100.0,
-                    "total_routes_checked": len(all_routes),
-                    "customer_concerts": user_concert_ids,
-                    "best_route": exact_matches[0]  # Берём первый точный матч
-                }
-            elif partial_matches:
-                # Сортируем по проценту совпадения
-                partial_matches.sort(key=lambda x: x['match_percentage'], reverse=True)
-                best_partial = partial_matches[0]
+            if found_routes["routes"]:
+                best_route, match_type, match_percentage = found_routes["routes"][0]
+                if match_type == "exact":
+                    reason = "Найдено точное совпадение"
+                else:
+                    reason = f"Найдено {found_routes['total_matches']} частичных совпадений, лучшее: {match_percentage:.1f}%"
                 match_data = {
                     "found": True,
-                    "match_type": "partial",
-                    "reason": f"Найдено {len(partial_matches)} частичных совпадений, лучшее: {best_partial['match_percentage']:.1f}%",
-                    "match_percentage": best_partial['match_percentage'],
-                    "total_routes_checked": len(all_routes),
+                    "match_type": match_type,
+                    "reason": reason,
+                    "match_percentage": match_percentage,
+                    "total_routes_checked": found_routes["total_routes_checked"],
                     "customer_concerts": user_concert_ids,
-                    "best_route": {k: v for k, v in best_partial.items() if k != 'match_percentage' and k != 'common_concerts'}
+                    "best_route": {
+                        "id": best_route.id,
+                        "composition": best_route.Sostav,
+                        "days": best_route.Days,
+                        "concerts": best_route.Concerts,
+                        "halls": best_route.Halls,
+                        "genre": best_route.Genre,
+                        "show_time": best_route.ShowTime,
+                        "trans_time": best_route.TransTime,
+                        "wait_time": best_route.WaitTime,
+                        "costs": best_route.Costs,
+                        "comfort_score": best_route.ComfortScore,
+                        "comfort_level": best_route.ComfortLevel,
+                        "intellect_score": best_route.IntellectScore,
+                        "intellect_category": best_route.IntellectCategory
+                    }
                 }
             else:
                 match_data = {
@@ -876,7 +828,7 @@ def get_user_route_sheet(session, user_external_id: str, concerts_data: list, fe
                     "match_type": "no_match",
                     "reason": "Не найдено подходящих маршрутов",
                     "match_percentage": 0.0,
-                    "total_routes_checked": len(all_routes),
+                    "total_routes_checked": found_routes["total_routes_checked"],
                     "customer_concerts": user_concert_ids,
                     "best_route": None
                 }
@@ -0,0 +1,419 @@
+"""
+Полное перестроение сопоставлений покупателей с маршрутами (CustomerRouteMatch).
+
+Покупатели читаются из базы потоком и раскладываются по разделам по хэшу
+внешнего ID. Порции разделов сопоставляются пулом процессов: каждый процесс
+получает битовый индекс маршрутов один раз при запуске (при fork — общие
+страницы памяти без копирования) и возвращает готовые строки таблицы.
+Единственный писатель в основном процессе пишет строки в теневую таблицу:
+в PostgreSQL — командой COPY, в остальных СУБД — пакетным INSERT.
+
+Точечные пересчёты отдельных покупателей пишут строки через INSERT ... ON CONFLICT
+по уникальному user_external_id и в PostgreSQL ждут окончания полного перестроения
+(рекомендательная блокировка), чтобы подмена таблицы не затёрла их результат.
+"""
+import io
+import os
+import csv
+import zlib
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlmodel import Session, select
+from sqlalchemy import func, insert, text
+
+from models import Purchase
+
+logger = logging.getLogger(__name__)
+
+# Размер порции покупателей, которую сопоставляет один процесс пула
+CUSTOMER_MATCH_CHUNK_SIZE = 5000
+
+# Пул процессов запускается, только если покупателей больше этого числа
+CUSTOMER_MATCH_PARALLEL_MIN = 20000
+
+# Столбцы CustomerRouteMatch, которые заполняет перестроение (id назначает база)
+MATCH_COLUMNS = (
+    "user_external_id", "found", "match_type", "reason", "customer_concerts", "customer_concerts_count",
+    "best_route_id", "match_percentage", "total_routes_checked", "created_at", "updated_at",
+)
+
+# Ключ рекомендательной блокировки PostgreSQL записи CustomerRouteMatch:
+# полное перестроение берёт её исключительно, точечные пересчёты — разделяемо
+CUSTOMER_MATCH_LOCK_KEY = 7260417
+
+# Маркер NULL в буфере COPY: пустая строка остаётся пустой строкой (customer_concerts)
+_COPY_NULL = "\\N"
+
+# Индекс маршрутов процесса пула (задаётся инициализатором)
+_worker_index = None
+
+
+def get_customer_match_workers() -> int:
+    """Число процессов сопоставления покупателей (можно переопределить переменной CUSTOMER_MATCH_WORKERS)"""
+    workers = os.environ.get("CUSTOMER_MATCH_WORKERS")
+    return max(1, int(workers) if workers else (os.cpu_count() or 1))
+
+
+def customer_partition(user_external_id: str, partitions: int) -> int:
+    """Раздел покупателя: стабильный между процессами и запусками хэш внешнего ID"""
+    return zlib.crc32(str(user_external_id).encode("utf-8")) % partitions
+
+
+def top_superset_routes(index, concert_ids: Iterable[int], k: int) -> Tuple[np.ndarray, int]:
+    """
+    Лучшие маршруты-надмножества набора концертов: сначала кратчайшие (точное совпадение — первым),
+    при равной длине — с меньшим ID. Точное совпадение ищется по хэшу состава, надмножества —
+    пересечением списков концерт → маршруты, начиная с самого редкого концерта
+
+    Args:
+        index: Битовый индекс маршрутов (RouteBitsetIndex) с размерами составов
+        concert_ids: ID концертов покупателя
+        k: Количество маршрутов
+
+    Returns:
+        Tuple[np.ndarray, int]: Позиции не более k лучших маршрутов и общее количество надмножеств
+                                (при k == 1 и точном совпадении надмножества не перечисляются — 1)
+    """
+    concert_ids = sorted({int(concert_id) for concert_id in concert_ids})
+    if k == 1:
+        exact = index.exact_route(concert_ids)
+        if exact is not None:
+            # Маршрута короче точного совпадения не бывает; остальные надмножества не перечисляются
+            return np.array([exact], dtype=np.int64), 1
+    positions = index.routes_containing_all(concert_ids)
+    if len(positions) > k:
+        sizes = index.route_sizes[positions]
+        # Порог k-го размера за O(n), затем сортировка только отобранных; позиции упорядочены по ID маршрута
+        threshold = np.partition(sizes, k - 1)[k - 1]
+        selected = positions[sizes <= threshold]
+        best = selected[np.argsort(index.route_sizes[selected], kind='stable')[:k]]
+    else:
+        best = positions[np.argsort(index.route_sizes[positions], kind='stable')]
+    return best, len(positions)
+
+
+def best_superset_route(index, concert_ids: List[int]):
+    """
+    Лучший маршрут для набора концертов покупателя: маршрут-надмножество наименьшей длины
+    (точное совпадение, если длина равна числу концертов; при равной длине — с меньшим ID)
+
+    Args:
+        index: Битовый индекс маршрутов (RouteBitsetIndex) с размерами составов
+        concert_ids: Уникальные ID концертов покупателя
+
+    Returns:
+        Optional[Tuple[int, str, float]]: (ID маршрута, "exact" или "partial", процент совпадения) или None
+    """
+    positions, _ = top_superset_routes(index, concert_ids, 1)
+    if not len(positions):
+        return None
+    best = positions[0]
+    size = int(index.route_sizes[best])
+    match_type = "exact" if size == len(concert_ids) else "partial"
+    return int(index.route_ids[best]), match_type, (len(concert_ids) / size) * 100
+
+
+def find_superset_routes(session: Session, concert_ids: Iterable[int], top_k: int) -> Dict:
+    """
+    Маршруты-надмножества набора концертов по общему индексу составов.
+    Из базы загружаются только top_k лучших маршрутов, каталог не читается
+
+    Args:
+        session: Сессия базы данных
+        concert_ids: ID концертов покупателя
+        top_k: Количество маршрутов с подробностями
+
+    Returns:
+        Dict: routes — [(Route, "exact" или "partial", процент совпадения), ...] в порядке качества,
+              total_matches — количество всех надмножеств, total_routes_checked — размер каталога
+    """
+    from models import Route
+    from services.crud.route_service import get_route_index
+    from services.route_catalog import ordered_by_ids
+
+    concert_ids = sorted({int(concert_id) for concert_id in concert_ids})
+    index = get_route_index(session)
+    positions, total_matches = np.empty(0, dtype=np.int64), 0
+    if concert_ids:
+        positions, total_matches = top_superset_routes(index, concert_ids, top_k)
+    sizes = {int(index.route_ids[position]): int(index.route_sizes[position]) for position in positions}
+    # Подробности — только для отобранных маршрутов
+    routes = []
+    if sizes:
+        routes = ordered_by_ids(session.exec(select(Route).where(Route.id.in_(list(sizes)))).all(), list(sizes))
+    return {
+        "routes": [
+            (route, "exact" if sizes[route.id] == len(concert_ids) else "partial",
+             (len(concert_ids) / sizes[route.id]) * 100)
+            for route in routes
+        ],
+        "total_matches": total_matches,
+        "total_routes_checked": index.n_routes,
+    }
+
+
+def match_customer_row(user_external_id: str, concert_ids: Iterable[int], index,
+                       now: Optional[datetime] = None) -> Dict:
+    """
+    Строка CustomerRouteMatch для покупателя
+
+    Args:
+        user_external_id: Внешний ID покупателя
+        concert_ids: ID купленных концертов (повторы допускаются)
+        index: Битовый индекс маршрутов
+        now: Время обновления (по умолчанию текущее)
+
+    Returns:
+        Dict: Значения столбцов MATCH_COLUMNS
+    """
+    now = now or datetime.utcnow()
+    customer_concert_ids = sorted({int(concert_id) for concert_id in concert_ids or () if concert_id is not None})
+    best_match = best_superset_route(index, customer_concert_ids) if customer_concert_ids else None
+    if not customer_concert_ids:
+        reason = "У покупателя нет покупок"
+    else:
+        reason = None if best_match else "Не найдено подходящих маршрутов"
+    return {
+        "user_external_id": str(user_external_id),
+        "found": best_match is not None,
+        "match_type": best_match[1] if best_match else "none",
+        "reason": reason,
+        "customer_concerts": ",".join(map(str, customer_concert_ids)),
+        "customer_concerts_count": len(customer_concert_ids),
+        "best_route_id": best_match[0] if best_match else None,
+        "match_percentage": best_match[2] if best_match else None,
+        "total_routes_checked": index.n_routes,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def match_customers(customers: Sequence[Tuple[str, Sequence[int]]], index) -> List[Dict]:
+    """Строки CustomerRouteMatch для порции покупателей [(внешний ID, концерты), ...]"""
+    now = datetime.utcnow()
+    return [match_customer_row(user_id, concert_ids, index, now) for user_id, concert_ids in customers]
+
+
+def _init_match_worker(index) -> None:
+    global _worker_index
+    _worker_index = index
+
+
+def _match_customers_worker(customers: Sequence[Tuple[str, Sequence[int]]]) -> List[Dict]:
+    """Сопоставляет порцию покупателей в процессе пула"""
+    return match_customers(customers, _worker_index)
+
+
+def stream_customer_concerts(session: Session, batch_size: int = CUSTOMER_MATCH_CHUNK_SIZE
+                             ) -> Iterator[Tuple[str, List[int]]]:
+    """
+    Покупатели с уникальными концертами потоком, без загрузки всей выборки в память.
+    В PostgreSQL концерты собираются array_agg, в остальных СУБД — группировкой упорядоченных пар
+
+    Returns:
+        Iterator[Tuple[str, List[int]]]: (внешний ID покупателя, ID концертов)
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        rows = session.exec(
+            select(Purchase.user_external_id, func.array_agg(func.distinct(Purchase.concert_id)))
+            .group_by(Purchase.user_external_id)
+            .execution_options(yield_per=batch_size)
+        )
+        for user_id, concert_ids in rows:
+            yield user_id, concert_ids or []
+        return
+
+    rows = session.exec(
+        select(Purchase.user_external_id, Purchase.concert_id).distinct()
+        .order_by(Purchase.user_external_id, Purchase.concert_id)
+        .execution_options(yield_per=batch_size)
+    )
+    for user_id, pairs in groupby(rows, key=lambda row: row[0]):
+        yield user_id, [concert_id for _, concert_id in pairs if concert_id is not None]
+
+
+def count_customers(session: Session) -> int:
+    """Количество покупателей (для прогресса перестроения)"""
+    return session.exec(select(func.count(func.distinct(Purchase.user_external_id)))).one()
+
+
+def _partitioned_chunks(customers: Iterable[Tuple[str, Sequence[int]]], partitions: int,
+                        chunk_size: int) -> Iterator[List[Tuple[str, Sequence[int]]]]:
+    """Раскладывает поток покупателей по разделам и отдаёт заполненные порции разделов"""
+    buffers = [[] for _ in range(partitions)]
+    for user_id, concert_ids in customers:
+        buffer = buffers[customer_partition(user_id, partitions)]
+        buffer.append((str(user_id), concert_ids))
+        if len(buffer) >= chunk_size:
+            yield list(buffer)
+            buffer.clear()
+    for buffer in buffers:
+        if buffer:
+            yield buffer
+
+
+def _matched_chunks(customers: Iterable[Tuple[str, Sequence[int]]], index, workers: int,
+                    chunk_size: int) -> Iterator[List[Dict]]:
+    """
+    Сопоставляет порции покупателей (параллельно, если процессов больше одного) в порядке готовности.
+    В работе одновременно не больше 2 * workers порций, чтобы медленный писатель не накапливал строки в памяти
+    """
+    if workers <= 1:
+        for chunk in _partitioned_chunks(customers, 1, chunk_size):
+            yield match_customers(chunk, index)
+        return
+
+    chunks = _partitioned_chunks(customers, workers, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_match_worker, initargs=(index,)) as executor:
+        in_flight = set()
+        for chunk in chunks:
+            in_flight.add(executor.submit(_match_customers_worker, chunk))
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in in_flight:
+            yield future.result()
+
+
+def _copy_buffer(rows: List[Dict]) -> io.StringIO:
+    """CSV-буфер строк в формате COPY"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow([_COPY_NULL if row[column] is None else row[column] for column in MATCH_COLUMNS])
+    buffer.seek(0)
+    return buffer
+
+
+def _write_rows_postgres(session: Session, target, rows: List[Dict]) -> None:
+    """Записывает строки в таблицу target командой COPY"""
+    quoted = ", ".join(f'"{column}"' for column in MATCH_COLUMNS)
+    dbapi_connection = session.connection().connection.dbapi_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY \"{target.name}\" ({quoted}) FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')",
+            _copy_buffer(rows)
+        )
+    session.commit()
+
+
+def _write_rows_generic(session: Session, target, rows: List[Dict]) -> None:
+    """Записывает строки в таблицу target пакетным INSERT (SQLite, используемый в тестах)"""
+    session.exec(insert(target), params=rows)
+    session.commit()
+
+
+@contextmanager
+def customer_match_rebuild_lock(session: Session) -> Iterator[None]:
+    """
+    Исключительная блокировка CustomerRouteMatch на время полного перестроения (только PostgreSQL).
+    Держится на отдельном соединении вне транзакций: перестроение фиксирует запись порциями
+
+    Args:
+        session: Сессия базы данных
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        yield
+        return
+    with session.get_bind().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": CUSTOMER_MATCH_LOCK_KEY})
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": CUSTOMER_MATCH_LOCK_KEY})
+
+
+def lock_customer_matches_shared(session: Session) -> None:
+    """
+    Разделяемая блокировка CustomerRouteMatch до конца текущей транзакции (только PostgreSQL).
+    Точечный пересчёт ждёт окончания полного перестроения, но не мешает другим пересчётам
+
+    Args:
+        session: Сессия базы данных
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.exec(text("SELECT pg_advisory_xact_lock_shared(:key)"), params={"key": CUSTOMER_MATCH_LOCK_KEY})
+
+
+def upsert_customer_route_matches(session: Session, rows: List[Dict]) -> None:
+    """
+    Записывает строки CustomerRouteMatch с заменой существующих по user_external_id (INSERT ... ON CONFLICT).
+    Параллельные пересчёты одного покупателя не создают дублей
+
+    Args:
+        session: Сессия базы данных
+        rows: Строки match_customer_row
+    """
+    from models import CustomerRouteMatch
+
+    if not rows:
+        return
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+
+    table = CustomerRouteMatch.__table__
+    statement = upsert(table).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.user_external_id],
+        set_={
+            column: statement.excluded[column]
+            for column in MATCH_COLUMNS if column not in ("user_external_id", "created_at")
+        }
+    )
+    session.exec(statement)
+
+
+def fill_customer_route_matches(session: Session, target, customers: Iterable[Tuple[str, Sequence[int]]],
+                                index, total: Optional[int] = None, workers: Optional[int] = None,
+                                chunk_size: int = CUSTOMER_MATCH_CHUNK_SIZE, status_dict: Dict = None) -> int:
+    """
+    Сопоставляет покупателей с маршрутами и записывает строки в таблицу target (теневую копию CustomerRouteMatch).
+    Время зависит от длины списков маршрутов самых редких концертов покупателей, а не от размера каталога
+
+    Args:
+        session: Сессия базы данных
+        target: Таблица для записи
+        customers: Покупатели [(внешний ID, ID концертов), ...], можно потоком
+        index: Битовый индекс маршрутов
+        total: Количество покупателей для прогресса (по умолчанию len(customers), если известна)
+        workers: Число процессов (по умолчанию get_customer_match_workers(); пул запускается
+                 только для больших выборок, если число процессов не задано явно)
+        chunk_size: Размер порции покупателей
+        status_dict: Словарь статуса (matches_total, matches_progress)
+
+    Returns:
+        int: Количество обработанных покупателей
+    """
+    if total is None and hasattr(customers, "__len__"):
+        total = len(customers)
+    if workers is None:
+        workers = get_customer_match_workers() if (total or 0) > CUSTOMER_MATCH_PARALLEL_MIN else 1
+    write_rows = _write_rows_postgres if session.get_bind().dialect.name == "postgresql" else _write_rows_generic
+    logger.info(f"Сопоставление покупателей: {total if total is not None else '?'} покупателей, процессов: {workers}")
+
+    if status_dict is not None:
+        status_dict["matches_total"] = total or 0
+        status_dict["matches_progress"] = 0
+
+    processed = 0
+    for rows in _matched_chunks(customers, index, workers, chunk_size):
+        write_rows(session, target, rows)
+        processed += len(rows)
+        percent = (processed / total) * 100 if total else 100
+        logger.info(f"Сопоставлено {processed}/{total if total is not None else '?'} покупателей ({percent:.1f}%)")
+        if status_dict is not None:
+            status_dict["matches_total"] = max(total or 0, processed)
+            status_dict["matches_progress"] = processed
+
+    logger.info(f"Завершено обновление сопоставлений. Обработано {processed} покупателей")
+    return processed
@@ -6,12 +6,16 @@ from datetime import datetime, timedelta, timezone
 import pandas as pd
 from typing import Dict, List
 import logging
-import csv
 from sqlmodel import Session
 from models.route import Route
-from sqlalchemy import and_, or_, text
-import re
+from sqlalchemy import and_, or_, text, func
 from . import route_service
+from services.route_index import parse_sostav
+from .route_import import import_routes_csv, ROUTE_IMPORT_CHUNK_SIZE
+from .customer_match import (
+    count_customers, customer_match_rebuild_lock, fill_customer_route_matches, lock_customer_matches_shared,
+    match_customer_row, stream_customer_concerts, upsert_customer_route_matches
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +25,13 @@ logger = logging.getLogger(__name__)
 import os
 BATCH_SIZE = int(os.getenv('DATA_LOADER_BATCH_SIZE', '1000'))
 
+# Пересчёт сопоставлений покупателей после новых покупок: "inline" — сразу, "celery" — задачей воркера
+CUSTOMER_REMATCH_MODE = os.getenv('CUSTOMER_REMATCH_MODE', 'inline')
+# Сколько покупателей передаётся в одну задачу воркера
+CUSTOMER_REMATCH_TASK_SIZE = int(os.getenv('CUSTOMER_REMATCH_TASK_SIZE', '500'))
+# Сколько покупателей пересчитывается и фиксируется одной транзакцией
+CUSTOMER_REMATCH_CHUNK_SIZE = 500
+
 # Функция для отключения/включения внешних ключей (для PostgreSQL)
 def disable_foreign_keys(session):
     """Отключает проверку внешних ключей для ускорения загрузки"""
@@ -230,6 +241,8 @@ def load_artists(session: Session, df_artists: pd.DataFrame):
     
     count = session.exec(select(Artist)).all()
     logger.info(f"В базе теперь {len(count)} артистов")
+    # Битовые маски артистов и кэш подборок привязаны к версии каталога
+    route_service.bump_route_catalog_version(session)
 
 
 def load_compositions(session: Session, df_details: pd.DataFrame):
@@ -305,6 +318,8 @@ def load_compositions(session: Session, df_details: pd.DataFrame):
 
     count = session.exec(select(Composition)).all()
     logger.info(f"В базе теперь {len(count)} композиций")
+    # Метрики разнообразия маршрутов в каталоге зависят от программ концертов
+    route_service.bump_route_catalog_version(session)
 
 
 def load_purchases(session: Session, df_ops: pd.DataFrame):
@@ -316,6 +331,7 @@ def load_purchases(session: Session, df_ops: pd.DataFrame):
     # Группируем покупки по батчам
     total_records = len(df_ops.drop_duplicates(["OpId"]))
     processed = 0
+    new_buyers = set()
     
     for batch_start in range(0, total_records, BATCH_SIZE):
         batch_end = min(batch_start + BATCH_SIZE, total_records)
@@ -337,6 +353,13 @@ def load_purchases(session: Session, df_ops: pd.DataFrame):
             })
         
         if records:
+            # Покупатели с новыми (а не повторно загруженными) покупками — их сопоставления устарели
+            known_ops = set(session.exec(
+                select(Purchase.external_op_id)
+                .where(Purchase.external_op_id.in_([record["external_op_id"] for record in records]))
+            ).all())
+            new_buyers.update(record["user_external_id"] for record in records
+                              if record["external_op_id"] not in known_ops)
             bulk_get_or_create(session, Purchase, records, ["external_op_id"])
         
         processed += len(records)
@@ -344,175 +367,187 @@ def load_purchases(session: Session, df_ops: pd.DataFrame):
     
     count = session.exec(select(Purchase)).all()
     logger.info(f"В базе теперь {len(count)} покупок")
+    
+    # Сопоставления с маршрутами пересчитываются только для покупателей с новыми покупками
+    on_purchases_added(session, new_buyers)
 
 
-def update_customer_route_matches(session: Session):
+def update_customer_route_matches(session: Session, status_dict: Dict = None, workers: int = None) -> int:
     """
     Обновляет сопоставления покупателей с маршрутами.
     Эта функция должна вызываться после загрузки маршрутов.
+    Покупатели читаются потоком и сопоставляются пулом процессов по битовому индексу каталога,
+    строки пишутся в теневую таблицу (в PostgreSQL — командой COPY)
+
+    Args:
+        session: Сессия базы данных
+        status_dict: Словарь статуса загрузки (matches_total, matches_progress)
+        workers: Число процессов сопоставления (по умолчанию по размеру выборки)
+
+    Returns:
+        int: Количество сопоставленных покупателей
     """
     from models import CustomerRouteMatch
-    from datetime import datetime
-    from collections import defaultdict
+    from services.crud.shadow_table import shadow_table
     
     logger.info("Начинаем обновление сопоставлений покупателей с маршрутами...")
     
-    # Получаем все маршруты
-    all_routes = session.exec(select(Route)).all()
-    logger.info(f"Загружено {len(all_routes)} маршрутов")
-    
-    # Создаем оптимизированные индексы маршрутов
-    routes_by_composition = {}
-    routes_by_length = defaultdict(list)  # Группируем маршруты по длине
-    routes_by_concerts = defaultdict(list)  # Индекс по отдельным концертам
-    
-    for route in all_routes:
-        try:
-            route_concert_ids = tuple(sorted([int(x.strip()) for x in route.Sostav.split(',') if x.strip()]))
-            routes_by_composition[route_concert_ids] = route
-            routes_by_length[len(route_concert_ids)].append((route_concert_ids, route))
-            
-            # Создаем индекс по отдельным концертам для быстрого поиска
-            for concert_id in route_concert_ids:
-                routes_by_concerts[concert_id].append((route_concert_ids, route))
-        except (ValueError, AttributeError) as e:
-            logger.warning(f"Ошибка при парсинге маршрута {route.id}: {e}")
-            continue
-    
-    logger.info(f"Создано индексов: {len(routes_by_composition)} маршрутов, {len(routes_by_concerts)} уникальных концертов")
-    
-    # Получаем всех покупателей с их уникальными концертами
-    from sqlalchemy import func
-    customer_concerts = session.exec(
-        select(
-            Purchase.user_external_id,
-            func.array_agg(func.distinct(Purchase.concert_id)).label('unique_concert_ids')
-        )
-        .group_by(Purchase.user_external_id)
-    ).all()
-    
-    logger.info(f"Найдено {len(customer_concerts)} покупателей для сопоставления")
-    
-    # Очищаем старые сопоставления
-    session.exec(delete(CustomerRouteMatch))
-    session.commit()
-    logger.info("Очищены старые сопоставления")
-    
-    # Батчинг для оптимизации
-    BATCH_SIZE = 500
-    match_records = []
-    
-    # Обрабатываем каждого покупателя
-    processed = 0
-    for customer_data in customer_concerts:
-        external_id = str(customer_data[0])
-        unique_concert_ids = customer_data[1] if customer_data[1] else []
-        
-        if not unique_concert_ids:
-            # Создаем запись для покупателя без покупок
-            match_record = CustomerRouteMatch(
-                user_external_id=external_id,
-                found=False,
-                match_type="none",
-                reason="У покупателя нет покупок",
-                customer_concerts="",
-                customer_concerts_count=0,
-                total_routes_checked=len(all_routes),
-                updated_at=datetime.utcnow()
-            )
-            match_records.append(match_record)
-            processed += 1
-            continue
-        
-        # Сортируем уникальные концерты
-        customer_concert_ids = sorted(unique_concert_ids)
-        customer_concert_ids_str = ",".join(map(str, customer_concert_ids))
-        customer_concert_ids_tuple = tuple(customer_concert_ids)
-        customer_concert_ids_set = set(customer_concert_ids)
-        
-        # Ищем точные совпадения
-        exact_matches = []
-        partial_matches = []
-        
-        # Проверяем точное совпадение (O(1) операция)
-        if customer_concert_ids_tuple in routes_by_composition:
-            route = routes_by_composition[customer_concert_ids_tuple]
-            exact_matches.append({
-                "route_id": route.id,
-                "match_type": "exact",
-                "match_percentage": 100.0
-            })
-        
-        # Оптимизированный поиск частичных совпадений
-        if not exact_matches:
-            # Находим потенциальные маршруты по первому концерту
-            potential_routes = []
-            if customer_concert_ids:
-                first_concert = customer_concert_ids[0]
-                if first_concert in routes_by_concerts:
-                    potential_routes.extend(routes_by_concerts[first_concert])
-            
-            # Проверяем только потенциальные маршруты
-            for route_concert_ids_tuple, route in potential_routes:
-                if customer_concert_ids_set.issubset(set(route_concert_ids_tuple)):
-                    match_percentage = (len(customer_concert_ids) / len(route_concert_ids_tuple)) * 100
-                    partial_matches.append({
-                        "route_id": route.id,
-                        "match_type": "partial",
-                        "match_percentage": match_percentage
-                    })
-            
-            # Сортируем частичные совпадения
-            partial_matches.sort(key=lambda x: x["match_percentage"], reverse=True)
-        
-        # Определяем лучший маршрут
-        best_match = None
-        match_type = "none"
-        reason = "Не найдено подходящих маршрутов"
-        
-        if exact_matches:
-            best_match = exact_matches[0]
-            match_type = "exact"
-            reason = None
-        elif partial_matches:
-            best_match = partial_matches[0]
-            match_type = "partial"
-            reason = None
-        
-        # Создаем запись
-        match_record = CustomerRouteMatch(
-            user_external_id=external_id,
-            found=best_match is not None,
-            match_type=match_type,
-            reason=reason,
-            customer_concerts=customer_concert_ids_str,
-            customer_concerts_count=len(customer_concert_ids),
-            best_route_id=best_match["route_id"] if best_match else None,
-            match_percentage=best_match["match_percentage"] if best_match else None,
-            total_routes_checked=len(all_routes),
-            updated_at=datetime.utcnow()
+    # Списки концерт → маршруты (по возрастанию ID маршрута) и размеры составов уже построены для каталога
+    index = route_service.get_route_index(session)
+    logger.info(f"Индекс маршрутов: {index.n_routes} маршрутов, {len(index.concert_ids)} уникальных концертов")
+    
+    total = count_customers(session)
+    logger.info(f"Найдено {total} покупателей для сопоставления")
+    
+    # Покупатели читаются отдельной сессией: запись порций фиксируется, не прерывая чтение.
+    # Новые сопоставления пишутся в теневую таблицу: до подмены читатели видят прежние.
+    # Точечные пересчёты ждут подмены, иначе их результат в живой таблице был бы потерян
+    with customer_match_rebuild_lock(session), Session(session.get_bind()) as reader, \
+            shadow_table(session, CustomerRouteMatch.__table__) as shadow_matches:
+        return fill_customer_route_matches(
+            session, shadow_matches, stream_customer_concerts(reader), index,
+            total=total, workers=workers, status_dict=status_dict
         )
-        
-        match_records.append(match_record)
-        processed += 1
-        
-        # Батчинг: сохраняем записи порциями
-        if len(match_records) >= BATCH_SIZE:
-            session.add_all(match_records)
-            session.commit()
-            logger.info(f"Обработано {processed}/{len(customer_concerts)} покупателей (батч сохранен)")
-            match_records = []
-        
-        if processed % 1000 == 0:
-            logger.info(f"Обработано {processed}/{len(customer_concerts)} покупателей")
-    
-    # Сохраняем оставшиеся записи
-    if match_records:
-        session.add_all(match_records)
+
+
+def rematch_customers(session: Session, user_external_ids) -> int:
+    """
+    Пересчитывает CustomerRouteMatch только для указанных покупателей.
+    Маршруты-надмножества ищутся по битовому индексу каталога, остальные сопоставления не трогаются
+
+    Args:
+        session: Сессия базы данных
+        user_external_ids: Внешние ID покупателей
+
+    Returns:
+        int: Количество пересчитанных сопоставлений
+    """
+    from models import CustomerRouteMatch
+    from collections import defaultdict
+
+    user_external_ids = sorted({str(user_id) for user_id in user_external_ids})
+    if not user_external_ids:
+        return 0
+
+    index = route_service.get_route_index(session)
+    matched = 0
+    for start in range(0, len(user_external_ids), CUSTOMER_REMATCH_CHUNK_SIZE):
+        chunk = user_external_ids[start:start + CUSTOMER_REMATCH_CHUNK_SIZE]
+        # До конца транзакции порции полное перестроение не подменит таблицу
+        lock_customer_matches_shared(session)
+        concerts_by_user = defaultdict(set)
+        for user_id, concert_id in session.exec(
+            select(Purchase.user_external_id, Purchase.concert_id)
+            .where(Purchase.user_external_id.in_(chunk))
+        ).all():
+            if concert_id is not None:
+                concerts_by_user[str(user_id)].add(concert_id)
+
+        without_purchases = [user_id for user_id in chunk if not concerts_by_user.get(user_id)]
+        if without_purchases:
+            session.exec(delete(CustomerRouteMatch).where(CustomerRouteMatch.user_external_id.in_(without_purchases)))
+        now = datetime.utcnow()
+        rows = [
+            match_customer_row(user_id, concerts_by_user[user_id], index, now)
+            for user_id in chunk if concerts_by_user.get(user_id)
+        ]
+        # Запись по уникальному user_external_id: параллельные пересчёты не создают дублей
+        upsert_customer_route_matches(session, rows)
         session.commit()
-        logger.info(f"Сохранен финальный батч из {len(match_records)} записей")
-    
-    logger.info(f"Завершено обновление сопоставлений. Обработано {processed} покупателей")
+        matched += len(rows)
+
+    logger.info(f"Пересчитаны сопоставления {matched} покупателей")
+    return matched
+
+
+def on_purchases_added(session: Session, user_external_ids) -> int:
+    """
+    Обновляет сопоставления с маршрутами покупателей, у которых появились новые покупки.
+    В режиме CUSTOMER_REMATCH_MODE=celery пересчёт ставится в очередь воркера,
+    иначе (и если очередь недоступна) выполняется сразу
+
+    Args:
+        session: Сессия базы данных
+        user_external_ids: Внешние ID покупателей с новыми покупками
+
+    Returns:
+        int: Количество сопоставлений, пересчитанных сразу (0, если пересчёт поставлен в очередь)
+    """
+    user_external_ids = sorted({str(user_id) for user_id in user_external_ids})
+    if not user_external_ids:
+        return 0
+    # Пока маршрутов нет, сопоставлять не с чем: все сопоставления построит загрузка маршрутов
+    if not session.exec(select(Route.id).limit(1)).first():
+        logger.info(f"Маршруты не загружены, пересчёт сопоставлений {len(user_external_ids)} покупателей пропущен")
+        return 0
+
+    if CUSTOMER_REMATCH_MODE == "celery":
+        try:
+            from worker.tasks import rematch_customers_task
+            for start in range(0, len(user_external_ids), CUSTOMER_REMATCH_TASK_SIZE):
+                rematch_customers_task.delay(user_external_ids[start:start + CUSTOMER_REMATCH_TASK_SIZE])
+            logger.info(f"Пересчёт сопоставлений {len(user_external_ids)} покупателей поставлен в очередь")
+            return 0
+        except Exception as e:
+            logger.error(f"Не удалось поставить пересчёт сопоставлений в очередь, пересчитываем сразу: {e}")
+
+    try:
+        return rematch_customers(session, user_external_ids)
+    except Exception as e:
+        logger.error(f"Ошибка при пересчёте сопоставлений покупателей: {e}")
+        session.rollback()
+        return 0
+
+
+def customers_affected_by_routes(session: Session, route_ids) -> List[str]:
+    """
+    Находит покупателей, для которых указанные маршруты могут стать совпадением:
+    все купленные ими концерты входят в состав одного из этих маршрутов
+
+    Args:
+        session: Сессия базы данных
+        route_ids: ID маршрутов (например, добавленных при повторной загрузке)
+
+    Returns:
+        List[str]: Внешние ID покупателей
+    """
+    from collections import defaultdict
+
+    route_ids = sorted(set(route_ids))
+    compositions_by_concert = defaultdict(list)
+    for start in range(0, len(route_ids), 500):
+        for _, sostav_ids, sostav in session.exec(
+            select(Route.id, Route.SostavIds, Route.Sostav).where(Route.id.in_(route_ids[start:start + 500]))
+        ).all():
+            composition = frozenset(sostav_ids if sostav_ids is not None else parse_sostav(sostav))
+            for concert_id in composition:
+                compositions_by_concert[concert_id].append(composition)
+    if not compositions_by_concert:
+        return []
+
+    # Кандидаты — покупатели хотя бы одного концерта из составов этих маршрутов
+    concert_ids = sorted(compositions_by_concert)
+    candidates = set()
+    for start in range(0, len(concert_ids), 500):
+        candidates.update(session.exec(
+            select(Purchase.user_external_id).where(Purchase.concert_id.in_(concert_ids[start:start + 500])).distinct()
+        ).all())
+
+    candidates = sorted(candidates)
+    concerts_by_user = defaultdict(set)
+    for start in range(0, len(candidates), 500):
+        for user_id, concert_id in session.exec(
+            select(Purchase.user_external_id, Purchase.concert_id)
+            .where(Purchase.user_external_id.in_(candidates[start:start + 500]))
+        ).all():
+            if concert_id is not None:
+                concerts_by_user[user_id].add(concert_id)
+
+    affected = [
+        str(user_id) for user_id, concerts in concerts_by_user.items()
+        if concerts and any(concerts <= composition for composition in compositions_by_concert.get(min(concerts), ()))
+    ]
+    return sorted(affected)
 
 
 def load_genres(session: Session):
@@ -659,7 +694,39 @@ def load_all_data(session: Session, df_halls: pd.DataFrame, df_concerts: pd.Data
             enable_foreign_keys(session)
 
 
-def load_routes_from_csv(session: Session, path: str, batch_size: int = 1000, status_dict=None):
+def _apply_route_catalog_delta(session: Session, result: Dict):
+    """
+    Обновляет зависимые данные только для добавленных, изменённых и удалённых маршрутов
+
+    Args:
+        session: Сессия базы данных
+        result: Результат import_routes_csv
+    """
+    added_ids, changed_ids, removed_ids = result["added_ids"], result["changed_ids"], result["removed_ids"]
+    if not (added_ids or changed_ids or removed_ids):
+        logger.info("Каталог маршрутов не изменился — обновление зависимых данных не требуется")
+        return
+
+    # Удаляем маршруты, которых нет в файле; их покупатели будут сопоставлены заново
+    affected_customers = set(route_service.delete_routes(session, removed_ids))
+    if added_ids or removed_ids:
+        update_routes_count_cache(session)
+    route_service.bump_route_catalog_version(session)
+
+    # Доступность и состав — только для добавленных и изменённых маршрутов
+    route_service.on_routes_changed(session, added_ids + changed_ids)
+
+    # Метрики изменённых маршрутов на сопоставление не влияют, новые маршруты могут стать совпадением
+    try:
+        affected_customers.update(customers_affected_by_routes(session, added_ids))
+        rematch_customers(session, affected_customers)
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении сопоставлений покупателей: {e}")
+    logger.info(f"Применены изменения каталога: +{len(added_ids)} ~{len(changed_ids)} -{len(removed_ids)}, пересчитано покупателей: {len(affected_customers)}")
+
+
+def load_routes_from_csv(session: Session, path: str, batch_size: int = None, status_dict=None,
+                         remove_missing: bool = True):
     import os
     import logging
     logger = logging.getLogger(__name__)
@@ -669,116 +736,63 @@ def load_routes_from_csv(session: Session, path: str, batch_size: int = 1000, st
             status_dict["error"] = f"Файл {path} не найден"
             status_dict["in_progress"] = False
         return {"added": 0, "updated": 0, "skipped": 0}
-    added, updated, skipped = 0, 0, 0
-    # Считаем общее количество строк для прогресса
-    with open(path, newline='', encoding='utf-8') as csvfile:
-        import csv
-        total_lines = sum(1 for _ in csvfile) - 1  # -1 для заголовка
-    if status_dict is not None:
-        status_dict["total"] = total_lines
-        status_dict["progress"] = 0
-        status_dict["added"] = 0
-        status_dict["updated"] = 0
-        status_dict["error"] = None
-    with open(path, newline='', encoding='utf-8') as csvfile:
-        import csv
-        reader = csv.DictReader(csvfile)
-        batch = []
-        for i, row in enumerate(reader, 1):
-            sostav_raw = row.get('Sostav', '')
-            concerts_list = re.findall(r'\d+', sostav_raw)
-            concerts_sorted = ','.join(sorted(concerts_list, key=str))
-            existing_route = session.exec(select(Route).where(Route.Sostav == concerts_sorted)).first()
-            if existing_route:
-                for field in Route.__fields__:
-                    if field == 'id' or field == 'Sostav':
-                        continue
-                    value = row.get(field)
-                    if value is not None:
-                        field_type = Route.__fields__[field].annotation if hasattr(Route, '__fields__') else None
-                        if field_type in [int, float]:
-                            try:
-                                value = field_type(value)
-                            except Exception:
-                                pass
-                        setattr(existing_route, field, value)
-                session.add(existing_route)
-                updated += 1
-            else:
-                route_kwargs = {k: v for k, v in row.items()}
-                route_kwargs['Sostav'] = concerts_sorted
-                for field in Route.__fields__:
-                    if field in route_kwargs and route_kwargs[field] is not None:
-                        field_type = Route.__fields__[field].annotation if hasattr(Route, '__fields__') else None
-                        if field_type in [int, float]:
-                            try:
-                                route_kwargs[field] = field_type(route_kwargs[field])
-                            except Exception:
-                                pass
-                route = Route(**route_kwargs)
-                batch.append(route)
-            if len(batch) >= batch_size:
-                session.add_all(batch)
-                session.commit()
-                added += len(batch)
-                batch = []
-            # Логируем прогресс каждые 1000 строк
-            if i % 1000 == 0 or i == total_lines:
-                percent = (i / total_lines) * 100 if total_lines > 0 else 100
-                logger.info(f"Обработано {i}/{total_lines} маршрутов ({percent:.1f}%)")
-                if status_dict is not None:
-                    status_dict["progress"] = i
-                    status_dict["added"] = added
-                    status_dict["updated"] = updated
-        if batch:
-            session.add_all(batch)
-            session.commit()
-            added += len(batch)
-        session.commit()
-        
+    # Повторная загрузка: применяется только разница с текущим каталогом
+    had_routes = session.exec(select(Route.id).limit(1)).first() is not None
+
+    # Потоковый импорт: порции CSV сливаются с route по составу маршрута
+    result = import_routes_csv(
+        session, path, chunk_size=batch_size or ROUTE_IMPORT_CHUNK_SIZE, status_dict=status_dict,
+        find_removed=had_routes and remove_missing
+    )
+    added, updated, skipped = result["added"], result["updated"], result["skipped"]
+
+    if had_routes:
+        _apply_route_catalog_delta(session, result)
+    else:
         # Обновляем кэш количества маршрутов
         update_routes_count_cache(session)
-        
+
+        # Каталог изменился — индексы маршрутов во всех процессах должны перестроиться
+        route_service.bump_route_catalog_version(session)
+        # Состав маршрутов для SQL-проверки доступности
+        route_service.rebuild_route_concert_links(session)
+
         # Инициализируем или обновляем AvailableRoute
         logger.info("Обновляем AvailableRoute после загрузки маршрутов...")
         try:
-            # Проверяем и инициализируем AvailableRoute (если нужно)
-            was_initialized = route_service.ensure_available_routes_exist(session)
-            
-            # Получаем статистику
-            stats = route_service.get_available_routes_stats(session)
-            logger.info(f"AvailableRoute обновлены: {stats['available_routes']} доступных из {stats['total_routes']} маршрутов ({stats['availability_percentage']}%)")
-            
-            # Инициализируем кэши только если AvailableRoute не были созданы заново
-            if not was_initialized:
-                route_service.init_available_routes_cache(session)
-                route_service.init_available_concerts_cache(session)
+            # Перестраиваем AvailableRoute в теневой таблице (обновляет и кэши количества)
+            route_service.rebuild_available_routes(session)
         except Exception as e:
             logger.error(f"Ошибка при обновлении AvailableRoute: {e}")
-        
+    
         # Обновляем сопоставления покупателей с маршрутами
         logger.info("Обновляем сопоставления покупателей с маршрутами...")
         try:
-            update_customer_route_matches(session)
+            update_customer_route_matches(session, status_dict=status_dict)
             logger.info("Сопоставления покупателей с маршрутами обновлены успешно")
         except Exception as e:
             logger.error(f"Ошибка при обновлении сопоставлений покупателей: {e}")
-        
+    
     if status_dict is not None:
-        status_dict["progress"] = total_lines
         status_dict["added"] = added
         status_dict["updated"] = updated
         status_dict["in_progress"] = False
-    logger.info(f"[load_routes_from_csv] Загружено маршрутов: добавлено {added}, обновлено {updated}")
-    return {"added": added, "updated": updated, "skipped": skipped}
+    logger.info(f"[load_routes_from_csv] Загружено маршрутов: добавлено {added}, обновлено {updated}, удалено {result['removed']}")
+    return {
+        "added": added,
+        "updated": updated,
+        "skipped": skipped,
+        "unchanged": result["unchanged"],
+        "removed": result["removed"],
+        "delta_applied": had_routes
+    }
 
 
 def update_routes_count_cache(session: Session):
     """Обновляет кэшированное количество маршрутов в таблице Statistics"""
     try:
         # Подсчитываем актуальное количество маршрутов
-        routes = session.exec(select(Route)).all()
-        routes_count = len(routes)
+        routes_count = session.exec(select(func.count(Route.id))).one()
         
         # Ищем существующую запись или создаём новую
         stats_record = session.exec(
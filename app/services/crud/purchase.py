@@ -8,11 +8,14 @@ from sqlalchemy import func
 from models.hall import Hall
 from models.statistics import Statistics
 from models import Route
+from services.crud.customer_match import find_superset_routes
+from services.route_index import route_concert_ids as route_concert_ids_of
 from models.artist import Artist, ConcertArtistLink
 from models.composition import Author, Composition, ConcertCompositionLink
 from models.genre import Genre
 import logging
 import time
+import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +24,12 @@ _route_statistics_cache = None
 _route_statistics_cache_time = None
 _route_statistics_cache_ttl = 300  # 5 минут
 
+# Сколько маршрутов с подробностями возвращает find_customer_route_match
+ROUTE_MATCH_TOP_K = 10
+
+# Сколько популярных маршрутов попадает в статистику
+ROUTE_STATISTICS_TOP_N = 20
+
 
 def get_user_purchased_concerts(session: Session, user_external_id: str) -> List[Concert]:
     """
@@ -393,13 +402,36 @@ def get_cached_off_program_count(session: Session) -> int:
         return 0
 
 
-def find_customer_route_match(session: Session, user_external_id: str) -> dict:
+def _route_match_details(route: Route) -> dict:
+    """Подробности маршрута для результата find_customer_route_match"""
+    return {
+        "route_id": route.id,
+        "route_composition": route.Sostav,
+        "route_days": route.Days,
+        "route_concerts": route.Concerts,
+        "route_halls": route.Halls,
+        "route_genre": route.Genre,
+        "route_show_time": route.ShowTime,
+        "route_trans_time": route.TransTime,
+        "route_wait_time": route.WaitTime,
+        "route_costs": route.Costs,
+        "route_comfort_score": route.ComfortScore,
+        "route_comfort_level": route.ComfortLevel,
+        "route_intellect_score": route.IntellectScore,
+        "route_intellect_category": route.IntellectCategory,
+    }
+
+
+def find_customer_route_match(session: Session, user_external_id: str, top_k: int = ROUTE_MATCH_TOP_K) -> dict:
     """
     Находит соответствие между покупками покупателя и маршрутами.
+    Маршруты ищутся по общему индексу составов (хэш состава для точного совпадения,
+    списки концерт → маршруты для надмножеств); подробности загружаются только для top_k лучших
     
     Args:
         session: Сессия базы данных
         user_external_id: Внешний ID пользователя (ClientId)
+        top_k: Количество маршрутов в matched_routes
         
     Returns:
         Словарь с информацией о найденном маршруте или причинах отсутствия соответствия
@@ -418,98 +450,38 @@ def find_customer_route_match(session: Session, user_external_id: str) -> dict:
     # Сортируем концерты по дате и получаем их ID
     customer_concert_ids = sorted([c.id for c in concerts])
     customer_concert_ids_str = ",".join(map(str, customer_concert_ids))
-    
-    # Получаем все маршруты
-    all_routes = session.exec(select(Route)).all()
-    
-    # Ищем точные совпадения
-    exact_matches = []
-    partial_matches = []
-    
-    for route in all_routes:
-        try:
-            # Парсим состав маршрута
-            route_concert_ids = sorted([int(x.strip()) for x in route.Sostav.split(',') if x.strip()])
-            
-            # Проверяем точное совпадение
-            if route_concert_ids == customer_concert_ids:
-                exact_matches.append({
-                    "route_id": route.id,
-                    "route_composition": route.Sostav,
-                    "route_days": route.Days,
-                    "route_concerts": route.Concerts,
-                    "route_halls": route.Halls,
-                    "route_genre": route.Genre,
-                    "route_show_time": route.ShowTime,
-                    "route_trans_time": route.TransTime,
-                    "route_wait_time": route.WaitTime,
-                    "route_costs": route.Costs,
-                    "route_comfort_score": route.ComfortScore,
-                    "route_comfort_level": route.ComfortLevel,
-                    "route_intellect_score": route.IntellectScore,
-                    "route_intellect_category": route.IntellectCategory,
-                    "match_type": "exact",
-                    "match_percentage": 100.0
-                })
-            
-            # Проверяем частичное совпадение (если покупатель купил подмножество концертов маршрута)
-            elif set(customer_concert_ids).issubset(set(route_concert_ids)):
-                match_percentage = (len(customer_concert_ids) / len(route_concert_ids)) * 100
-                partial_matches.append({
-                    "route_id": route.id,
-                    "route_composition": route.Sostav,
-                    "route_days": route.Days,
-                    "route_concerts": route.Concerts,
-                    "route_halls": route.Halls,
-                    "route_genre": route.Genre,
-                    "route_show_time": route.ShowTime,
-                    "route_trans_time": route.TransTime,
-                    "route_wait_time": route.WaitTime,
-                    "route_costs": route.Costs,
-                    "route_comfort_score": route.ComfortScore,
-                    "route_comfort_level": route.ComfortLevel,
-                    "route_intellect_score": route.IntellectScore,
-                    "route_intellect_category": route.IntellectCategory,
-                    "match_type": "partial",
-                    "match_percentage": match_percentage,
-                    "missing_concerts": list(set(route_concert_ids) - set(customer_concert_ids))
-                })
-                
-        except (ValueError, AttributeError) as e:
-            logger.warning(f"Ошибка при парсинге маршрута {route.id}: {e}")
-            continue
-    
-    # Сортируем частичные совпадения по проценту совпадения
-    partial_matches.sort(key=lambda x: x["match_percentage"], reverse=True)
-    
-    # Формируем результат
-    if exact_matches:
-        return {
-            "found": True,
-            "match_type": "exact",
-            "customer_concerts": customer_concert_ids,
-            "customer_concerts_str": customer_concert_ids_str,
-            "matched_routes": exact_matches,
-            "best_match": exact_matches[0]
-        }
-    elif partial_matches:
-        return {
-            "found": True,
-            "match_type": "partial",
-            "customer_concerts": customer_concert_ids,
-            "customer_concerts_str": customer_concert_ids_str,
-            "matched_routes": partial_matches,
-            "best_match": partial_matches[0]
-        }
-    else:
+    customer_concert_ids_set = set(customer_concert_ids)
+    
+    # Лучшие маршруты-надмножества: точные совпадения первыми, затем по убыванию процента совпадения
+    found = find_superset_routes(session, customer_concert_ids, top_k)
+    matched_routes = []
+    for route, match_type, match_percentage in found["routes"]:
+        match = {**_route_match_details(route), "match_type": match_type, "match_percentage": match_percentage}
+        if match_type == "partial":
+            match["missing_concerts"] = sorted(set(route_concert_ids_of(route)) - customer_concert_ids_set)
+        matched_routes.append(match)
+    
+    if not matched_routes:
         return {
             "found": False,
             "reason": "Не найдено подходящих маршрутов",
             "customer_concerts": customer_concert_ids,
             "customer_concerts_str": customer_concert_ids_str,
             "matched_routes": [],
-            "total_routes_checked": len(all_routes)
+            "total_routes_checked": found["total_routes_checked"]
         }
+    
+    best_match = matched_routes[0]
+    return {
+        "found": True,
+        "match_type": best_match["match_type"],
+        "customer_concerts": customer_concert_ids,
+        "customer_concerts_str": customer_concert_ids_str,
+        # Точные совпадения не смешиваются с частичными
+        "matched_routes": [match for match in matched_routes if match["match_type"] == best_match["match_type"]],
+        "best_match": best_match,
+        "total_matches": found["total_matches"]
+    }
 
 
 def get_all_customers_route_matches(session: Session) -> dict:
@@ -545,18 +517,142 @@ def get_all_customers_route_matches(session: Session) -> dict:
     return results
 
 
-def get_route_statistics(session: Session, force_refresh: bool = False) -> dict:
+def _empty_route_statistics(error: Optional[str] = None) -> dict:
+    """Пустая статистика маршрутов (нет покупок или ошибка расчёта)"""
+    cache_info = {'cached': False, 'calculation_time': 0}
+    if error is not None:
+        cache_info['error'] = error
+    return {
+        'total_purchases': 0,
+        'unique_routes': 0,
+        'active_users': 0,
+        'avg_popularity': 0,
+        'popular_routes': [],
+        'daily_stats': [],
+        'matched_customers': 0,
+        'unmatched_customers': 0,
+        'cache_info': cache_info
+    }
+
+
+def _timestamp_or_none(value) -> Optional[datetime]:
+    return None if pd.isna(value) else pd.Timestamp(value).to_pydatetime()
+
+
+def compute_route_statistics(session: Session, top_n: int = ROUTE_STATISTICS_TOP_N) -> dict:
     """
-    Возвращает статистику популярности маршрутов среди покупателей
-    Использует кэширование для улучшения производительности
-    
+    Считает статистику популярности маршрутов одним сгруппированным проходом:
+    покупки агрегируются в SQL (GROUP BY покупатель и концерт), сопоставления берутся
+    из CustomerRouteMatch, популярность маршрутов, даты последних покупок и статистика
+    по дням считаются векторно в pandas
+
     Args:
         session: Сессия базы данных
-        force_refresh: Принудительно обновить кэш
-        
+        top_n: Количество популярных маршрутов с подробностями
+
     Returns:
-        Словарь со статистикой маршрутов
+        Словарь со статистикой маршрутов (без cache_info)
     """
+    from models import CustomerRouteMatch
+
+    # Покупки: одна строка на пару покупатель–концерт с количеством и последней датой покупки
+    purchases = pd.DataFrame(
+        session.exec(
+            select(Purchase.user_external_id, Purchase.concert_id,
+                   func.count(Purchase.id), func.max(Purchase.purchased_at))
+            .group_by(Purchase.user_external_id, Purchase.concert_id)
+        ).all(),
+        columns=['user_external_id', 'concert_id', 'purchases', 'last_purchase']
+    )
+    if purchases.empty:
+        return _empty_route_statistics()
+    purchases['last_purchase'] = pd.to_datetime(purchases['last_purchase'])
+    total_purchases = int(purchases['purchases'].sum())
+    users = purchases.groupby('user_external_id')['last_purchase'].max()
+    active_users = len(users)
+
+    matches = pd.DataFrame(
+        session.exec(select(CustomerRouteMatch.user_external_id, CustomerRouteMatch.found,
+                            CustomerRouteMatch.best_route_id).order_by(CustomerRouteMatch.id)).all(),
+        columns=['user_external_id', 'found', 'best_route_id']
+    )
+    # user_external_id уникален; повторы возможны только в строках, оставшихся с тех пор, когда
+    # ensure_route_indexes ещё не удалил их при создании уникального индекса: учитывается последняя запись
+    matches = matches.drop_duplicates('user_external_id', keep='last')
+    matched = matches[matches['found'].astype(bool) & matches['best_route_id'].notna()].copy()
+    matched['best_route_id'] = matched['best_route_id'].astype('int64')
+    matched_customers = len(matched)
+    unmatched_customers = len(matches) - matched_customers
+
+    # Популярность маршрутов и последняя покупка среди покупателей маршрута
+    matched['last_purchase'] = matched['user_external_id'].map(users)
+    popularity = (
+        matched.groupby('best_route_id')
+        .agg(customers=('user_external_id', 'size'), last_purchase=('last_purchase', 'max'))
+        .reset_index()
+        .sort_values(['customers', 'best_route_id'], ascending=[False, True], kind='stable')
+    )
+    top = popularity.head(top_n)
+    top_route_ids = top['best_route_id'].astype(int).tolist()
+    routes = {
+        route.id: route for route in session.exec(select(Route).where(Route.id.in_(top_route_ids))).all()
+    } if top_route_ids else {}
+
+    popular_routes = []
+    for route_id, customers, last_purchase in zip(top_route_ids, top['customers'].tolist(), top['last_purchase']):
+        route = routes.get(route_id)
+        popular_routes.append({
+            'route_id': route_id,
+            'route_name': f"Маршрут {route_id}",
+            'purchase_count': int(customers),
+            'percentage': (customers / active_users * 100) if active_users > 0 else 0,
+            'last_purchase': _timestamp_or_none(last_purchase),
+            'status': 'available',
+            'route_details': {
+                'days': route.Days if route else None,
+                'concerts': route.Concerts if route else None,
+                'halls': route.Halls if route else None,
+                'genre': route.Genre if route else None,
+                'comfort_score': route.ComfortScore if route else None,
+                'intellect_score': route.IntellectScore if route else None
+            }
+        })
+
+    # Статистика по дням фестиваля: покупки концертов дня и маршруты их покупателей
+    concerts = pd.DataFrame(session.exec(select(Concert.id, Concert.datetime)).all(), columns=['concert_id', 'datetime'])
+    concerts = concerts[concerts['datetime'].notna()]
+    concerts['date'] = pd.to_datetime(concerts['datetime']).dt.date
+    day_purchases = purchases.merge(concerts[['concert_id', 'date']], on='concert_id', how='inner')
+    day_purchases['best_route_id'] = day_purchases['user_external_id'].map(
+        matched.set_index('user_external_id')['best_route_id']
+    )
+    per_day = day_purchases.groupby('date').agg(purchases=('purchases', 'sum'), routes=('best_route_id', 'nunique'))
+
+    daily_stats = []
+    for day_num, day_date in enumerate(sorted(concerts['date'].unique()), 1):
+        purchases_count = int(per_day['purchases'].get(day_date, 0))
+        daily_stats.append({
+            'day': day_num,
+            'date': day_date,
+            'purchases': purchases_count,
+            'routes': int(per_day['routes'].get(day_date, 0)),
+            'popularity': (purchases_count / total_purchases * 100) if total_purchases > 0 else 0
+        })
+
+    return {
+        'total_purchases': total_purchases,
+        'unique_routes': len(popularity),
+        'active_users': active_users,
+        'avg_popularity': float(popularity['customers'].mean()) if len(popularity) else 0,
+        'popular_routes': popular_routes,
+        'daily_stats': daily_stats,
+        'matched_customers': matched_customers,
+        'unmatched_customers': unmatched_customers,
+    }
+
+
+def _cached_route_statistics(session: Session, force_refresh: bool = False) -> dict:
+    """Статистика маршрутов из кэша процесса или пересчитанная compute_route_statistics"""
     global _route_statistics_cache, _route_statistics_cache_time
     
     # Проверяем кэш
@@ -573,577 +669,51 @@ def get_route_statistics(session: Session, force_refresh: bool = False) -> dict:
     start_time = time.time()
     
     try:
-        # Получаем данные о соответствии маршрутов для всех покупателей
-        customers_data = get_all_customers_route_matches(session)
-        
-        if not customers_data['customers_data']:
-            result = {
-                'total_purchases': 0,
-                'unique_routes': 0,
-                'active_users': 0,
-                'avg_popularity': 0,
-                'popular_routes': [],
-                'daily_stats': [],
-                'matched_customers': 0,
-                'unmatched_customers': 0,
-                'cache_info': {
-                    'cached': False,
-                    'calculation_time': 0
-                }
-            }
-            
-            # Сохраняем в кэш
-            _route_statistics_cache = result
-            _route_statistics_cache_time = current_time
-            
-            return result
-        
-        # Подсчитываем популярность маршрутов
-        route_popularity = {}
-        route_details = {}
-        route_last_purchase = {}
-        
-        # Получаем все покупки для определения дат
-        purchases_query = (
-            select(Purchase.user_external_id, Purchase.concert_id, Purchase.purchased_at)
-            .order_by(Purchase.purchased_at)
-        )
-        purchases = session.exec(purchases_query).all()
-        
-        # Создаем словарь последних покупок пользователей
-        user_last_purchase = {}
-        for purchase in purchases:
-            user_id = purchase.user_external_id
-            if user_id not in user_last_purchase or purchase.purchased_at > user_last_purchase[user_id]:
-                user_last_purchase[user_id] = purchase.purchased_at
-        
-        # Анализируем данные о соответствии маршрутов
-        for customer_data in customers_data['customers_data']:
-            if customer_data['found'] and customer_data['matched_routes']:
-                # Берем лучший маршрут для этого покупателя
-                best_match = customer_data['best_match']
-                route_id = best_match['route_id']
-                
-                # Увеличиваем счетчик популярности маршрута
-                if route_id not in route_popularity:
-                    route_popularity[route_id] = 0
-                    route_details[route_id] = best_match
-                route_popularity[route_id] += 1
-                
-                # Обновляем дату последней покупки для маршрута
-                # Находим пользователя по его концертам
-                for purchase in purchases:
-                    user_concerts = [p.concert_id for p in purchases if p.user_external_id == purchase.user_external_id]
-                    if set(user_concerts) == set(customer_data['customer_concerts']):
-                        user_id = purchase.user_external_id
-                        if user_id in user_last_purchase:
-                            if route_id not in route_last_purchase or user_last_purchase[user_id] > route_last_purchase[route_id]:
-                                route_last_purchase[route_id] = user_last_purchase[user_id]
-                        break
-        
-        # Сортируем маршруты по популярности
-        sorted_routes = sorted(route_popularity.items(), key=lambda x: x[1], reverse=True)
-        
-        # Подготавливаем данные для топ маршрутов
-        popular_routes = []
-        total_customers = customers_data['total_customers']
-        
-        for route_id, customer_count in sorted_routes[:20]:  # Топ 20 маршрутов
-            route_detail = route_details[route_id]
-            percentage = (customer_count / total_customers * 100) if total_customers > 0 else 0
-            
-            popular_routes.append({
-                'route_id': route_id,
-                'route_name': f"Маршрут {route_id}",
-                'purchase_count': customer_count,
-                'percentage': percentage,
-                'last_purchase': route_last_purchase.get(route_id),
-                'status': 'available',  # Все найденные маршруты доступны
-                'route_details': {
-                    'days': route_detail.get('route_days'),
-                    'concerts': route_detail.get('route_concerts'),
-                    'halls': route_detail.get('route_halls'),
-                    'genre': route_detail.get('route_genre'),
-                    'comfort_score': route_detail.get('route_comfort_score'),
-                    'intellect_score': route_detail.get('route_intellect_score')
-                }
-            })
-        
-        # Статистика по дням (упрощенная версия для ускорения)
-        daily_stats = []
-        
-        # Получаем уникальные даты концертов
-        concert_dates = session.exec(
-            select(Concert.datetime)
-            .distinct()
-            .order_by(Concert.datetime)
-        ).all()
-        
-        # Группируем концерты по дням
-        concerts_by_day = {}
-        for concert_datetime in concert_dates:
-            if concert_datetime:
-                day_date = concert_datetime.date()
-                if day_date not in concerts_by_day:
-                    concerts_by_day[day_date] = []
-                concerts_by_day[day_date].append(concert_datetime)
-        
-        # Анализируем статистику по дням
-        for day_num, (day_date, day_concerts) in enumerate(concerts_by_day.items(), 1):
-            day_concert_ids = [c.id for c in day_concerts]
-            day_purchases = 0
-            day_routes = set()
-            
-            # Считаем покупки и маршруты для этого дня
-            for customer_data in customers_data['customers_data']:
-                if customer_data['found']:
-                    # Проверяем, есть ли у покупателя концерты в этот день
-                    customer_day_concerts = [cid for cid in customer_data['customer_concerts'] if cid in day_concert_ids]
-                    if customer_day_concerts:
-                        day_purchases += len(customer_day_concerts)
-                        
-                        # Добавляем маршрут в статистику дня
-                        if customer_data['matched_routes']:
-                            best_match = customer_data['best_match']
-                            day_routes.add(best_match['route_id'])
-            
-            # Вычисляем популярность дня
-            total_purchases = sum(route_popularity.values())
-            day_popularity = (day_purchases / total_purchases * 100) if total_purchases > 0 else 0
-            
-            daily_stats.append({
-                'day': day_num,
-                'date': day_date,
-                'purchases': day_purchases,
-                'routes': len(day_routes),
-                'popularity': day_popularity
-            })
-        
-        calculation_time = time.time() - start_time
-        logger.info(f"Статистика маршрутов рассчитана за {calculation_time:.2f} секунд")
-        
-        result = {
-            'total_purchases': len(purchases),
-            'unique_routes': len(route_popularity),
-            'active_users': total_customers,
-            'avg_popularity': sum(route_popularity.values()) / len(route_popularity) if route_popularity else 0,
-            'popular_routes': popular_routes,
-            'daily_stats': daily_stats,
-            'matched_customers': customers_data['matched_customers'],
-            'unmatched_customers': customers_data['unmatched_customers'],
-            'cache_info': {
-                'cached': True,
-                'calculation_time': calculation_time
-            }
-        }
-        
-        # Сохраняем в кэш
-        _route_statistics_cache = result
-        _route_statistics_cache_time = current_time
-        
-        return result
-        
+        result = compute_route_statistics(session)
     except Exception as e:
         logger.error(f"Ошибка при получении статистики маршрутов: {e}")
-        return {
-            'total_purchases': 0,
-            'unique_routes': 0,
-            'active_users': 0,
-            'avg_popularity': 0,
-            'popular_routes': [],
-            'daily_stats': [],
-            'matched_customers': 0,
-            'unmatched_customers': 0,
-            'cache_info': {
-                'cached': False,
-                'calculation_time': 0,
-                'error': str(e)
-            }
-        }
+        return _empty_route_statistics(str(e))
+    
+    calculation_time = time.time() - start_time
+    logger.info(f"Статистика маршрутов рассчитана за {calculation_time:.2f} секунд")
+    result['cache_info'] = {
+        'cached': result['total_purchases'] > 0,
+        'calculation_time': calculation_time
+    }
+    
+    # Сохраняем в кэш
+    _route_statistics_cache = result
+    _route_statistics_cache_time = current_time
+    return result
+
+
+def get_route_statistics(session: Session, force_refresh: bool = False) -> dict:
+    """
+    Возвращает статистику популярности маршрутов среди покупателей
+    Использует кэширование для улучшения производительности
+    
+    Args:
+        session: Сессия базы данных
+        force_refresh: Принудительно обновить кэш
+        
+    Returns:
+        Словарь со статистикой маршрутов
+    """
+    return _cached_route_statistics(session, force_refresh)
 
 
 def get_route_statistics_fast(session: Session, force_refresh: bool = False) -> dict:
     """
     Быстрая версия статистики маршрутов через SQL-запросы
     """
-    global _route_statistics_cache, _route_statistics_cache_time
-    
-    # Проверяем кэш
-    current_time = time.time()
-    if (not force_refresh and 
-        _route_statistics_cache is not None and 
-        _route_statistics_cache_time is not None and
-        current_time - _route_statistics_cache_time < _route_statistics_cache_ttl):
-        
-        logger.info("Возвращаем статистику маршрутов из кэша")
-        return _route_statistics_cache
-    
-    logger.info("Начинаем быстрый расчет статистики маршрутов...")
-    start_time = time.time()
-    
-    try:
-        # 1. Базовая статистика покупок
-        total_purchases = session.exec(select(func.count(Purchase.id))).one()
-        active_users = session.exec(select(func.count(func.distinct(Purchase.user_external_id)))).one()
-        
-        if total_purchases == 0:
-            result = {
-                'total_purchases': 0,
-                'unique_routes': 0,
-                'active_users': 0,
-                'avg_popularity': 0,
-                'popular_routes': [],
-                'daily_stats': [],
-                'matched_customers': 0,
-                'unmatched_customers': 0,
-                'cache_info': {
-                    'cached': False,
-                    'calculation_time': 0
-                }
-            }
-            _route_statistics_cache = result
-            _route_statistics_cache_time = current_time
-            return result
-        
-        # 2. Получаем все покупки с группировкой по пользователям (упрощенная версия)
-        all_purchases = session.exec(select(Purchase.user_external_id, Purchase.concert_id)).all()
-        
-        # Группируем покупки по пользователям
-        user_purchases = {}
-        for purchase in all_purchases:
-            user_id = purchase.user_external_id
-            if user_id not in user_purchases:
-                user_purchases[user_id] = []
-            user_purchases[user_id].append(purchase.concert_id)
-        
-        # 3. Получаем все маршруты
-        from models import Route
-        all_routes = session.exec(select(Route)).all()
-        
-        # 4. Быстрый подсчет популярности маршрутов
-        route_popularity = {}
-        route_details = {}
-        matched_customers = 0
-        
-        for user_id, user_concert_ids in user_purchases.items():
-            user_concerts = set(user_concert_ids)
-            
-            # Ищем точные совпадения маршрутов
-            for route in all_routes:
-                try:
-                    route_concerts = set(int(x.strip()) for x in route.Sostav.split(',') if x.strip())
-                    
-                    # Точное совпадение
-                    if route_concerts == user_concerts:
-                        if route.id not in route_popularity:
-                            route_popularity[route.id] = 0
-                            route_details[route.id] = {
-                                'route_id': route.id,
-                                'route_name': f"Маршрут {route.id}",
-                                'route_days': route.Days,
-                                'route_concerts': route.Concerts,
-                                'route_halls': route.Halls,
-                                'route_genre': route.Genre,
-                                'route_comfort_score': route.ComfortScore,
-                                'route_intellect_score': route.IntellectScore
-                            }
-                        route_popularity[route.id] += 1
-                        matched_customers += 1
-                        break
-                        
-                except (ValueError, AttributeError):
-                    continue
-        
-        unmatched_customers = active_users - matched_customers
-        
-        # 5. Сортируем маршруты по популярности
-        sorted_routes = sorted(route_popularity.items(), key=lambda x: x[1], reverse=True)
-        
-        # 6. Подготавливаем топ маршрутов
-        popular_routes = []
-        for route_id, customer_count in sorted_routes[:20]:
-            route_detail = route_details[route_id]
-            percentage = (customer_count / active_users * 100) if active_users > 0 else 0
-            
-            popular_routes.append({
-                'route_id': route_id,
-                'route_name': route_detail['route_name'],
-                'purchase_count': customer_count,
-                'percentage': percentage,
-                'last_purchase': None,  # Упрощено для скорости
-                'status': 'available',
-                'route_details': {
-                    'days': route_detail['route_days'],
-                    'concerts': route_detail['route_concerts'],
-                    'halls': route_detail['route_halls'],
-                    'genre': route_detail['route_genre'],
-                    'comfort_score': route_detail['route_comfort_score'],
-                    'intellect_score': route_detail['route_intellect_score']
-                }
-            })
-        
-        # 7. Упрощенная статистика по дням
-        daily_stats = []
-        concert_dates = session.exec(
-            select(Concert.datetime)
-            .distinct()
-            .order_by(Concert.datetime)
-        ).all()
-        
-        concerts_by_day = {}
-        for concert_datetime in concert_dates:
-            if concert_datetime:
-                day_date = concert_datetime.date()
-                if day_date not in concerts_by_day:
-                    concerts_by_day[day_date] = []
-                concerts_by_day[day_date].append(concert_datetime)
-        
-        for day_num, (day_date, day_concerts) in enumerate(concerts_by_day.items(), 1):
-            day_concert_ids = [c.id for c in day_concerts]
-            
-            # Подсчитываем покупки для этого дня
-            day_purchases = session.exec(
-                select(func.count(Purchase.id))
-                .where(Purchase.concert_id.in_(day_concert_ids))
-            ).one()
-            
-            daily_stats.append({
-                'day': day_num,
-                'date': day_date,
-                'purchases': day_purchases,
-                'routes': 0,  # Упрощено для скорости
-                'popularity': (day_purchases / total_purchases * 100) if total_purchases > 0 else 0
-            })
-        
-        calculation_time = time.time() - start_time
-        logger.info(f"Быстрая статистика маршрутов рассчитана за {calculation_time:.2f} секунд")
-        
-        result = {
-            'total_purchases': total_purchases,
-            'unique_routes': len(route_popularity),
-            'active_users': active_users,
-            'avg_popularity': sum(route_popularity.values()) / len(route_popularity) if route_popularity else 0,
-            'popular_routes': popular_routes,
-            'daily_stats': daily_stats,
-            'matched_customers': matched_customers,
-            'unmatched_customers': unmatched_customers,
-            'cache_info': {
-                'cached': True,
-                'calculation_time': calculation_time
-            }
-        }
-        
-        # Сохраняем в кэш
-        _route_statistics_cache = result
-        _route_statistics_cache_time = current_time
-        
-        return result
-        
-    except Exception as e:
-        logger.error(f"Ошибка при получении быстрой статистики маршрутов: {e}")
-        return {
-            'total_purchases': 0,
-            'unique_routes': 0,
-            'active_users': 0,
-            'avg_popularity': 0,
-            'popular_routes': [],
-            'daily_stats': [],
-            'matched_customers': 0,
-            'unmatched_customers': 0,
-            'cache_info': {
-                'cached': False,
-                'calculation_time': 0,
-                'error': str(e)
-            }
-        }
+    return _cached_route_statistics(session, force_refresh)
 
 
 def get_route_statistics_simple(session: Session, force_refresh: bool = False) -> dict:
     """
     Простая и быстрая статистика маршрутов на основе данных из CustomerRouteMatch
     """
-    global _route_statistics_cache, _route_statistics_cache_time
-    
-    # Проверяем кэш
-    current_time = time.time()
-    if (not force_refresh and 
-        _route_statistics_cache is not None and 
-        _route_statistics_cache_time is not None and
-        current_time - _route_statistics_cache_time < _route_statistics_cache_ttl):
-        
-        logger.info("Возвращаем статистику маршрутов из кэша")
-        return _route_statistics_cache
-    
-    logger.info("Начинаем простой расчет статистики маршрутов...")
-    start_time = time.time()
-    
-    try:
-        from models import CustomerRouteMatch, Route, Purchase, Concert
-        
-        # 1. Базовая статистика покупок
-        total_purchases = session.exec(select(func.count(Purchase.id))).one()
-        active_users = session.exec(select(func.count(func.distinct(Purchase.user_external_id)))).one()
-        
-        if total_purchases == 0:
-            result = {
-                'total_purchases': 0,
-                'unique_routes': 0,
-                'active_users': 0,
-                'avg_popularity': 0,
-                'popular_routes': [],
-                'daily_stats': [],
-                'matched_customers': 0,
-                'unmatched_customers': 0,
-                'cache_info': {
-                    'cached': False,
-                    'calculation_time': 0
-                }
-            }
-            _route_statistics_cache = result
-            _route_statistics_cache_time = current_time
-            return result
-        
-        # 2. Получаем все соответствия маршрутов из CustomerRouteMatch
-        matches = session.exec(select(CustomerRouteMatch)).all()
-        
-        # 3. Подсчитываем статистику
-        matched_customers = 0
-        unmatched_customers = 0
-        route_popularity = {}
-        route_details = {}
-        
-        for match in matches:
-            if match.found and match.best_route_id:
-                matched_customers += 1
-                
-                # Увеличиваем счетчик популярности маршрута
-                if match.best_route_id not in route_popularity:
-                    route_popularity[match.best_route_id] = 0
-                route_popularity[match.best_route_id] += 1
-            else:
-                unmatched_customers += 1
-        
-        # 4. Получаем детали маршрутов для популярных
-        if route_popularity:
-            route_ids = list(route_popularity.keys())
-            routes = session.exec(select(Route).where(Route.id.in_(route_ids))).all()
-            
-            for route in routes:
-                route_details[route.id] = {
-                    'route_id': route.id,
-                    'route_name': f"Маршрут {route.id}",
-                    'route_days': route.Days,
-                    'route_concerts': route.Concerts,
-                    'route_halls': route.Halls,
-                    'route_genre': route.Genre,
-                    'route_comfort_score': route.ComfortScore,
-                    'route_intellect_score': route.IntellectScore
-                }
-        
-        # 5. Сортируем маршруты по популярности
-        sorted_routes = sorted(route_popularity.items(), key=lambda x: x[1], reverse=True)
-        
-        # 6. Подготавливаем топ маршрутов
-        popular_routes = []
-        for route_id, customer_count in sorted_routes[:20]:
-            route_detail = route_details.get(route_id, {})
-            percentage = (customer_count / active_users * 100) if active_users > 0 else 0
-            
-            popular_routes.append({
-                'route_id': route_id,
-                'route_name': route_detail.get('route_name', f"Маршрут {route_id}"),
-                'purchase_count': customer_count,
-                'percentage': percentage,
-                'last_purchase': None,  # Упрощено для скорости
-                'status': 'available',
-                'route_details': {
-                    'days': route_detail.get('route_days'),
-                    'concerts': route_detail.get('route_concerts'),
-                    'halls': route_detail.get('route_halls'),
-                    'genre': route_detail.get('route_genre'),
-                    'comfort_score': route_detail.get('route_comfort_score'),
-                    'intellect_score': route_detail.get('route_intellect_score')
-                }
-            })
-        
-        # 7. Упрощенная статистика по дням
-        daily_stats = []
-        concert_dates = session.exec(
-            select(Concert.datetime)
-            .distinct()
-            .order_by(Concert.datetime)
-        ).all()
-        
-        concerts_by_day = {}
-        for concert_datetime in concert_dates:
-            if concert_datetime:
-                day_date = concert_datetime.date()
-                if day_date not in concerts_by_day:
-                    concerts_by_day[day_date] = []
-                concerts_by_day[day_date].append(concert_datetime)
-        
-        for day_num, (day_date, day_concerts) in enumerate(concerts_by_day.items(), 1):
-            # Получаем ID концертов для этого дня
-            day_concert_ids = session.exec(
-                select(Concert.id)
-                .where(Concert.datetime.in_(day_concerts))
-            ).all()
-            
-            # Подсчитываем покупки для этого дня
-            day_purchases = session.exec(
-                select(func.count(Purchase.id))
-                .where(Purchase.concert_id.in_(day_concert_ids))
-            ).one()
-            
-            daily_stats.append({
-                'day': day_num,
-                'date': day_date,
-                'purchases': day_purchases,
-                'routes': 0,  # Упрощено для скорости
-                'popularity': (day_purchases / total_purchases * 100) if total_purchases > 0 else 0
-            })
-        
-        calculation_time = time.time() - start_time
-        logger.info(f"Простая статистика маршрутов рассчитана за {calculation_time:.2f} секунд")
-        
-        result = {
-            'total_purchases': total_purchases,
-            'unique_routes': len(route_popularity),
-            'active_users': active_users,
-            'avg_popularity': sum(route_popularity.values()) / len(route_popularity) if route_popularity else 0,
-            'popular_routes': popular_routes,
-            'daily_stats': daily_stats,
-            'matched_customers': matched_customers,
-            'unmatched_customers': unmatched_customers,
-            'cache_info': {
-                'cached': True,
-                'calculation_time': calculation_time
-            }
-        }
-        
-        # Сохраняем в кэш
-        _route_statistics_cache = result
-        _route_statistics_cache_time = current_time
-        
-        return result
-        
-    except Exception as e:
-        logger.error(f"Ошибка при получении простой статистики маршрутов: {e}")
-        return {
-            'total_purchases': 0,
-            'unique_routes': 0,
-            'active_users': 0,
-            'avg_popularity': 0,
-            'popular_routes': [],
-            'daily_stats': [],
-            'matched_customers': 0,
-            'unmatched_customers': 0,
-            'cache_info': {
-                'cached': False,
-                'calculation_time': 0,
-                'error': str(e)
-            }
-        }
+    return _cached_route_statistics(session, force_refresh)
 
 
 def clear_route_statistics_cache():
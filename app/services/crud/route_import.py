@@ -0,0 +1,455 @@
+"""
+Потоковый импорт маршрутов из CSV.
+
+Файл читается порциями через pandas, типы приводятся векторно для всей порции.
+В PostgreSQL порция загружается командой COPY во временную таблицу и сливается
+с route одним INSERT ... ON CONFLICT по каноническому составу маршрута (Sostav).
+
+Разбор большого файла распараллелен: файл делится на диапазоны байтов по границам
+строк, пул процессов разбирает диапазоны в типизированные порции, а единственный
+писатель в основном процессе сливает их с базой строго в порядке файла.
+
+Каждая строка получает отпечаток RowHash (хэш состава и метрик): строки, совпадающие
+с уже загруженными, не перезаписываются, а импорт возвращает ID добавленных,
+изменённых и исчезнувших из файла маршрутов, чтобы обновлять только их.
+"""
+import io
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlmodel import Session, select
+from sqlalchemy import text
+
+from models.route import Route
+
+logger = logging.getLogger(__name__)
+
+# Размер порции строк CSV
+ROUTE_IMPORT_CHUNK_SIZE = 50000
+
+# Размер диапазона байтов файла, который разбирает один процесс пула
+ROUTE_IMPORT_RANGE_BYTES = 16 * 1024 * 1024
+
+# Размер порции ID/составов в условиях IN (...)
+_LOOKUP_BATCH_SIZE = 500
+
+# Временная таблица для COPY (живёт до конца транзакции одной порции)
+_STAGING_TABLE = "route_import_staging"
+
+
+def route_csv_columns(header: List[str]) -> Dict[str, str]:
+    """
+    Сопоставляет столбцы CSV полям Route (по имени поля или по его alias, например "TransTime_%")
+
+    Args:
+        header: Заголовок CSV
+
+    Returns:
+        Dict[str, str]: {столбец CSV: поле Route}; Sostav и вычисляемые поля не включаются
+    """
+    header = set(header)
+    columns = {}
+    for name, field in Route.model_fields.items():
+        if name in ('id', 'Sostav', 'SostavIds', 'RowHash'):
+            continue
+        if name in header:
+            columns[name] = name
+        elif field.alias and field.alias in header:
+            columns[field.alias] = name
+    return columns
+
+
+def _field_kind(name: str) -> Tuple[Optional[type], bool]:
+    """Базовый тип поля Route (int, float или None для строк) и признак обязательности"""
+    annotation = Route.model_fields[name].annotation
+    if annotation in (int, float):
+        return annotation, True
+    if annotation in (Optional[int], Optional[float]):
+        return annotation.__args__[0], False
+    return None, annotation is str
+
+
+def _sostav_hashes(sostav: pd.Series) -> np.ndarray:
+    """64-битные хэши канонических составов (для поиска маршрутов, исчезнувших из файла)"""
+    return pd.util.hash_pandas_object(sostav, index=False).values
+
+
+def prepare_route_chunk(chunk: pd.DataFrame, columns: Dict[str, str]) -> Tuple[pd.DataFrame, int]:
+    """
+    Приводит порцию CSV к столбцам и типам Route и вычисляет отпечаток каждой строки
+
+    Args:
+        chunk: Порция CSV (все значения строками)
+        columns: Сопоставление столбцов CSV полям Route
+
+    Returns:
+        Tuple[pd.DataFrame, int]: Подготовленные строки (последняя строка для каждого состава)
+                                  и количество пропущенных строк
+    """
+    concerts = chunk['Sostav'].fillna('').astype(str).str.findall(r'\d+')
+    data = {
+        'Sostav': concerts.map(lambda ids: ','.join(sorted(ids))),
+        'SostavIds': concerts.map(lambda ids: sorted({int(x) for x in ids})),
+    }
+    valid = concerts.map(len) > 0
+
+    for csv_column, name in columns.items():
+        kind, required = _field_kind(name)
+        values = chunk[csv_column]
+        if kind is int:
+            values = pd.to_numeric(values, errors='coerce').round().astype('Int64')
+        elif kind is float:
+            values = pd.to_numeric(values, errors='coerce').astype('float64')
+        else:
+            values = values.astype(object).where(values.notna() & (values != ''), None)
+        if required:
+            valid &= values.notna()
+        data[name] = values
+
+    prepared = pd.DataFrame(data)[valid.values]
+    # Повтор состава в файле обновляет маршрут: остаётся последняя строка
+    prepared = prepared.drop_duplicates('Sostav', keep='last')
+    prepared['RowHash'] = pd.util.hash_pandas_object(
+        prepared.drop(columns=['SostavIds']), index=False
+    ).values.view(np.int64)
+    return prepared, int((~valid).sum())
+
+
+def get_route_import_workers() -> int:
+    """Число процессов разбора файла маршрутов (можно переопределить переменной ROUTE_IMPORT_WORKERS)"""
+    workers = os.environ.get("ROUTE_IMPORT_WORKERS")
+    return max(1, int(workers) if workers else (os.cpu_count() or 1))
+
+
+def read_csv_header(path: str) -> Tuple[List[str], int]:
+    """
+    Читает заголовок CSV
+
+    Args:
+        path: Путь к CSV-файлу
+
+    Returns:
+        Tuple[List[str], int]: Имена столбцов и смещение первой строки данных в байтах
+    """
+    with open(path, 'rb') as csvfile:
+        line = csvfile.readline()
+        data_start = csvfile.tell()
+    header = pd.read_csv(io.BytesIO(line), dtype=str, nrows=0, encoding='utf-8').columns
+    return list(header), data_start
+
+
+def split_byte_ranges(path: str, data_start: int, range_bytes: int) -> List[Tuple[int, int]]:
+    """
+    Делит данные CSV на диапазоны байтов, выровненные по границам строк.
+    Поля файла маршрутов не содержат переводов строк, поэтому каждая строка целиком попадает в один диапазон
+
+    Args:
+        path: Путь к CSV-файлу
+        data_start: Смещение первой строки данных
+        range_bytes: Желаемый размер диапазона
+
+    Returns:
+        List[Tuple[int, int]]: Диапазоны [начало, конец) в порядке файла
+    """
+    file_size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as csvfile:
+        start = data_start
+        while start < file_size:
+            end = start + range_bytes
+            if end < file_size:
+                csvfile.seek(end)
+                csvfile.readline()  # дочитываем строку, на которую попала граница
+                end = csvfile.tell()
+            end = min(end, file_size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_byte_range(path: str, header: List[str], columns: Dict[str, str], start: int, end: int,
+                     chunk_size: int) -> List[Tuple[pd.DataFrame, int]]:
+    """
+    Разбирает диапазон байтов CSV в подготовленные порции (выполняется в процессе пула)
+
+    Args:
+        path: Путь к CSV-файлу
+        header: Имена столбцов файла
+        columns: Сопоставление столбцов CSV полям Route
+        start: Начало диапазона
+        end: Конец диапазона
+        chunk_size: Размер порции строк
+
+    Returns:
+        List[Tuple[pd.DataFrame, int]]: Подготовленные порции и число прочитанных строк каждой из них
+    """
+    with open(path, 'rb') as csvfile:
+        csvfile.seek(start)
+        data = csvfile.read(end - start)
+    if not data.strip():
+        return []
+    reader = pd.read_csv(
+        io.BytesIO(data), header=None, names=header, dtype=str, keep_default_na=False,
+        chunksize=chunk_size, encoding='utf-8'
+    )
+    return [(prepare_route_chunk(chunk, columns)[0], len(chunk)) for chunk in reader]
+
+
+def _parsed_batches(path: str, header: List[str], columns: Dict[str, str], ranges: List[Tuple[int, int]],
+                    chunk_size: int, workers: int) -> Iterator[Tuple[pd.DataFrame, int, int]]:
+    """
+    Разбирает диапазоны файла (параллельно, если процессов больше одного) и отдаёт порции в порядке файла.
+    В работе одновременно не больше 2 * workers диапазонов, чтобы медленный писатель не накапливал порции в памяти
+
+    Returns:
+        Iterator[Tuple[pd.DataFrame, int, int]]: Подготовленная порция, число прочитанных строк
+                                                 и конец разобранной части файла в байтах
+    """
+    if workers <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            for prepared, rows in parse_byte_range(path, header, columns, start, end, chunk_size):
+                yield prepared, rows, end
+        return
+
+    pending_ranges = iter(ranges)
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+        in_flight = deque()
+
+        def submit_next() -> None:
+            byte_range = next(pending_ranges, None)
+            if byte_range is not None:
+                in_flight.append((byte_range[1], executor.submit(
+                    parse_byte_range, path, header, columns, byte_range[0], byte_range[1], chunk_size
+                )))
+
+        for _ in range(2 * workers):
+            submit_next()
+        while in_flight:
+            end, future = in_flight.popleft()
+            batches = future.result()
+            submit_next()
+            for prepared, rows in batches:
+                yield prepared, rows, end
+
+
+def _chunk_records(prepared: pd.DataFrame) -> List[dict]:
+    """Строки порции как словари с None вместо пропусков и питоновскими числами"""
+    records = []
+    for row in prepared.astype(object).itertuples(index=False):
+        records.append({
+            name: (None if not isinstance(value, list) and pd.isna(value)
+                   else value.item() if hasattr(value, 'item') else value)
+            for name, value in zip(prepared.columns, row)
+        })
+    return records
+
+
+def _copy_buffer(prepared: pd.DataFrame) -> io.StringIO:
+    """CSV-буфер порции в формате COPY (массив SostavIds в виде литерала {1,2,3})"""
+    frame = prepared.copy()
+    frame['SostavIds'] = frame['SostavIds'].map(lambda ids: '{' + ','.join(map(str, ids)) + '}')
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, na_rep='')
+    buffer.seek(0)
+    return buffer
+
+
+def _merge_chunk_postgres(session: Session, prepared: pd.DataFrame) -> Tuple[List[int], List[int]]:
+    """
+    Загружает порцию через COPY во временную таблицу и сливает её с route.
+    Маршруты с тем же отпечатком не перезаписываются
+
+    Returns:
+        Tuple[List[int], List[int]]: ID добавленных и изменённых маршрутов
+    """
+    columns = list(prepared.columns)
+    quoted = ', '.join(f'"{name}"' for name in columns)
+    updates = ', '.join(
+        f'"{name}" = EXCLUDED."{name}"' for name in columns if name != 'Sostav'
+    )
+
+    # Только столбцы файла, без ограничений и значения по умолчанию для id
+    session.exec(text(
+        f"CREATE TEMP TABLE {_STAGING_TABLE} ON COMMIT DROP AS "
+        f"SELECT {quoted} FROM route WITH NO DATA"
+    ))
+    dbapi_connection = session.connection().connection.dbapi_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {_STAGING_TABLE} ({quoted}) FROM STDIN WITH (FORMAT csv, NULL '')",
+            _copy_buffer(prepared)
+        )
+
+    merged = session.exec(text(
+        f"INSERT INTO route ({quoted}) SELECT {quoted} FROM {_STAGING_TABLE} "
+        f"ON CONFLICT (\"Sostav\") DO UPDATE SET {updates} "
+        f"WHERE route.\"RowHash\" IS DISTINCT FROM EXCLUDED.\"RowHash\" "
+        f"RETURNING id, (xmax = 0) AS inserted"
+    )).all()
+    session.commit()
+    added_ids = [route_id for route_id, inserted in merged if inserted]
+    changed_ids = [route_id for route_id, inserted in merged if not inserted]
+    return added_ids, changed_ids
+
+
+def _existing_routes(session: Session, sostavs: List[str]) -> Dict[str, Tuple[int, Optional[int]]]:
+    """ID и отпечатки уже загруженных маршрутов с указанными составами"""
+    existing = {}
+    for start in range(0, len(sostavs), _LOOKUP_BATCH_SIZE):
+        batch = sostavs[start:start + _LOOKUP_BATCH_SIZE]
+        for sostav, route_id, row_hash in session.exec(
+            select(Route.Sostav, Route.id, Route.RowHash).where(Route.Sostav.in_(batch))
+        ).all():
+            existing[sostav] = (route_id, row_hash)
+    return existing
+
+
+def _merge_chunk_generic(session: Session, prepared: pd.DataFrame) -> Tuple[List[int], List[int]]:
+    """
+    Сливает порцию с route через INSERT ... ON CONFLICT (SQLite, используемый в тестах).
+    Маршруты с тем же отпечатком не перезаписываются
+
+    Returns:
+        Tuple[List[int], List[int]]: ID добавленных и изменённых маршрутов
+    """
+    from sqlalchemy.dialects.sqlite import insert
+
+    table = Route.__table__
+    records = _chunk_records(prepared)
+    existing = _existing_routes(session, [record['Sostav'] for record in records])
+    changed_ids = [
+        existing[record['Sostav']][0] for record in records
+        if record['Sostav'] in existing and existing[record['Sostav']][1] != record['RowHash']
+    ]
+    new_sostavs = [record['Sostav'] for record in records if record['Sostav'] not in existing]
+
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['Sostav'],
+        set_={
+            name: statement.excluded[name]
+            for name in prepared.columns if name != 'Sostav'
+        },
+        where=table.c.RowHash.is_distinct_from(statement.excluded.RowHash)
+    )
+    session.exec(statement, params=records)
+    session.commit()
+
+    added_ids = [route_id for route_id, _ in _existing_routes(session, new_sostavs).values()]
+    return added_ids, changed_ids
+
+
+def find_removed_routes(session: Session, seen_sostav_hashes: np.ndarray) -> List[int]:
+    """
+    Находит маршруты, составов которых не было в загруженном файле
+
+    Args:
+        session: Сессия базы данных
+        seen_sostav_hashes: Хэши составов из файла
+
+    Returns:
+        List[int]: ID маршрутов, отсутствующих в файле
+    """
+    seen = np.unique(seen_sostav_hashes)
+    removed = []
+    rows = session.exec(select(Route.id, Route.Sostav).execution_options(yield_per=ROUTE_IMPORT_CHUNK_SIZE))
+    for partition in rows.partitions():
+        route_ids = np.fromiter((route_id for route_id, _ in partition), dtype=np.int64, count=len(partition))
+        hashes = _sostav_hashes(pd.Series([sostav for _, sostav in partition], dtype=object))
+        removed.extend(route_ids[~np.isin(hashes, seen)].tolist())
+    return removed
+
+
+def import_routes_csv(session: Session, path: str, chunk_size: int = ROUTE_IMPORT_CHUNK_SIZE,
+                      status_dict: Dict = None, find_removed: bool = False, workers: Optional[int] = None,
+                      range_bytes: int = ROUTE_IMPORT_RANGE_BYTES) -> Dict:
+    """
+    Импортирует маршруты из CSV потоково, добавляя новые и обновляя изменившиеся по составу.
+    Файл разбирается пулом процессов по диапазонам байтов, порции сливаются с базой в порядке файла
+
+    Args:
+        session: Сессия базы данных
+        path: Путь к CSV-файлу маршрутов
+        chunk_size: Размер порции строк
+        status_dict: Словарь статуса загрузки (total, progress, added, updated, error)
+        find_removed: Найти маршруты, которых нет в файле (сами маршруты не удаляются)
+        workers: Число процессов разбора (по умолчанию get_route_import_workers())
+        range_bytes: Размер диапазона байтов, который разбирает один процесс
+
+    Returns:
+        Dict: Количество добавленных, изменённых, неизменённых и пропущенных строк,
+              а также ID добавленных (added_ids), изменённых (changed_ids) и отсутствующих в файле (removed_ids) маршрутов
+    """
+    is_postgres = session.get_bind().dialect.name == "postgresql"
+    merge_chunk = _merge_chunk_postgres if is_postgres else _merge_chunk_generic
+    workers = workers or get_route_import_workers()
+    file_size = os.path.getsize(path)
+    added_ids, changed_ids, seen_hashes = [], [], []
+    unchanged, skipped, processed = 0, 0, 0
+
+    if status_dict is not None:
+        status_dict["total"] = 0
+        status_dict["progress"] = 0
+        status_dict["added"] = 0
+        status_dict["updated"] = 0
+        status_dict["error"] = None
+
+    header, data_start = read_csv_header(path)
+    if 'Sostav' not in header:
+        raise ValueError("В файле маршрутов нет столбца Sostav")
+    columns = route_csv_columns(header)
+    ranges = split_byte_ranges(path, data_start, range_bytes)
+    logger.info(
+        f"Импорт маршрутов: {len(columns)} столбцов сопоставлено полям Route, "
+        f"{len(ranges)} диапазонов файла, процессов разбора: {min(workers, max(len(ranges), 1))}"
+    )
+
+    for prepared, rows, read_bytes in _parsed_batches(path, header, columns, ranges, chunk_size, workers):
+        chunk_added, chunk_changed = merge_chunk(session, prepared) if len(prepared) else ([], [])
+        added_ids.extend(chunk_added)
+        changed_ids.extend(chunk_changed)
+        unchanged += len(prepared) - len(chunk_added) - len(chunk_changed)
+        # Повторы состава внутри порции перекрываются последней строкой
+        skipped += rows - len(prepared)
+        if find_removed:
+            seen_hashes.append(_sostav_hashes(prepared['Sostav']))
+        processed += rows
+
+        # Общее число строк оценивается по доле разобранного файла, без отдельного прохода
+        estimated_total = int(processed * file_size / read_bytes) if read_bytes else processed
+        percent = (processed / estimated_total) * 100 if estimated_total else 100
+        logger.info(f"Обработано {processed} маршрутов (~{percent:.1f}%)")
+        if status_dict is not None:
+            status_dict["total"] = max(estimated_total, processed)
+            status_dict["progress"] = processed
+            status_dict["added"] = len(added_ids)
+            status_dict["updated"] = len(changed_ids)
+
+    removed_ids = []
+    if find_removed:
+        hashes = np.concatenate(seen_hashes) if seen_hashes else np.empty(0, dtype=np.uint64)
+        removed_ids = find_removed_routes(session, hashes)
+
+    if status_dict is not None:
+        status_dict["total"] = processed
+        status_dict["progress"] = processed
+
+    logger.info(
+        f"Импорт маршрутов завершён: добавлено {len(added_ids)}, изменено {len(changed_ids)}, "
+        f"без изменений {unchanged}, пропущено {skipped}, нет в файле {len(removed_ids)}"
+    )
+    return {
+        "added": len(added_ids),
+        "updated": len(changed_ids),
+        "unchanged": unchanged,
+        "skipped": skipped,
+        "removed": len(removed_ids),
+        "added_ids": added_ids,
+        "changed_ids": changed_ids,
+        "removed_ids": removed_ids,
+    }
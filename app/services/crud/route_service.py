@@ -2,13 +2,49 @@
 Сервис для работы с маршрутами и их доступностью
 """
 from sqlmodel import Session, select, delete
-from models import Route, AvailableRoute, Concert, Statistics
+from sqlalchemy import func, text, insert, exists, and_, or_, literal, inspect
+from models import Route, AvailableRoute, Concert, Statistics, RouteConcertLink, CustomerRouteMatch
+from services.route_index import RouteBitsetIndex, parse_sostav, route_concert_ids
+from services.route_catalog import RouteCatalog, remove_stale_catalogs
+from services.route_skyline import skyline_layers
+from services.crud.shadow_table import shadow_table
+from config_data_path import ROUTE_CATALOG_DIR
 from datetime import datetime, timezone
 import logging
-from typing import List, Dict, Tuple
+import os
+import threading
+import numpy as np
+from typing import List, Dict, Tuple, Iterable, Optional
 
 logger = logging.getLogger(__name__)
 
+# Ключ версии каталога маршрутов в Statistics
+ROUTE_CATALOG_VERSION_KEY = "route_catalog_version"
+
+# Версия набора доступных маршрутов в Statistics (меняется при каждом изменении AvailableRoute)
+AVAILABILITY_VERSION_KEY = "available_routes_version"
+
+# Размер порции для массовых операций с AvailableRoute
+AVAILABILITY_BATCH_SIZE = 1000
+
+# Формат файлов колоночного каталога (меняется при добавлении столбцов, чтобы не открыть старые файлы)
+ROUTE_CATALOG_FORMAT = 3
+
+# Кэш битового индекса маршрутов (перестраивается при смене версии каталога)
+_route_index_cache = None
+_route_index_version = None
+_route_index_lock = threading.Lock()
+
+# Кэш битовых индексов маршрут×композитор и маршрут×артист: {вид: (ключ, индекс)}
+_route_entity_cache = {}
+
+# Кэш маски доступности маршрутов каталога: (версия данных маршрутов, маска)
+_route_availability_cache = None
+
+# Кэш колоночного каталога маршрутов (файлы каталога открыты через mmap)
+_route_catalog_cache = None
+_route_catalog_lock = threading.Lock()
+
 
 def is_route_available(session: Session, route: Route) -> bool:
     """
@@ -22,8 +58,7 @@ def is_route_available(session: Session, route: Route) -> bool:
         bool: True если все концерты доступны, False иначе
     """
     try:
-        # Парсим состав маршрута (например: "1,2,3,4")
-        concert_ids = [int(x.strip()) for x in route.Sostav.split(',') if x.strip()]
+        concert_ids = route_concert_ids(route)
         
         if not concert_ids:
             logger.debug(f"Маршрут {route.id} не содержит концертов")
@@ -68,8 +103,7 @@ def is_route_available_optimized(session: Session, route: Route, concerts_cache:
         bool: True если все концерты доступны, False иначе
     """
     try:
-        # Парсим состав маршрута (например: "1,2,3,4")
-        concert_ids = [int(x.strip()) for x in route.Sostav.split(',') if x.strip()]
+        concert_ids = route_concert_ids(route)
         
         if not concert_ids:
             logger.debug(f"Маршрут {route.id} не содержит концертов")
@@ -105,9 +139,738 @@ def is_route_available_optimized(session: Session, route: Route, concerts_cache:
         return False
 
 
+def get_route_catalog_version(session: Session) -> int:
+    """
+    Возвращает текущую версию каталога маршрутов
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        int: Версия каталога (0, если маршруты ещё не загружались)
+    """
+    stats_record = session.exec(
+        select(Statistics).where(Statistics.key == ROUTE_CATALOG_VERSION_KEY)
+    ).first()
+    return stats_record.value if stats_record else 0
+
+
+def _increment_statistic(session: Session, key: str) -> Statistics:
+    """Увеличивает счётчик в Statistics на 1 (без фиксации транзакции)"""
+    stats_record = session.exec(select(Statistics).where(Statistics.key == key)).first()
+    if stats_record:
+        stats_record.value += 1
+        stats_record.updated_at = datetime.now(timezone.utc)
+    else:
+        stats_record = Statistics(key=key, value=1, updated_at=datetime.now(timezone.utc))
+        session.add(stats_record)
+    return stats_record
+
+
+def get_availability_version(session: Session) -> int:
+    """
+    Возвращает версию набора доступных маршрутов (AvailableRoute)
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        int: Версия (0, если AvailableRoute ещё не обновлялись)
+    """
+    stats_record = session.exec(
+        select(Statistics).where(Statistics.key == AVAILABILITY_VERSION_KEY)
+    ).first()
+    return stats_record.value if stats_record else 0
+
+
+def get_route_data_version(session: Session) -> str:
+    """
+    Версия данных, от которых зависят подборки маршрутов: каталог маршрутов и набор доступных маршрутов.
+    Вычисляется без загрузки каталога, поэтому подходит для ключей кэша
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        str: Строка версии (например: "f2-v3-1000-1000-a7")
+    """
+    return f"{_route_catalog_key(session)}-a{get_availability_version(session)}"
+
+
+def bump_route_catalog_version(session: Session) -> int:
+    """
+    Увеличивает версию каталога маршрутов. Вызывается после любого изменения таблицы Route,
+    чтобы все процессы перестроили свои индексы маршрутов
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        int: Новая версия каталога
+    """
+    stats_record = _increment_statistic(session, ROUTE_CATALOG_VERSION_KEY)
+    session.commit()
+    logger.info(f"Версия каталога маршрутов обновлена: {stats_record.value}")
+    return stats_record.value
+
+
+def get_route_catalog_dir() -> str:
+    """Базовая папка сохранённых каталогов маршрутов (можно переопределить переменной ROUTE_CATALOG_DIR)"""
+    return os.environ.get("ROUTE_CATALOG_DIR", ROUTE_CATALOG_DIR)
+
+
+def _route_catalog_key(session: Session) -> str:
+    """
+    Ключ версии колоночного каталога.
+    Кроме версии из Statistics учитывает количество и максимальный ID маршрутов,
+    чтобы после пересоздания базы не открыть файлы каталога от прежних данных
+    """
+    routes_count, max_route_id = session.exec(select(func.count(Route.id), func.max(Route.id))).one()
+    return f"f{ROUTE_CATALOG_FORMAT}-v{get_route_catalog_version(session)}-{routes_count}-{max_route_id or 0}"
+
+
+def _route_catalog_columns() -> Tuple[List[str], List[str]]:
+    """Числовые поля Route, попадающие в каталог, и те из них, что хранятся как int64"""
+    columns, int_columns = [], []
+    for name, field in Route.model_fields.items():
+        if name in ('id', 'RowHash'):
+            continue
+        if field.annotation in (int, float, Optional[int], Optional[float]):
+            columns.append(name)
+            if field.annotation is int:
+                int_columns.append(name)
+    return columns, int_columns
+
+
+def build_route_catalog(session: Session, key: str = None) -> RouteCatalog:
+    """
+    Строит колоночный каталог маршрутов одной выборкой столбцов (без создания объектов Route)
+    и добавляет метрики разнообразия по композиторам (route_diversity_columns)
+    и слои Парето по IntellectScore/ComfortScore/Costs внутри корзин количества концертов (SkylineLayer)
+
+    Args:
+        session: Сессия базы данных
+        key: Ключ версии каталога (по умолчанию вычисляется)
+
+    Returns:
+        RouteCatalog: Каталог маршрутов
+    """
+    key = key or _route_catalog_key(session)
+    columns, int_columns = _route_catalog_columns()
+    rows = session.exec(
+        select(Route.id, Route.SostavIds, Route.Sostav, *[getattr(Route, name) for name in columns])
+        .order_by(Route.id)
+    ).all()
+    catalog = RouteCatalog.from_rows(
+        key, columns, int_columns,
+        [(row[0], row[1] if row[1] is not None else parse_sostav(row[2]), *row[3:]) for row in rows]
+    )
+    # Разнообразие программы: по произведениям концертов маршрута (ConcertCompositionLink)
+    catalog.columns.update(route_diversity_columns(
+        len(catalog), _catalog_link_pairs(catalog, _entity_links_array(session, "composer", distinct=False))
+    ))
+    catalog.columns["SkylineLayer"] = skyline_layers(
+        catalog.column('IntellectScore'), catalog.column('ComfortScore'), catalog.column('Costs'),
+        groups=catalog.column('Concerts')
+    )
+    return catalog
+
+
+def get_route_catalog(session: Session) -> RouteCatalog:
+    """
+    Возвращает колоночный каталог маршрутов текущей версии.
+    Каталог открывается из файлов через mmap; если файлов этой версии ещё нет,
+    он строится по базе и сохраняется для остальных процессов
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        RouteCatalog: Каталог маршрутов
+    """
+    global _route_catalog_cache
+
+    key = _route_catalog_key(session)
+    with _route_catalog_lock:
+        if _route_catalog_cache is not None and _route_catalog_cache.key == key:
+            return _route_catalog_cache
+
+        base_dir = get_route_catalog_dir()
+        directory = os.path.join(base_dir, key)
+        catalog = None
+        try:
+            catalog = RouteCatalog.load(key, directory)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось открыть каталог маршрутов {key}: {e}")
+
+        if catalog is None:
+            logger.info(f"Строим колоночный каталог маршрутов {key}...")
+            catalog = build_route_catalog(session, key)
+            try:
+                catalog.save(directory)
+                remove_stale_catalogs(base_dir, key)
+                # Дальше работаем с файлами, чтобы страницы разделялись с другими процессами
+                saved_catalog = RouteCatalog.load(key, directory)
+                if saved_catalog is not None:
+                    catalog = saved_catalog
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить каталог маршрутов {key}: {e}")
+
+        _route_catalog_cache = catalog
+        return catalog
+
+
+def clear_route_catalog_cache():
+    """
+    Очищает кэш колоночного каталога маршрутов в текущем процессе
+    """
+    global _route_catalog_cache
+    with _route_catalog_lock:
+        _route_catalog_cache = None
+    logger.info("Кэш каталога маршрутов очищен")
+
+
+def build_route_index(session: Session, catalog: RouteCatalog = None) -> RouteBitsetIndex:
+    """
+    Строит битовый индекс маршрутов по колоночному каталогу
+
+    Args:
+        session: Сессия базы данных
+        catalog: Каталог маршрутов (по умолчанию текущий)
+
+    Returns:
+        RouteBitsetIndex: Индекс маршрутов
+    """
+    if catalog is None:
+        catalog = get_route_catalog(session)
+    return RouteBitsetIndex.from_compositions(catalog.route_ids, catalog.compositions())
+
+
+def get_route_index(session: Session) -> RouteBitsetIndex:
+    """
+    Возвращает битовый индекс маршрутов из кэша процесса, перестраивая его при смене версии каталога
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        RouteBitsetIndex: Индекс маршрутов
+    """
+    global _route_index_cache, _route_index_version
+
+    catalog = get_route_catalog(session)
+    with _route_index_lock:
+        if _route_index_cache is None or _route_index_version != catalog.key:
+            logger.info(f"Строим битовый индекс маршрутов для каталога {catalog.key}...")
+            _route_index_cache = build_route_index(session, catalog)
+            _route_index_version = catalog.key
+        return _route_index_cache
+
+
+def _route_entity_links(kind: str):
+    """Запрос пар (внешний ID концерта, ID композитора или артиста) для индекса сущностей маршрутов"""
+    from models import Composition, ConcertCompositionLink, ConcertArtistLink
+    if kind == "composer":
+        return (
+            select(Concert.external_id, Composition.author_id)
+            .join(ConcertCompositionLink, ConcertCompositionLink.concert_id == Concert.id)
+            .join(Composition, Composition.id == ConcertCompositionLink.composition_id)
+        )
+    if kind == "artist":
+        return (
+            select(Concert.external_id, ConcertArtistLink.artist_id)
+            .join(ConcertArtistLink, ConcertArtistLink.concert_id == Concert.id)
+        )
+    raise ValueError(f"Неизвестный вид сущностей маршрута: {kind}")
+
+
+def _entity_links_array(session: Session, kind: str, distinct: bool = True) -> np.ndarray:
+    """Пары (внешний ID концерта, ID сущности) массивом shape (m, 2); без distinct — по строке на произведение"""
+    query = _route_entity_links(kind)
+    rows = session.exec(query.distinct() if distinct else query).all()
+    return np.array([row for row in rows if row[0] is not None], dtype=np.int64).reshape(-1, 2)
+
+
+def _catalog_link_pairs(catalog: RouteCatalog, links: np.ndarray) -> np.ndarray:
+    """
+    Соединяет пары (маршрут, концерт) каталога с парами (концерт, сущность) через сортировку по концерту
+
+    Returns:
+        np.ndarray: Пары (позиция маршрута, ID сущности) shape (m, 2), с повторами
+    """
+    route_positions = np.repeat(np.arange(len(catalog), dtype=np.int64), catalog.route_sizes)
+    route_concerts = np.asarray(catalog.concert_ids)
+    links = links[np.argsort(links[:, 0], kind='stable')]
+    starts = np.searchsorted(links[:, 0], route_concerts, side='left')
+    counts = np.searchsorted(links[:, 0], route_concerts, side='right') - starts
+    pair_routes = np.repeat(route_positions, counts)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_links = np.repeat(starts, counts) + offsets
+    return np.stack([pair_routes, links[pair_links, 1]], axis=1)
+
+
+def route_diversity_columns(n_routes: int, pairs: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Метрики разнообразия маршрутов по парам (позиция маршрута, композитор) — по паре на произведение
+
+    Args:
+        n_routes: Количество маршрутов каталога
+        pairs: Пары shape (m, 2)
+
+    Returns:
+        Dict[str, np.ndarray]: DistinctComposers (число композиторов), TopComposerShare
+                               (доля произведений главного композитора, NaN без произведений)
+                               и ComposerEntropy (энтропия распределения по композиторам, бит)
+    """
+    if len(pairs):
+        unique_pairs, counts = np.unique(pairs, axis=0, return_counts=True)
+        routes = unique_pairs[:, 0]
+    else:
+        routes, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    distinct = np.bincount(routes, minlength=n_routes).astype(np.int64)
+    total = np.bincount(routes, weights=counts, minlength=n_routes)
+    top = np.zeros(n_routes, dtype=np.float64)
+    np.maximum.at(top, routes, counts)
+    probabilities = counts / total[routes] if len(routes) else np.empty(0)
+    entropy = np.bincount(routes, weights=-probabilities * np.log2(probabilities), minlength=n_routes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = np.where(total > 0, top / total, np.nan)
+    return {"DistinctComposers": distinct, "TopComposerShare": share, "ComposerEntropy": entropy}
+
+
+def build_route_entity_index(session: Session, kind: str, catalog: RouteCatalog = None) -> RouteBitsetIndex:
+    """
+    Строит битовый индекс маршрут×композитор или маршрут×артист: сущности маршрута —
+    объединение сущностей его концертов по ConcertCompositionLink/ConcertArtistLink
+
+    Args:
+        session: Сессия базы данных
+        kind: "composer" или "artist"
+        catalog: Каталог маршрутов (по умолчанию текущий)
+
+    Returns:
+        RouteBitsetIndex: Индекс, в котором вместо концертов — ID композиторов (Author) или артистов
+    """
+    if catalog is None:
+        catalog = get_route_catalog(session)
+    pairs = np.unique(_catalog_link_pairs(catalog, _entity_links_array(session, kind)), axis=0).reshape(-1, 2)
+
+    logger.info(f"Строим индекс маршрутов по сущностям «{kind}»: {len(pairs)} пар маршрут-сущность")
+    return RouteBitsetIndex.from_pairs(catalog.route_ids, pairs[:, 0], pairs[:, 1])
+
+
+def get_route_entity_index(session: Session, kind: str) -> RouteBitsetIndex:
+    """
+    Возвращает битовый индекс маршрут×композитор или маршрут×артист из кэша процесса.
+    Индекс перестраивается при смене версии каталога или количества связей концертов с сущностями
+
+    Args:
+        session: Сессия базы данных
+        kind: "composer" или "artist"
+
+    Returns:
+        RouteBitsetIndex: Индекс сущностей маршрутов
+    """
+    catalog = get_route_catalog(session)
+    links_count = session.exec(select(func.count()).select_from(_route_entity_links(kind).subquery())).one()
+    key = f"{catalog.key}-{links_count}"
+    with _route_index_lock:
+        cached = _route_entity_cache.get(kind)
+        if cached is None or cached[0] != key:
+            cached = (key, build_route_entity_index(session, kind, catalog))
+            _route_entity_cache[kind] = cached
+        return cached[1]
+
+
+def clear_route_index_cache():
+    """
+    Очищает кэш битовых индексов и колоночного каталога маршрутов
+    """
+    global _route_index_cache, _route_index_version, _route_availability_cache
+    with _route_index_lock:
+        _route_index_cache = None
+        _route_index_version = None
+        _route_entity_cache.clear()
+        _route_availability_cache = None
+    clear_route_catalog_cache()
+    logger.info("Кэш битового индекса маршрутов очищен")
+
+
+def get_available_concert_ids(session: Session) -> List[int]:
+    """
+    Возвращает внешние ID концертов, на которые есть билеты
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        List[int]: ID концертов (Concert.external_id), используемые в составе маршрутов
+    """
+    return session.exec(
+        select(Concert.external_id).where(Concert.tickets_available == True)
+    ).all()
+
+
+def get_route_availability_mask(session: Session) -> np.ndarray:
+    """
+    Возвращает маску доступности маршрутов в порядке позиций каталога.
+    Маска вычисляется по битовому индексу один раз на версию каталога и доступных маршрутов
+    (см. get_route_data_version), поэтому подборки учитывают доступность без выборки AvailableRoute
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        np.ndarray: Булев массив по позициям каталога, True если на все концерты маршрута есть билеты
+    """
+    global _route_availability_cache
+
+    version = get_route_data_version(session)
+    with _route_index_lock:
+        if _route_availability_cache is not None and _route_availability_cache[0] == version:
+            return _route_availability_cache[1]
+
+    index = get_route_index(session)
+    mask = index.available_mask(index.blocked_concerts(get_available_concert_ids(session)))
+    mask.setflags(write=False)
+    with _route_index_lock:
+        _route_availability_cache = (version, mask)
+    logger.info(f"Маска доступности маршрутов {version}: доступно {int(mask.sum())} из {len(mask)}")
+    return mask
+
+
+def _patch_availability_mask(previous_version: str, version: str,
+                             route_positions: np.ndarray, available: np.ndarray) -> None:
+    """Переносит кэшированную маску доступности на новую версию, обновив только перепроверенные маршруты"""
+    global _route_availability_cache
+    with _route_index_lock:
+        if _route_availability_cache is None or _route_availability_cache[0] != previous_version:
+            return
+        # Позиции маршрутов действительны только для того же каталога
+        if version.rsplit("-a", 1)[0] != previous_version.rsplit("-a", 1)[0]:
+            return
+        mask = _route_availability_cache[1].copy()
+        mask[route_positions] = available
+        mask.setflags(write=False)
+        _route_availability_cache = (version, mask)
+
+
+def _available_route_insert(session: Session, where_clause, target=None) -> int:
+    """
+    Копирует маршруты в AvailableRoute одним INSERT ... SELECT, не загружая строки в Python
+
+    Args:
+        session: Сессия базы данных
+        where_clause: Условие отбора строк Route
+        target: Таблица назначения (по умолчанию AvailableRoute, при перестроении — её теневая копия)
+
+    Returns:
+        int: Количество добавленных записей
+    """
+    route_columns = [column.name for column in Route.__table__.columns]
+    source = select(
+        *[Route.__table__.c[name] for name in route_columns],
+        Route.id.label('original_route_id'),
+        literal(datetime.now(timezone.utc)).label('last_availability_check')
+    ).where(where_clause)
+    result = session.exec(
+        insert(AvailableRoute.__table__ if target is None else target).from_select(
+            route_columns + ['original_route_id', 'last_availability_check'], source
+        )
+    )
+    return max(result.rowcount or 0, 0)
+
+
+def _copy_routes_to_available(session: Session, route_ids: Iterable[int]) -> int:
+    """
+    Копирует маршруты с указанными ID в AvailableRoute порциями
+
+    Args:
+        session: Сессия базы данных
+        route_ids: ID маршрутов для копирования
+
+    Returns:
+        int: Количество добавленных записей
+    """
+    route_ids = list(route_ids)
+    added = 0
+    for start in range(0, len(route_ids), AVAILABILITY_BATCH_SIZE):
+        chunk = route_ids[start:start + AVAILABILITY_BATCH_SIZE]
+        added += _available_route_insert(session, Route.id.in_(chunk))
+    return added
+
+
+def _delete_available_routes(session: Session, available_route_ids: Iterable[int]) -> int:
+    """
+    Удаляет записи AvailableRoute по их ID порциями
+
+    Args:
+        session: Сессия базы данных
+        available_route_ids: ID записей AvailableRoute
+
+    Returns:
+        int: Количество удалённых записей
+    """
+    available_route_ids = list(available_route_ids)
+    for start in range(0, len(available_route_ids), AVAILABILITY_BATCH_SIZE):
+        chunk = available_route_ids[start:start + AVAILABILITY_BATCH_SIZE]
+        session.exec(delete(AvailableRoute).where(AvailableRoute.id.in_(chunk)))
+    return len(available_route_ids)
+
+
+def _count_available_routes(session: Session) -> int:
+    return session.exec(select(func.count(AvailableRoute.id))).one()
+
+
+def ensure_route_sostav_ids(session: Session) -> int:
+    """
+    Заполняет SostavIds у маршрутов, загруженных до появления столбца.
+    Для существующей базы PostgreSQL также создаёт недостающие столбцы (SostavIds, RowHash) и GIN-индекс
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        int: Количество заполненных маршрутов
+    """
+    try:
+        if session.get_bind().dialect.name == "postgresql":
+            for table in ("route", "availableroute"):
+                session.exec(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "SostavIds" integer[]'))
+                session.exec(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "RowHash" bigint'))
+            session.exec(text(
+                'CREATE INDEX IF NOT EXISTS ix_route_sostavids_gin ON route USING gin ("SostavIds")'
+            ))
+            sostav_ids_sql = (
+                "ARRAY(SELECT DISTINCT (m[1])::int AS concert_id "
+                "FROM regexp_matches(\"Sostav\", '\\d+', 'g') AS m ORDER BY concert_id)"
+            )
+            filled = 0
+            for table in ("route", "availableroute"):
+                result = session.exec(text(
+                    f'UPDATE {table} SET "SostavIds" = {sostav_ids_sql} WHERE "SostavIds" IS NULL'
+                ))
+                filled += max(result.rowcount or 0, 0)
+        else:
+            filled = 0
+            for model in (Route, AvailableRoute):
+                rows = session.exec(select(model.id, model.Sostav).where(model.SostavIds.is_(None))).all()
+                for route_id, sostav in rows:
+                    session.exec(
+                        model.__table__.update()
+                        .where(model.__table__.c.id == route_id)
+                        .values(SostavIds=parse_sostav(sostav))
+                    )
+                filled += len(rows)
+        session.commit()
+
+        if filled:
+            logger.info(f"Заполнен состав маршрутов в виде массива: {filled}")
+        return filled
+
+    except Exception as e:
+        logger.error(f"Ошибка при заполнении SostavIds: {e}")
+        session.rollback()
+        raise
+
+
+def find_routes_containing_concerts(session: Session, concert_ids: Iterable[int],
+                                    available_only: bool = False,
+                                    limit: Optional[int] = None) -> List:
+    """
+    Находит маршруты, в состав которых входят все указанные концерты.
+    В PostgreSQL используется оператор @> по GIN-индексу на SostavIds,
+    в остальных СУБД — RouteConcertLink
+
+    Args:
+        session: Сессия базы данных
+        concert_ids: ID концертов в терминах состава маршрута
+        available_only: Искать только среди AvailableRoute
+        limit: Максимальное количество маршрутов
+
+    Returns:
+        List: Маршруты (Route или AvailableRoute), сначала самые короткие
+    """
+    concert_ids = sorted({int(c) for c in concert_ids})
+    if not concert_ids:
+        return []
+
+    model = AvailableRoute if available_only else Route
+    if session.get_bind().dialect.name == "postgresql":
+        condition = model.SostavIds.contains(concert_ids)
+    else:
+        matching_routes = (
+            select(RouteConcertLink.route_id)
+            .where(RouteConcertLink.concert_id.in_(concert_ids))
+            .group_by(RouteConcertLink.route_id)
+            .having(func.count() == len(concert_ids))
+        )
+        route_id_column = AvailableRoute.original_route_id if available_only else Route.id
+        condition = route_id_column.in_(matching_routes)
+
+    query = select(model).where(condition).order_by(model.Concerts, model.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return session.exec(query).all()
+
+
+def rebuild_route_concert_links(session: Session) -> int:
+    """
+    Перестраивает RouteConcertLink по составам маршрутов.
+    Связи строятся в теневой таблице и подменяют живую целиком, поэтому проверки доступности
+    во время перестроения видят прежние связи. В PostgreSQL состав разбирается прямо в базе,
+    маршруты не копируются в Python
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        int: Количество связей маршрут-концерт
+    """
+    try:
+        with shadow_table(session, RouteConcertLink.__table__) as shadow:
+            if session.get_bind().dialect.name == "postgresql":
+                session.exec(text(
+                    f'INSERT INTO "{shadow.name}" (route_id, concert_id) '
+                    "SELECT DISTINCT r.id, (m[1])::int "
+                    "FROM route r, regexp_matches(r.\"Sostav\", '\\d+', 'g') AS m"
+                ))
+            else:
+                rows = session.exec(select(Route.id, Route.SostavIds, Route.Sostav)).all()
+                links = [
+                    {"route_id": route_id, "concert_id": concert_id}
+                    for route_id, sostav_ids, sostav in rows
+                    for concert_id in (sostav_ids if sostav_ids is not None else parse_sostav(sostav))
+                ]
+                if links:
+                    session.exec(insert(shadow), params=links)
+            session.commit()
+
+        links_count = session.exec(select(func.count()).select_from(RouteConcertLink)).one()
+        logger.info(f"Связи маршрут-концерт перестроены: {links_count}")
+        return links_count
+
+    except Exception as e:
+        logger.error(f"Ошибка при перестроении связей маршрут-концерт: {e}")
+        session.rollback()
+        raise
+
+
+def ensure_route_concert_links(session: Session) -> bool:
+    """
+    Строит RouteConcertLink, если маршруты есть, а связей ещё нет (база создана до появления таблицы)
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        bool: True если связи были построены
+    """
+    has_links = session.exec(select(RouteConcertLink.route_id).limit(1)).first() is not None
+    has_routes = session.exec(select(Route.id).limit(1)).first() is not None
+    if has_routes and not has_links:
+        rebuild_route_concert_links(session)
+        return True
+    return False
+
+
+def _route_blocked_clause(route_id_column):
+    """Условие: в маршруте есть концерт без билетов или отсутствующий в базе"""
+    return exists(
+        select(RouteConcertLink.route_id)
+        .select_from(RouteConcertLink)
+        .outerjoin(Concert, and_(
+            Concert.external_id == RouteConcertLink.concert_id,
+            Concert.tickets_available == True
+        ))
+        .where(RouteConcertLink.route_id == route_id_column, Concert.id.is_(None))
+    )
+
+
+def _route_has_concerts_clause(route_id_column):
+    """Условие: у маршрута есть хотя бы один концерт"""
+    return exists(
+        select(RouteConcertLink.route_id).where(RouteConcertLink.route_id == route_id_column)
+    )
+
+
+def refresh_available_routes_sql(session: Session) -> Dict[str, int]:
+    """
+    Приводит AvailableRoute в соответствие с доступностью концертов двумя SQL-операторами:
+    DELETE ... WHERE EXISTS для ставших недоступными маршрутов и INSERT ... SELECT для новых.
+    Каталог маршрутов не передаётся через Python
+
+    Args:
+        session: Сессия базы данных
+
+    Returns:
+        Dict: {'deleted_count': int, 'added_count': int}
+    """
+    deleted = session.exec(
+        delete(AvailableRoute).where(or_(
+            AvailableRoute.original_route_id.is_(None),
+            ~_route_has_concerts_clause(AvailableRoute.original_route_id),
+            _route_blocked_clause(AvailableRoute.original_route_id)
+        ))
+    )
+    deleted_count = max(deleted.rowcount or 0, 0)
+
+    added_count = _available_route_insert(session, and_(
+        _route_has_concerts_clause(Route.id),
+        ~_route_blocked_clause(Route.id),
+        ~exists(select(AvailableRoute.id).where(AvailableRoute.original_route_id == Route.id))
+    ))
+    return {'deleted_count': deleted_count, 'added_count': added_count}
+
+
+def rebuild_available_routes(session: Session, status_dict: Dict = None) -> Dict[str, int]:
+    """
+    Полностью перестраивает AvailableRoute после загрузки каталога маршрутов.
+    Доступные маршруты копируются в теневую таблицу, которая затем атомарно подменяет живую:
+    читатели до конца перестроения видят прежний набор доступных маршрутов
+
+    Args:
+        session: Сессия базы данных
+        status_dict: Словарь статуса проверки (progress, available_count)
+
+    Returns:
+        Dict: {'total_routes': int, 'available_routes': int, 'unavailable_routes': int}
+    """
+    try:
+        total_routes = session.exec(select(func.count(Route.id))).one()
+        ensure_route_concert_links(session)
+        with shadow_table(session, AvailableRoute.__table__) as shadow:
+            available_count = _available_route_insert(session, and_(
+                _route_has_concerts_clause(Route.id),
+                ~_route_blocked_clause(Route.id)
+            ), target=shadow)
+            session.commit()
+
+        if status_dict is not None:
+            status_dict["progress"] = total_routes
+            status_dict["available_count"] = available_count
+
+        update_available_routes_cache(session, available_count)
+        from services.crud.tickets import get_available_concerts_count
+        update_available_concerts_cache(session, get_available_concerts_count(session))
+
+        logger.info(f"AvailableRoute перестроены: {available_count} доступных из {total_routes} маршрутов")
+        return {
+            'total_routes': total_routes,
+            'available_routes': available_count,
+            'unavailable_routes': total_routes - available_count
+        }
+
+    except Exception as e:
+        logger.error(f"Ошибка при перестроении AvailableRoute: {e}")
+        session.rollback()
+        raise
+
+
 def init_available_routes(session: Session, status_dict: Dict = None) -> Dict[str, int]:
     """
-    Инициализирует AvailableRoute, копируя все доступные маршруты
+    Инициализирует AvailableRoute, копируя все доступные маршруты.
+    Доступность вычисляется в базе по RouteConcertLink, маршруты не загружаются в Python
     
     Args:
         session: Сессия базы данных
@@ -119,62 +882,27 @@ def init_available_routes(session: Session, status_dict: Dict = None) -> Dict[st
         logger.info("Начинаем инициализацию AvailableRoute...")
         
         # Проверяем, есть ли уже AvailableRoute
-        existing_count = len(session.exec(select(AvailableRoute)).all())
+        existing_count = _count_available_routes(session)
         if existing_count > 0:
             logger.info(f"AvailableRoute уже существуют ({existing_count} записей), пропускаем инициализацию")
             return {
-                'total_routes': len(session.exec(select(Route)).all()),
+                'total_routes': session.exec(select(func.count(Route.id))).one(),
                 'available_routes': existing_count,
                 'unavailable_routes': 0
             }
         
-        # Очищаем старые данные
-        session.exec(delete(AvailableRoute))
-        session.commit()
-        logger.info("Удалены старые записи AvailableRoute")
-        
-        # Получаем все маршруты и кэшируем концерты
-        all_routes = session.exec(select(Route)).all()
-        total_routes = len(all_routes)
+        # Копируем доступные маршруты одним INSERT ... SELECT
+        total_routes = session.exec(select(func.count(Route.id))).one()
         logger.info(f"Найдено {total_routes} маршрутов для проверки")
         
-        # Кэшируем все концерты для быстрого доступа
-        all_concerts = session.exec(select(Concert)).all()
-        concerts_by_external_id = {c.external_id: c for c in all_concerts}
-        logger.info(f"Кэшировано {len(concerts_by_external_id)} концертов")
-        
-        available_routes = []
-        unavailable_count = 0
-        
-        # Логируем прогресс каждые 1000 маршрутов
-        for i, route in enumerate(all_routes, 1):
-            if is_route_available_optimized(session, route, concerts_by_external_id):
-                # Создаём копию маршрута для AvailableRoute
-                available_route_data = route.model_dump()
-                available_route_data['original_route_id'] = route.id
-                available_route_data['last_availability_check'] = datetime.now(timezone.utc)
-                
-                available_route = AvailableRoute(**available_route_data)
-                available_routes.append(available_route)
-            else:
-                unavailable_count += 1
-            
-            # Логируем прогресс каждые 1000 маршрутов
-            if i % 1000 == 0 or i == total_routes:
-                percent = (i / total_routes) * 100 if total_routes > 0 else 100
-                logger.info(f"Проверено {i}/{total_routes} маршрутов ({percent:.1f}%) - найдено доступных: {len(available_routes)}")
-                
-                # Обновляем глобальный статус, если передан
-                if status_dict is not None:
-                    status_dict["progress"] = i
-                    status_dict["available_count"] = len(available_routes)
-        
-        # Сохраняем доступные маршруты
-        if available_routes:
-            session.add_all(available_routes)
-            session.commit()
+        ensure_route_concert_links(session)
+        available_count = refresh_available_routes_sql(session)['added_count']
+        session.commit()
+        unavailable_count = total_routes - available_count
         
-        available_count = len(available_routes)
+        if status_dict is not None:
+            status_dict["progress"] = total_routes
+            status_dict["available_count"] = available_count
         
         # Обновляем кэш количества доступных маршрутов
         update_available_routes_cache(session, available_count)
@@ -201,7 +929,8 @@ def init_available_routes(session: Session, status_dict: Dict = None) -> Dict[st
 def update_available_routes(session: Session, status_dict: Dict = None) -> Dict[str, int]:
     """
     Обновляет AvailableRoute, удаляя маршруты с недоступными концертами
-    и добавляя маршруты, которые снова стали доступными
+    и добавляя маршруты, которые снова стали доступными.
+    Разница вычисляется и применяется набором SQL-операторов без чтения каталога в Python
     
     Args:
         session: Сессия базы данных
@@ -212,82 +941,33 @@ def update_available_routes(session: Session, status_dict: Dict = None) -> Dict[
     try:
         logger.info("Начинаем обновление AvailableRoute...")
         
-        # Получаем текущие доступные маршруты и все маршруты одним запросом
-        current_available = session.exec(select(AvailableRoute)).all()
-        current_count = len(current_available)
-        
-        # Получаем все оригинальные маршруты одним запросом
-        all_routes = session.exec(select(Route)).all()
-        routes_by_id = {route.id: route for route in all_routes}
-        
-        # Кэшируем все концерты для быстрого доступа
-        all_concerts = session.exec(select(Concert)).all()
-        concerts_by_external_id = {c.external_id: c for c in all_concerts}
+        current_count = _count_available_routes(session)
+        total_routes = session.exec(select(func.count(Route.id))).one()
         
-        # Получаем все существующие AvailableRoute одним запросом
-        existing_available_route_ids = {
-            ar.original_route_id for ar in current_available
-        }
+        # Вся разница вычисляется и применяется в базе
+        ensure_route_concert_links(session)
+        delta = refresh_available_routes_sql(session)
+        deleted_count = delta['deleted_count']
+        added_count = delta['added_count']
+        session.commit()
         
-        # Проверяем каждый доступный маршрут
-        routes_to_delete = []
-        for available_route in current_available:
-            original_route = routes_by_id.get(available_route.original_route_id)
-            if not original_route or not is_route_available_optimized(session, original_route, concerts_by_external_id):
-                routes_to_delete.append(available_route)
-        
-        # Удаляем недоступные маршруты батчем
-        deleted_count = len(routes_to_delete)
-        if routes_to_delete:
-            # Используем bulk delete для оптимизации
-            route_ids_to_delete = [route.id for route in routes_to_delete]
-            session.exec(delete(AvailableRoute).where(AvailableRoute.id.in_(route_ids_to_delete)))
+        if deleted_count:
             logger.info(f"Удалено {deleted_count} недоступных маршрутов")
+        if added_count:
+            logger.info(f"Добавлено {added_count} снова доступных маршрутов")
         
-        # Проверяем, не стали ли доступными новые маршруты
-        routes_to_add = []
-        total_routes = len(all_routes)
-        
-        logger.info(f"Проверяем {total_routes} маршрутов на доступность...")
-        
-        for i, route in enumerate(all_routes, 1):
-            # Проверяем, есть ли уже этот маршрут в AvailableRoute (используем кэш)
-            if route.id not in existing_available_route_ids and is_route_available_optimized(session, route, concerts_by_external_id):
-                # Создаём новую запись AvailableRoute
-                available_route_data = route.model_dump()
-                available_route_data['original_route_id'] = route.id
-                available_route_data['last_availability_check'] = datetime.now(timezone.utc)
-                
-                available_route = AvailableRoute(**available_route_data)
-                routes_to_add.append(available_route)
-            
-            # Логируем прогресс каждые 1000 маршрутов
-            if i % 1000 == 0 or i == total_routes:
-                percent = (i / total_routes) * 100 if total_routes > 0 else 100
-                logger.info(f"Проверено {i}/{total_routes} маршрутов ({percent:.1f}%) - найдено новых доступных: {len(routes_to_add)}")
-                
-                # Обновляем глобальный статус, если передан
-                if status_dict is not None:
-                    status_dict["progress"] = i
-                    # Общее количество доступных маршрутов = текущие - удалённые + новые
-                    status_dict["available_count"] = current_count - deleted_count + len(routes_to_add)
-        
-        # Добавляем новые доступные маршруты
-        added_count = 0
-        if routes_to_add:
-            session.add_all(routes_to_add)
-            added_count = len(routes_to_add)
-        
-        session.commit()
-        
-        # Получаем финальное количество
-        final_count = len(session.exec(select(AvailableRoute)).all())
+        final_count = current_count - deleted_count + added_count
+        if status_dict is not None:
+            status_dict["progress"] = total_routes
+            status_dict["available_count"] = final_count
         
         # Обновляем кэш количества доступных маршрутов
         update_available_routes_cache(session, final_count)
         
         # Обновляем кэш количества концертов в продаже
-        available_concerts_count = len(session.exec(select(Concert).where(Concert.tickets_available == True)).all())
+        available_concerts_count = session.exec(
+            select(func.count(Concert.id)).where(Concert.tickets_available == True)
+        ).one()
         update_available_concerts_cache(session, available_concerts_count)
         
         logger.info(f"Обновление завершено: удалено {deleted_count}, добавлено {added_count}, всего доступно {final_count}")
@@ -306,6 +986,172 @@ def update_available_routes(session: Session, status_dict: Dict = None) -> Dict[
         raise
 
 
+def on_concert_availability_changed(session: Session, concert_ids: Iterable[int]) -> Dict[str, int]:
+    """
+    Обновляет AvailableRoute после изменения доступности отдельных концертов.
+    По обратному индексу концерт → маршруты перепроверяются только маршруты,
+    содержащие изменившиеся концерты
+    
+    Args:
+        session: Сессия базы данных
+        concert_ids: Внешние ID концертов (Concert.external_id), у которых изменился tickets_available
+        
+    Returns:
+        Dict с статистикой изменений
+    """
+    try:
+        concert_ids = list(concert_ids)
+        index = get_route_index(session)
+        route_positions = index.routes_for_concerts(concert_ids)
+        previous_version = get_route_data_version(session)
+        
+        if not len(route_positions):
+            logger.info(f"Концерты {concert_ids} не входят ни в один маршрут, AvailableRoute не изменены")
+            return {'affected_routes': 0, 'deleted_count': 0, 'added_count': 0}
+        
+        # Перепроверяем только затронутые маршруты
+        blocked = index.blocked_concerts(get_available_concert_ids(session))
+        available = index.available_mask(blocked, route_positions)
+        affected_route_ids = index.route_ids[route_positions].tolist()
+        target_route_ids = set(index.route_ids[route_positions[available]].tolist())
+        
+        # Текущее состояние затронутых маршрутов
+        existing_route_ids = set()
+        rows_to_delete = []
+        for start in range(0, len(affected_route_ids), AVAILABILITY_BATCH_SIZE):
+            chunk = affected_route_ids[start:start + AVAILABILITY_BATCH_SIZE]
+            current_available = session.exec(
+                select(AvailableRoute.id, AvailableRoute.original_route_id)
+                .where(AvailableRoute.original_route_id.in_(chunk))
+            ).all()
+            for available_route_id, original_route_id in current_available:
+                if original_route_id not in target_route_ids or original_route_id in existing_route_ids:
+                    rows_to_delete.append(available_route_id)
+                else:
+                    existing_route_ids.add(original_route_id)
+        
+        deleted_count = _delete_available_routes(session, rows_to_delete)
+        added_count = _copy_routes_to_available(session, sorted(target_route_ids - existing_route_ids))
+        session.commit()
+        
+        if deleted_count or added_count:
+            update_available_routes_cache(
+                session, get_cached_available_routes_count(session) - deleted_count + added_count
+            )
+        else:
+            # AvailableRoute не изменились, но доступность маршрутов могла измениться (маска подборок)
+            _increment_statistic(session, AVAILABILITY_VERSION_KEY)
+            session.commit()
+        _patch_availability_mask(previous_version, get_route_data_version(session), route_positions, available)
+        
+        logger.info(f"Изменение доступности концертов {concert_ids}: проверено {len(affected_route_ids)} маршрутов, удалено {deleted_count}, добавлено {added_count}")
+        
+        return {
+            'affected_routes': len(affected_route_ids),
+            'deleted_count': deleted_count,
+            'added_count': added_count
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка при инкрементальном обновлении AvailableRoute: {e}")
+        session.rollback()
+        raise
+
+
+def on_routes_changed(session: Session, route_ids: Iterable[int]) -> Dict[str, int]:
+    """
+    Обновляет RouteConcertLink и AvailableRoute только для добавленных, изменённых или удалённых маршрутов
+    (например, после повторной загрузки файла маршрутов)
+    
+    Args:
+        session: Сессия базы данных
+        route_ids: ID затронутых маршрутов
+        
+    Returns:
+        Dict с статистикой изменений
+    """
+    try:
+        route_ids = sorted(set(route_ids))
+        deleted_count, added_count = 0, 0
+        for start in range(0, len(route_ids), AVAILABILITY_BATCH_SIZE):
+            chunk = route_ids[start:start + AVAILABILITY_BATCH_SIZE]
+            
+            # Состав маршрутов для SQL-проверки доступности
+            session.exec(delete(RouteConcertLink).where(RouteConcertLink.route_id.in_(chunk)))
+            rows = session.exec(select(Route.id, Route.SostavIds, Route.Sostav).where(Route.id.in_(chunk))).all()
+            links = [
+                {"route_id": route_id, "concert_id": concert_id}
+                for route_id, sostav_ids, sostav in rows
+                for concert_id in (sostav_ids if sostav_ids is not None else parse_sostav(sostav))
+            ]
+            if links:
+                session.exec(insert(RouteConcertLink.__table__), params=links)
+            
+            # Копии в AvailableRoute пересоздаются, чтобы отражать новые метрики маршрута
+            result = session.exec(delete(AvailableRoute).where(AvailableRoute.original_route_id.in_(chunk)))
+            deleted_count += max(result.rowcount or 0, 0)
+            added_count += _available_route_insert(session, and_(
+                Route.id.in_(chunk), _route_has_concerts_clause(Route.id), ~_route_blocked_clause(Route.id)
+            ))
+        session.commit()
+        
+        if deleted_count != added_count:
+            update_available_routes_cache(
+                session, get_cached_available_routes_count(session) - deleted_count + added_count
+            )
+        
+        logger.info(f"Обновлены затронутые маршруты: {len(route_ids)}, AvailableRoute удалено {deleted_count}, добавлено {added_count}")
+        return {
+            'affected_routes': len(route_ids),
+            'deleted_count': deleted_count,
+            'added_count': added_count
+        }
+        
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении затронутых маршрутов: {e}")
+        session.rollback()
+        raise
+
+
+def delete_routes(session: Session, route_ids: Iterable[int]) -> List[str]:
+    """
+    Удаляет маршруты вместе с их связями, копиями в AvailableRoute и сопоставлениями покупателей
+    
+    Args:
+        session: Сессия базы данных
+        route_ids: ID удаляемых маршрутов
+        
+    Returns:
+        List[str]: Внешние ID покупателей, чьи сопоставления ссылались на удалённые маршруты
+    """
+    try:
+        route_ids = sorted(set(route_ids))
+        if not route_ids:
+            return []
+        
+        affected_customers = set()
+        for start in range(0, len(route_ids), AVAILABILITY_BATCH_SIZE):
+            chunk = route_ids[start:start + AVAILABILITY_BATCH_SIZE]
+            affected_customers.update(session.exec(
+                select(CustomerRouteMatch.user_external_id).where(CustomerRouteMatch.best_route_id.in_(chunk))
+            ).all())
+            session.exec(delete(CustomerRouteMatch).where(CustomerRouteMatch.best_route_id.in_(chunk)))
+            session.exec(delete(RouteConcertLink).where(RouteConcertLink.route_id.in_(chunk)))
+            session.exec(delete(AvailableRoute).where(AvailableRoute.original_route_id.in_(chunk)))
+            session.exec(delete(Route).where(Route.id.in_(chunk)))
+        session.commit()
+        
+        # Количество доступных маршрутов пересчитывается целиком: удалённые могли быть доступными
+        update_available_routes_cache(session, _count_available_routes(session))
+        logger.info(f"Удалено маршрутов: {len(route_ids)}, затронуто сопоставлений покупателей: {len(affected_customers)}")
+        return sorted(affected_customers)
+        
+    except Exception as e:
+        logger.error(f"Ошибка при удалении маршрутов: {e}")
+        session.rollback()
+        raise
+
+
 def get_available_routes_stats(session: Session) -> Dict[str, int]:
     """
     Получает статистику по доступным маршрутам
@@ -378,6 +1224,40 @@ def ensure_available_routes_exist(session: Session, status_dict: Dict = None) ->
         raise
 
 
+def ensure_route_indexes(session: Session):
+    """
+    Создаёт индексы таблиц маршрутов в уже существующей базе (create_all не добавляет их к готовым таблицам)
+    
+    Args:
+        session: Сессия базы данных
+    """
+    try:
+        session.exec(text(
+            "CREATE INDEX IF NOT EXISTS ix_availableroute_original_route_id "
+            "ON availableroute (original_route_id)"
+        ))
+        # Уникальный состав маршрута нужен для слияния при импорте (ON CONFLICT)
+        session.exec(text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS "ix_route_Sostav" ON route ("Sostav")'
+        ))
+        # Одна строка сопоставления на покупателя: точечный пересчёт пишет через ON CONFLICT
+        match_indexes = inspect(session.connection()).get_indexes("customerroutematch")
+        if not any(ix["unique"] and ix["column_names"] == ["user_external_id"] for ix in match_indexes):
+            session.exec(text(
+                "DELETE FROM customerroutematch WHERE id NOT IN "
+                "(SELECT max(id) FROM customerroutematch GROUP BY user_external_id)"
+            ))
+            session.exec(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_customerroutematch_user_external_id "
+                "ON customerroutematch (user_external_id)"
+            ))
+        session.commit()
+        logger.info("Индексы таблиц маршрутов проверены")
+    except Exception as e:
+        logger.error(f"Ошибка при создании индексов таблиц маршрутов: {e}")
+        session.rollback()
+
+
 def update_available_routes_cache(session: Session, available_count: int):
     """
     Обновляет кэшированное количество доступных маршрутов в таблице Statistics
@@ -402,6 +1282,8 @@ def update_available_routes_cache(session: Session, available_count: int):
                 updated_at=datetime.now(timezone.utc)
             )
             session.add(stats_record)
+        # AvailableRoute изменились — кэши, зависящие от доступности, должны обновиться
+        _increment_statistic(session, AVAILABILITY_VERSION_KEY)
         
         session.commit()
         logger.info(f"Кэш количества доступных маршрутов обновлён: {available_count}")
@@ -0,0 +1,135 @@
+"""
+Перестроение производных таблиц через теневую копию.
+
+Новое содержимое таблицы (AvailableRoute, RouteConcertLink, CustomerRouteMatch)
+пишется в теневую таблицу, которую читатели не видят, и подменяет живую таблицу
+в одной короткой транзакции. Читатели не блокируются на время перестроения
+и никогда не видят пустую или частично заполненную таблицу.
+
+В PostgreSQL теневая таблица создаётся UNLOGGED (массовая запись и построение
+индексов не пишутся в WAL), индексы и ограничения строятся после заполнения,
+а подмена выполняется переименованием. В остальных СУБД (SQLite в тестах)
+содержимое переносится в живую таблицу одной транзакцией.
+"""
+import re
+import logging
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlmodel import Session
+from sqlalchemy import Column, MetaData, Table, text
+
+logger = logging.getLogger(__name__)
+
+# Суффикс имён теневой таблицы и её индексов/ограничений до подмены
+SHADOW_SUFFIX = "__shadow"
+
+
+def _shadow_name(name: str) -> str:
+    return f"{name}{SHADOW_SUFFIX}"
+
+
+def _create_shadow(session: Session, table: Table, is_postgres: bool) -> Table:
+    """Создаёт пустую теневую таблицу со столбцами живой таблицы"""
+    shadow_name = _shadow_name(table.name)
+    # Теневая таблица могла остаться после прерванного перестроения
+    session.exec(text(f'DROP TABLE IF EXISTS "{shadow_name}"'))
+    if is_postgres:
+        session.exec(text(f'CREATE UNLOGGED TABLE "{shadow_name}" (LIKE "{table.name}" INCLUDING DEFAULTS)'))
+    else:
+        session.exec(text(f'CREATE TABLE "{shadow_name}" AS SELECT * FROM "{table.name}" WHERE 0'))
+    session.commit()
+    return Table(shadow_name, MetaData(), *[Column(column.name, column.type) for column in table.columns])
+
+
+def _swap_postgres(session: Session, table: Table, shadow: Table) -> None:
+    """
+    Строит индексы и ограничения теневой таблицы по образцу живой
+    и подменяет живую таблицу переименованием в одной транзакции
+    """
+    live, shadow_name = table.name, shadow.name
+    constraints = session.exec(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table AS regclass) AND contype IN ('p', 'u', 'f', 'c') "
+        "ORDER BY contype DESC"  # сначала первичный и уникальные ключи
+    ), params={"table": f'"{live}"'}).all()
+    constraint_names = {name for name, _ in constraints}
+    indexes = session.exec(text(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = :table"
+    ), params={"table": live}).all()
+    sequences = session.exec(text(
+        "SELECT attname, pg_get_serial_sequence(:quoted, attname) FROM pg_attribute "
+        "WHERE attrelid = CAST(:quoted AS regclass) AND attnum > 0 AND NOT attisdropped "
+        "AND pg_get_serial_sequence(:quoted, attname) IS NOT NULL"
+    ), params={"quoted": f'"{live}"'}).all()
+
+    # Индексы строятся по уже заполненной таблице — один проход вместо обновления на каждую строку
+    for name, definition in constraints:
+        session.exec(text(
+            f'ALTER TABLE "{shadow_name}" ADD CONSTRAINT "{_shadow_name(name)}" {definition}'
+        ))
+    for name, definition in indexes:
+        if name in constraint_names:
+            continue
+        definition = re.sub(
+            r" INDEX .+? ON (ONLY )?\S+ ",
+            f' INDEX "{_shadow_name(name)}" ON "{shadow_name}" ',
+            definition, count=1
+        )
+        session.exec(text(definition))
+    session.exec(text(f'ALTER TABLE "{shadow_name}" SET LOGGED'))
+    session.exec(text(f'ANALYZE "{shadow_name}"'))
+    session.commit()
+
+    # Подмена: читатели ждут только переименования
+    session.exec(text(f'LOCK TABLE "{live}" IN ACCESS EXCLUSIVE MODE'))
+    for column_name, sequence in sequences:
+        session.exec(text(f'ALTER SEQUENCE {sequence} OWNED BY "{shadow_name}"."{column_name}"'))
+    session.exec(text(f'DROP TABLE "{live}"'))
+    session.exec(text(f'ALTER TABLE "{shadow_name}" RENAME TO "{live}"'))
+    for name in constraint_names:
+        session.exec(text(f'ALTER TABLE "{live}" RENAME CONSTRAINT "{_shadow_name(name)}" TO "{name}"'))
+    for name, _ in indexes:
+        if name not in constraint_names:
+            session.exec(text(f'ALTER INDEX "{_shadow_name(name)}" RENAME TO "{name}"'))
+    session.commit()
+
+
+def _swap_generic(session: Session, table: Table, shadow: Table) -> None:
+    """Переносит содержимое теневой таблицы в живую одной транзакцией"""
+    columns = ", ".join(f'"{column.name}"' for column in table.columns)
+    session.exec(text(f'DELETE FROM "{table.name}"'))
+    session.exec(text(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{shadow.name}"'))
+    session.exec(text(f'DROP TABLE "{shadow.name}"'))
+    session.commit()
+
+
+@contextmanager
+def shadow_table(session: Session, table: Table) -> Iterator[Table]:
+    """
+    Перестраивает таблицу через теневую копию.
+    Внутри блока новое содержимое пишется в теневую таблицу (можно фиксировать порциями),
+    при выходе без ошибок она атомарно подменяет живую; при ошибке живая таблица не меняется
+
+    Args:
+        session: Сессия базы данных
+        table: Живая таблица (например: AvailableRoute.__table__)
+
+    Returns:
+        Iterator[Table]: Теневая таблица с теми же столбцами, для INSERT ... SELECT и пакетных вставок
+    """
+    is_postgres = session.get_bind().dialect.name == "postgresql"
+    shadow = _create_shadow(session, table, is_postgres)
+    try:
+        yield shadow
+        if is_postgres:
+            _swap_postgres(session, table, shadow)
+        else:
+            _swap_generic(session, table, shadow)
+    except Exception:
+        session.rollback()
+        session.exec(text(f'DROP TABLE IF EXISTS "{shadow.name}"'))
+        session.commit()
+        raise
+    logger.info(f"Таблица {table.name} перестроена через теневую копию")
@@ -85,6 +85,9 @@ class TicketsService:
             
             result = {}
             
+            # Запоминаем исходную доступность, чтобы обновить только затронутые маршруты
+            initial_availability = {c.id: c.tickets_available for c in concerts}
+            
             # Определяем общее количество концертов
             total_concerts = len(concerts)
             
@@ -169,13 +172,18 @@ class TicketsService:
                 except Exception as e:
                     logger.error(f"Ошибка при обновлении кэша концертов: {e}")
                 
-                # Обновляем доступные маршруты после изменения данных о билетах
-                try:
-                    from services.crud.route_service import update_available_routes
-                    routes_update_result = update_available_routes(session)
-                    logger.info(f"Доступные маршруты обновлены: {routes_update_result}")
-                except Exception as e:
-                    logger.error(f"Ошибка при обновлении доступных маршрутов: {e}")
+                # Обновляем только маршруты с концертами, у которых изменилась доступность
+                changed_concert_ids = [
+                    c.external_id for c in concerts
+                    if initial_availability.get(c.id) != c.tickets_available
+                ]
+                if changed_concert_ids:
+                    try:
+                        from services.crud.route_service import on_concert_availability_changed
+                        routes_update_result = on_concert_availability_changed(session, changed_concert_ids)
+                        logger.info(f"Доступные маршруты обновлены: {routes_update_result}")
+                    except Exception as e:
+                        logger.error(f"Ошибка при обновлении доступных маршрутов: {e}")
             
             logger.info(f"Получена информация о билетах для {len(result)} концертов (доступно: {sum(1 for r in result.values() if r['available'])})")
             return result
@@ -1,4 +1,4 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from sqlmodel import Session, select
 from models.route import Route
 from models.composition import Author, Composition
@@ -6,107 +6,838 @@ from models.artist import Artist
 from models.concert import Concert
 from models.hall import Hall
 from models.user import User
+from services.crud import route_service
+from services.route_ranking import RouteRankingIndex, top_k_positions
+from services.route_similarity import RouteSimilarityIndex, most_similar_routes, most_similar_routes_batch
+from collections import OrderedDict
+from itertools import islice
+import numpy as np
+import copy
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Веса приоритетов анкеты: (вес IntellectScore, вес ComfortScore)
+PRIORITY_WEIGHTS = {
+    "intellect": (1.0, 0.0),
+    "comfort": (0.0, 1.0),
+    "balance": (0.5, 0.5)
+}
+
+# Пороги анкеты «разнообразие»: mono — день одного композитора, diverse — микс композиторов
+MONO_MIN_TOP_COMPOSER_SHARE = 0.6
+DIVERSE_MIN_COMPOSERS = 3
+DIVERSE_MAX_TOP_COMPOSER_SHARE = 0.5
+
+# Кэш рейтингов маршрутов (перестраивается при смене версии каталога)
+_route_ranking_cache = None
+_route_ranking_lock = threading.Lock()
+
+# Рейтинги только по доступным маршрутам: (рейтинги, маска доступности, отфильтрованные рейтинги)
+_available_ranking_cache = None
+
+# Кэш MinHash LSH индекса составов (перестраивается при смене версии каталога)
+_route_similarity_cache = None
+_route_similarity_lock = threading.Lock()
+
+# Кэш готовых подборок: ключ — хэш нормализованной анкеты и версии данных маршрутов
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024"))
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "300"))
+_recommendation_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_recommendation_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_recommendation_cache_lock = threading.Lock()
+
+# Предвычисленные подборки для дискретной части анкеты (priority × окно min/max_concerts):
+# фоновое задание пересчитывает их при смене версии каталога или доступных маршрутов
+RECOMMENDATION_PRECOMPUTE_TOP_N = 10
+RECOMMENDATION_PRECOMPUTE_INTERVAL = float(os.getenv("RECOMMENDATION_PRECOMPUTE_INTERVAL", "30"))
+_PRECOMPUTED_PREFERENCES = {"priority", "min_concerts", "max_concerts"}
+_precomputed = {"version": None, "results": {}, "built_at": None}
+_precomputed_stats = {"hits": 0}
+_precompute_lock = threading.Lock()
+_precompute_wakeup = threading.Event()
+_precompute_thread: Optional[threading.Thread] = None
+
+# Размер порции запросов пакетных подборок (iter_recommendations_batch)
+RECOMMENDATION_BATCH_SIZE = 1000
+
+# Поля анкеты со списками ID: порядок и повторы не влияют на подборки
+_ID_LIST_PREFERENCES = (
+    "composers", "artists", "concerts",
+    "exclude_composers", "exclude_artists", "exclude_concerts",
+    "planned_concerts",
+)
+
+
+def get_route_ranking_index(catalog) -> RouteRankingIndex:
+    """
+    Возвращает рейтинги маршрутов для текущей версии каталога, строя их при смене версии
+
+    Args:
+        catalog: RouteCatalog
+
+    Returns:
+        RouteRankingIndex: Рейтинги маршрутов по корзинам количества концертов
+    """
+    global _route_ranking_cache
+    with _route_ranking_lock:
+        if _route_ranking_cache is None or _route_ranking_cache.key != catalog.key:
+            _route_ranking_cache = RouteRankingIndex.from_catalog(catalog, PRIORITY_WEIGHTS)
+        return _route_ranking_cache
+
+
+def get_available_route_ranking_index(catalog, available: np.ndarray) -> RouteRankingIndex:
+    """
+    Возвращает рейтинги маршрутов, из корзин которых убраны недоступные маршруты.
+    Маска доступности кэшируется по get_route_data_version (новая версия — новый массив),
+    поэтому рейтинги фильтруются один раз на версию, а запросы берут готовые головы корзин
+
+    Args:
+        catalog: RouteCatalog
+        available: Маска доступности маршрутов (get_route_availability_mask)
+
+    Returns:
+        RouteRankingIndex: Рейтинги доступных маршрутов
+    """
+    global _available_ranking_cache
+    ranking = get_route_ranking_index(catalog)
+    with _route_ranking_lock:
+        cached = _available_ranking_cache
+        if cached is None or cached[0] is not ranking or cached[1] is not available:
+            cached = (ranking, available, ranking.restricted(available))
+            _available_ranking_cache = cached
+        return cached[2]
+
+
+def get_route_similarity_index(catalog) -> RouteSimilarityIndex:
+    """
+    Возвращает MinHash LSH индекс составов для текущей версии каталога, строя его при смене версии
+
+    Args:
+        catalog: RouteCatalog
+
+    Returns:
+        RouteSimilarityIndex: Индекс похожих маршрутов
+    """
+    global _route_similarity_cache
+    with _route_similarity_lock:
+        if _route_similarity_cache is None or _route_similarity_cache.key != catalog.key:
+            _route_similarity_cache = RouteSimilarityIndex.from_catalog(catalog)
+        return _route_similarity_cache
+
+
+def _int_list(value) -> List[int]:
+    """Список ID из анкеты: список или строка через запятую"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [int(item) for item in value if str(item).strip().isdigit()]
+
+
+def _concert_external_ids(session: Session, concert_ids: List[int]) -> List[int]:
+    """Внешние ID концертов (в терминах состава маршрута) по их ID в базе"""
+    if not concert_ids:
+        return []
+    return [
+        external_id for external_id in session.exec(
+            select(Concert.external_id).where(Concert.id.in_(concert_ids), Concert.external_id.is_not(None))
+        ).all()
+    ]
+
+
+def diversity_mask(catalog, diversity: Optional[str]) -> Optional[np.ndarray]:
+    """
+    Маска маршрутов по предпочтению разнообразия (по предвычисленным столбцам каталога)
+
+    Args:
+        catalog: RouteCatalog
+        diversity: "mono", "diverse" или "flexible"
+
+    Returns:
+        Optional[np.ndarray]: Булев массив по позициям каталога или None, если фильтр не нужен
+    """
+    if diversity == 'mono':
+        return catalog.column('TopComposerShare') >= MONO_MIN_TOP_COMPOSER_SHARE
+    if diversity == 'diverse':
+        return (
+            (catalog.column('DistinctComposers') >= DIVERSE_MIN_COMPOSERS)
+            & (catalog.column('TopComposerShare') <= DIVERSE_MAX_TOP_COMPOSER_SHARE)
+        )
+    return None
+
+
+def route_filter_mask(session: Session, preferences: dict) -> Optional[np.ndarray]:
+    """
+    Маска маршрутов каталога по фильтрам анкеты. Каждый фильтр — одна векторная операция
+    над битовыми индексами маршрут×композитор, маршрут×артист и маршрут×концерт:
+    composers/artists/concerts — в маршруте есть хотя бы один из выбранных (AND с маской),
+    exclude_composers/exclude_artists/exclude_concerts — нет ни одного (AND NOT).
+    Концерты анкеты задаются ID в базе (Concert.id)
+
+    Args:
+        session: Сессия базы данных
+        preferences: Анкета пользователя
+
+    Returns:
+        Optional[np.ndarray]: Булев массив по позициям каталога или None, если фильтров нет
+    """
+    filters = []
+    for kind, include_key, exclude_key in (
+        ("composer", "composers", "exclude_composers"),
+        ("artist", "artists", "exclude_artists"),
+        ("concert", "concerts", "exclude_concerts"),
+    ):
+        include, exclude = _int_list(preferences.get(include_key)), _int_list(preferences.get(exclude_key))
+        if kind == "concert":
+            include, exclude = _concert_external_ids(session, include), _concert_external_ids(session, exclude)
+        if include or exclude:
+            filters.append((kind, include, exclude))
+    if not filters:
+        return None
+
+    mask = None
+    for kind, include, exclude in filters:
+        if kind == "concert":
+            index = route_service.get_route_index(session)
+        else:
+            index = route_service.get_route_entity_index(session, kind)
+        part = index.any_mask(include) if include else np.ones(index.n_routes, dtype=bool)
+        if exclude:
+            part &= ~index.any_mask(exclude)
+        logger.info(f"Фильтр «{kind}»: включить {include}, исключить {exclude}, подходит {int(part.sum())} маршрутов")
+        mask = part if mask is None else mask & part
+    return mask
+
+
+def _planned_concert_ids(session: Session, preferences: dict, user_external_id: Optional[str]) -> List[int]:
+    """
+    Концерты для поиска альтернатив: planned_concerts из анкеты (ID в терминах состава маршрута),
+    затем выбранные в анкете концерты (concerts, ID в базе),
+    а если их нет — концерты, на которые покупатель уже купил билеты
+    """
+    planned = _int_list(preferences.get('planned_concerts'))
+    if not planned:
+        planned = _concert_external_ids(session, _int_list(preferences.get('concerts')))
+    if planned or not user_external_id:
+        return planned
+    return _purchased_concert_ids(session, user_external_id)
+
+
+def _purchased_concert_ids(session: Session, user_external_id: str) -> List[int]:
+    """Концерты (ID в терминах состава маршрута), на которые покупатель купил билеты"""
+    from models.purchase import Purchase
+    return [
+        external_id for external_id in session.exec(
+            select(Concert.external_id)
+            .join(Purchase, Purchase.concert_id == Concert.id)
+            .where(Purchase.user_external_id == user_external_id, Concert.external_id.is_not(None))
+            .distinct()
+        ).all()
+    ]
+
+
+def normalize_preferences(preferences: dict) -> dict:
+    """
+    Каноническая форма анкеты для ключа кэша: пустые значения отбрасываются,
+    списки ID сортируются без повторов
+
+    Args:
+        preferences: Анкета пользователя
+
+    Returns:
+        dict: Нормализованная анкета
+    """
+    normalized = {}
+    for key, value in (preferences or {}).items():
+        if key in _ID_LIST_PREFERENCES:
+            value = sorted(set(_int_list(value)))
+        if value is None or value == "" or value == []:
+            continue
+        normalized[key] = value
+    return normalized
+
+
+def recommendation_cache_key(preferences: dict, top_n: int, planned_concerts: List[int], data_version: str) -> str:
+    """
+    Ключ кэша подборок
+
+    Args:
+        preferences: Анкета пользователя
+        top_n: Размер подборок
+        planned_concerts: Концерты для поиска альтернатив (уже определённые по анкете или покупкам)
+        data_version: Версия каталога и доступных маршрутов (route_service.get_route_data_version)
+
+    Returns:
+        str: SHA-256 канонического JSON
+    """
+    payload = normalize_preferences(preferences)
+    payload.pop("planned_concerts", None)
+    payload = {
+        "preferences": payload,
+        "top_n": top_n,
+        "planned_concerts": sorted(set(planned_concerts)),
+        "version": data_version,
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _recommendation_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    with _recommendation_cache_lock:
+        entry = _recommendation_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _recommendation_cache.move_to_end(key)
+            _recommendation_cache_stats["hits"] += 1
+            return entry[1]
+        if entry is not None:
+            del _recommendation_cache[key]
+        _recommendation_cache_stats["misses"] += 1
+        return None
+
+
+def _recommendation_cache_put(key: str, result: Dict[str, Any]) -> None:
+    if RECOMMENDATION_CACHE_SIZE <= 0:
+        return
+    with _recommendation_cache_lock:
+        _recommendation_cache[key] = (time.monotonic() + RECOMMENDATION_CACHE_TTL, result)
+        _recommendation_cache.move_to_end(key)
+        while len(_recommendation_cache) > RECOMMENDATION_CACHE_SIZE:
+            _recommendation_cache.popitem(last=False)
+            _recommendation_cache_stats["evictions"] += 1
+
+
+def get_recommendation_cache_stats() -> Dict[str, Any]:
+    """
+    Счётчики кэша подборок
+
+    Returns:
+        Dict[str, Any]: hits, misses, evictions, size, max_size, ttl_seconds, hit_rate
+    """
+    with _recommendation_cache_lock:
+        stats = dict(_recommendation_cache_stats)
+        stats["size"] = len(_recommendation_cache)
+    stats["max_size"] = RECOMMENDATION_CACHE_SIZE
+    stats["ttl_seconds"] = RECOMMENDATION_CACHE_TTL
+    requests = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / requests, 4) if requests else 0.0
+    return stats
+
+
+def clear_recommendation_cache() -> None:
+    """Очищает кэш и предвычисленные подборки, сбрасывает счётчики"""
+    with _recommendation_cache_lock:
+        _recommendation_cache.clear()
+        for name in _recommendation_cache_stats:
+            _recommendation_cache_stats[name] = 0
+    with _precompute_lock:
+        _precomputed.update(version=None, results={}, built_at=None)
+        _precomputed_stats["hits"] = 0
+
+
+def _precompute_key(catalog, preferences: dict) -> Optional[tuple]:
+    """
+    Ключ предвычисленных подборок: (приоритет, первая корзина окна, последняя корзина окна + 1).
+    None, если анкета содержит поля вне дискретного пространства
+    """
+    normalized = normalize_preferences(preferences)
+    if not set(normalized) <= _PRECOMPUTED_PREFERENCES:
+        return None
+    min_concerts, max_concerts = normalized.get('min_concerts'), normalized.get('max_concerts')
+    if any(value is not None and (not isinstance(value, int) or isinstance(value, bool))
+           for value in (min_concerts, max_concerts)):
+        return None
+    priority = normalized.get('priority', 'balance')
+    if priority not in PRIORITY_WEIGHTS:
+        priority = 'balance'
+    buckets = get_route_ranking_index(catalog).window(min_concerts, max_concerts)
+    return priority, buckets.start, buckets.stop
+
+
+def precompute_recommendations(session: Session, force: bool = False) -> int:
+    """
+    Предвычисляет подборки для всех сочетаний приоритета и окна количества концертов.
+    Разные min_concerts/max_concerts, дающие одно окно корзин каталога, используют одну подборку
+
+    Args:
+        session: Сессия базы данных
+        force: Пересчитать, даже если версия данных не изменилась
+
+    Returns:
+        int: Количество вычисленных подборок (0, если пересчёт не потребовался)
+    """
+    # Версия читается до расчёта: если данные изменятся во время расчёта, результат не будет использован
+    version = route_service.get_route_data_version(session)
+    if not force and _precomputed["version"] == version:
+        return 0
+
+    started = time.monotonic()
+    catalog = route_service.get_route_catalog(session)
+    buckets = get_route_ranking_index(catalog).bucket_values
+    results = {}
+    for priority in PRIORITY_WEIGHTS:
+        for start in range(len(buckets)):
+            for stop in range(start + 1, len(buckets) + 1):
+                # Границы окна — значения крайних корзин: window() вернёт ровно [start, stop)
+                preferences = {
+                    "priority": priority,
+                    "min_concerts": int(buckets[start]),
+                    "max_concerts": int(buckets[stop - 1]),
+                }
+                results[(priority, start, stop)] = _build_recommendations(
+                    session, preferences, RECOMMENDATION_PRECOMPUTE_TOP_N, []
+                )
+
+    with _precompute_lock:
+        _precomputed.update(version=version, results=results, built_at=datetime.now(timezone.utc))
+    logger.info(f"Предвычислено {len(results)} подборок для версии {version} за {time.monotonic() - started:.2f} с")
+    return len(results)
+
+
+def _precomputed_recommendations(catalog, preferences: dict, top_n: int,
+                                 planned_concerts: List[int], version: str) -> Optional[Dict[str, Any]]:
+    """Предвычисленные подборки для анкеты, если они есть для текущей версии данных"""
+    if planned_concerts or top_n != RECOMMENDATION_PRECOMPUTE_TOP_N or _precomputed["version"] != version:
+        return None
+    key = _precompute_key(catalog, preferences)
+    with _precompute_lock:
+        if _precomputed["version"] != version or key not in _precomputed["results"]:
+            return None
+        _precomputed_stats["hits"] += 1
+        return _precomputed["results"][key]
+
+
+def get_precompute_status() -> Dict[str, Any]:
+    """
+    Состояние предвычисленных подборок
+
+    Returns:
+        Dict[str, Any]: version, combinations, built_at, hits, running
+    """
+    with _precompute_lock:
+        return {
+            "version": _precomputed["version"],
+            "combinations": len(_precomputed["results"]),
+            "built_at": _precomputed["built_at"].isoformat() if _precomputed["built_at"] else None,
+            "hits": _precomputed_stats["hits"],
+            "running": _precompute_thread is not None and _precompute_thread.is_alive(),
+        }
+
+
+def _precompute_loop(engine) -> None:
+    while True:
+        try:
+            with Session(engine) as session:
+                precompute_recommendations(session)
+        except Exception as e:
+            logger.error(f"Ошибка предвычисления подборок: {e}")
+        _precompute_wakeup.wait(RECOMMENDATION_PRECOMPUTE_INTERVAL)
+        _precompute_wakeup.clear()
+
+
+def start_recommendation_precompute(engine) -> None:
+    """
+    Запускает фоновое задание предвычисления подборок.
+    Задание проверяет версию каталога и доступных маршрутов раз в RECOMMENDATION_PRECOMPUTE_INTERVAL секунд
+    (или сразу после schedule_recommendation_precompute) и пересчитывает подборки при её смене
+
+    Args:
+        engine: Движок базы данных (у задания своя сессия)
+    """
+    global _precompute_thread
+    if RECOMMENDATION_PRECOMPUTE_INTERVAL <= 0:
+        logger.info("Предвычисление подборок отключено")
+        return
+    if _precompute_thread is not None and _precompute_thread.is_alive():
+        return
+    _precompute_thread = threading.Thread(
+        target=_precompute_loop, args=(engine,), name="recommendation-precompute", daemon=True
+    )
+    _precompute_thread.start()
+
+
+def schedule_recommendation_precompute() -> None:
+    """Просит фоновое задание проверить версию данных, не дожидаясь очередного интервала"""
+    _precompute_wakeup.set()
+
+
 # --- Основная функция рекомендаций ---
 def get_recommendations(
     session: Session,
     preferences: dict,
-    top_n: int = 10
+    top_n: int = 10,
+    user_external_id: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Возвращает подборки маршрутов по анкете пользователя.
+    Анкеты только из priority/min_concerts/max_concerts отдаются из предвычисленных подборок,
+    остальные кэшируются (LRU с TTL) по нормализованной анкете и версии каталога/доступных маршрутов,
+    поэтому после изменения маршрутов или их доступности кэш не используется.
     preferences: dict (priority, max_concerts, diversity, composers, artists, planned_concerts)
+    user_external_id: покупатель, по покупкам которого ищутся альтернативы, если planned_concerts не заданы
     """
     logger.info(f"Получение рекомендаций с предпочтениями: {preferences}")
-    
-    # 1. Получаем все маршруты
-    routes = session.exec(select(Route)).all()
-    logger.info(f"Найдено маршрутов в базе: {len(routes)}")
-    
-    if not routes:
-        logger.warning("В базе данных нет маршрутов")
-        return {
-            "top_weighted": [],
-            "top_intellect": [],
-            "top_comfort": [],
-            "top_balanced": [],
-            "alternatives": []
-        }
-    
-    # 2. Фильтрация по количеству концертов (min_concerts/max_concerts) с понижением min_concerts
+
+    planned_concerts = _planned_concert_ids(session, preferences, user_external_id)
+    version = route_service.get_route_data_version(session)
+    if _precomputed["version"] == version:
+        precomputed = _precomputed_recommendations(
+            route_service.get_route_catalog(session), preferences, top_n, planned_concerts, version
+        )
+        if precomputed is not None:
+            logger.info("Подборки взяты из предвычисленных")
+            return copy.deepcopy(precomputed)
+
+    key = recommendation_cache_key(preferences, top_n, planned_concerts, version)
+    cached = _recommendation_cache_get(key)
+    if cached is not None:
+        logger.info("Подборки взяты из кэша")
+        return copy.deepcopy(cached)
+
+    result = _build_recommendations(session, preferences, top_n, planned_concerts)
+    _recommendation_cache_put(key, result)
+    return copy.deepcopy(result)
+
+
+_EMPTY_RECOMMENDATIONS = ("top_weighted", "top_intellect", "top_comfort", "top_balanced", "alternatives")
+
+
+def _select_recommendations(
+    session: Session,
+    catalog,
+    available: Optional[np.ndarray],
+    preferences: dict,
+    top_n: int,
+    planned_concerts: List[int]
+) -> Dict[str, tuple]:
+    """
+    Позиции маршрутов каталога для каждой подборки (без чтения составов из базы)
+
+    Returns:
+        Dict[str, tuple]: {подборка: (позиции, баллы для вывода или None)}
+    """
+    # 2. Окно по количеству концертов (min_concerts/max_concerts) с понижением min_concerts
     min_concerts = preferences.get('min_concerts')
     max_concerts = preferences.get('max_concerts')
     logger.info(f"Фильтрация по min_concerts: {min_concerts}, max_concerts: {max_concerts}")
-    filtered = []
-    if min_concerts is not None and max_concerts is not None:
-        cur_min = min_concerts
-        while cur_min >= 0:
-            filtered = [r for r in routes if cur_min <= getattr(r, 'Concerts', 0) <= max_concerts]
-            logger.info(f"min_concerts={cur_min}, найдено маршрутов: {len(filtered)}")
-            if filtered:
-                break
-            cur_min -= 1
-        if cur_min < 0:
-            filtered = [r for r in routes if getattr(r, 'Concerts', 0) <= max_concerts]
-    elif min_concerts is not None:
-        cur_min = min_concerts
-        while cur_min >= 0:
-            filtered = [r for r in routes if getattr(r, 'Concerts', 0) >= cur_min]
-            logger.info(f"min_concerts={cur_min}, найдено маршрутов: {len(filtered)}")
-            if filtered:
-                break
-            cur_min -= 1
-        if cur_min < 0:
-            filtered = routes
-    elif max_concerts is not None:
-        filtered = [r for r in routes if getattr(r, 'Concerts', 0) <= max_concerts]
-    else:
-        filtered = routes  # Без ограничений
-    logger.info(f"После фильтрации по количеству концертов: {len(filtered)} маршрутов")
-
-    # 3. Фильтрация по diversity (уникальные композиторы и доля главного)
-    # TODO: реализовать через связи
-
-    # 4. Фильтрация по include/exclude (composers, artists, concerts)
-    # TODO: реализовать через связи
+    ranking = get_route_ranking_index(catalog)
+    buckets = ranking.window(min_concerts, max_concerts)
+    logger.info(f"После фильтрации по количеству концертов: {ranking.window_size(buckets)} маршрутов")
+
+    # 3. Фильтрация по include/exclude (composers, artists, concerts) по битовым индексам
+    allowed = route_filter_mask(session, preferences)
+
+    # Маршруты с распроданными концертами убраны из корзин рейтингов один раз на версию данных:
+    # без фильтров анкеты подборки берут головы корзин без маски
+    if available is not None:
+        ranking = get_available_route_ranking_index(catalog, available)
+
+    # 4. Фильтрация по diversity (уникальные композиторы и доля главного) по столбцам каталога
+    diversity = diversity_mask(catalog, preferences.get('diversity'))
+    if diversity is not None:
+        combined = diversity if allowed is None else allowed & diversity
+        if (combined if available is None else combined & available).any():
+            allowed = combined
+        else:
+            # Разнообразие — мягкое предпочтение: не оставляем пользователя без подборок
+            logger.info(f"Нет маршрутов с diversity={preferences.get('diversity')}, фильтр не применяется")
 
     # 5. Взвешенное ранжирование (score не добавляем в объект, а считаем отдельно)
-    weights = {
-        "intellect": (1.0, 0.0),
-        "comfort": (0.0, 1.0),
-        "balance": (0.5, 0.5)
-    }
-    w_i, w_c = weights.get(preferences.get('priority', 'balance'), (0.5, 0.5))
+    priority = preferences.get('priority', 'balance')
+    if priority not in PRIORITY_WEIGHTS:
+        priority = 'balance'
+    w_i, w_c = PRIORITY_WEIGHTS[priority]
     logger.info(f"Веса для ранжирования: intellect={w_i}, comfort={w_c}")
+    weighted_ranking = f"weighted_{priority}"
+
+    # 6. Подборки: слияние заранее отсортированных корзин окна вместо сортировки каталога
+    selection = {
+        "top_weighted": (ranking.top(weighted_ranking, top_n, buckets, allowed), ranking.scores[weighted_ranking]),
+        "top_intellect": (ranking.top("intellect", top_n, buckets, allowed), None),
+        "top_comfort": (ranking.top("comfort", top_n, buckets, allowed), None),
+        "top_balanced": (ranking.top("balanced", top_n, buckets, allowed), None),
+        "alternatives": (np.empty(0, dtype=np.int64), None),
+    }
+
+    # 7. Альтернативы: маршруты, похожие по составу на planned_concerts (MinHash LSH + точный Жаккар)
+    if planned_concerts:
+        selection["alternatives"] = most_similar_routes(
+            get_route_similarity_index(catalog), route_service.get_route_index(session), planned_concerts, top_n,
+            allowed=available
+        )
+    return selection
+
+
+def _route_sostav(session: Session, catalog, positions: np.ndarray) -> Dict[int, str]:
+    """Составы маршрутов по позициям каталога одним запросом (метрики берутся из каталога)"""
+    if not len(positions):
+        return {}
+    route_ids = np.unique(catalog.route_ids[positions]).tolist()
+    return dict(session.exec(select(Route.id, Route.Sostav).where(Route.id.in_(route_ids))).all())
+
+
+def _render_recommendations(catalog, selection: Dict[str, tuple], sostav_by_id: Dict[int, str]) -> Dict[str, Any]:
+    """Словари подборок для фронта по позициям маршрутов"""
+    result = {}
+    for name, (positions, scores) in selection.items():
+        routes = []
+        for i, position in enumerate(positions.tolist()):
+            route_id = int(catalog.route_ids[position])
+            if name == "alternatives":
+                route = catalog_route_to_dict(catalog, position, sostav_by_id.get(route_id))
+                route["jaccard"] = round(float(scores[i]), 4)
+            else:
+                route = catalog_route_to_dict(
+                    catalog, position, sostav_by_id.get(route_id), None if scores is None else float(scores[position])
+                )
+            routes.append(route)
+        result[name] = routes
+    return result
+
+
+def _build_recommendations(
+    session: Session,
+    preferences: dict,
+    top_n: int,
+    planned_concerts: List[int]
+) -> Dict[str, Any]:
+    """Вычисляет подборки маршрутов по анкете (без кэша)"""
+    # 1. Колоночный каталог маршрутов (объекты Route загружаются только для итоговых подборок)
+    catalog = route_service.get_route_catalog(session)
+    logger.info(f"Найдено маршрутов в каталоге: {len(catalog)}")
     
-    weighted_routes = [
-        (r, w_i * getattr(r, 'IntellectScore', 0) + w_c * getattr(r, 'ComfortScore', 0))
-        for r in filtered
-    ]
+    if not len(catalog):
+        logger.warning("В базе данных нет маршрутов")
+        return {name: [] for name in _EMPTY_RECOMMENDATIONS}
+
+    selection = _select_recommendations(
+        session, catalog, _availability_mask(session, catalog), preferences, top_n, planned_concerts
+    )
+    # 8. Из базы читается только состав попавших в подборки маршрутов
+    positions = np.concatenate([positions for positions, _ in selection.values()])
+    result = _render_recommendations(catalog, selection, _route_sostav(session, catalog, positions))
+    logger.info(f"Результат: top_weighted={len(result['top_weighted'])}, top_intellect={len(result['top_intellect'])}, top_comfort={len(result['top_comfort'])}, top_balanced={len(result['top_balanced'])}")
+    return result
+
+
+def _availability_mask(session: Session, catalog) -> Optional[np.ndarray]:
+    """Маска доступности маршрутов для каталога (None, если каталог сменился во время запроса)"""
+    available = route_service.get_route_availability_mask(session)
+    if len(available) != len(catalog):
+        return None
+    logger.info(f"Доступных маршрутов: {int(available.sum())}")
+    return available
+
+
+def _concert_external_ids_batch(session: Session, concert_ids: Iterable[int]) -> Dict[int, int]:
+    """Внешние ID концертов (в терминах состава маршрута) по их ID в базе для нескольких анкет одним запросом"""
+    concert_ids = sorted(set(concert_ids))
+    if not concert_ids:
+        return {}
+    return dict(session.exec(
+        select(Concert.id, Concert.external_id).where(Concert.id.in_(concert_ids), Concert.external_id.is_not(None))
+    ).all())
+
+
+def _purchased_concert_ids_batch(session: Session, user_external_ids: List[str]) -> Dict[str, List[int]]:
+    """Купленные концерты (ID в терминах состава маршрута) нескольких покупателей одним запросом"""
+    from models.purchase import Purchase
+    purchased = {user: [] for user in user_external_ids}
+    if not user_external_ids:
+        return purchased
+    rows = session.exec(
+        select(Purchase.user_external_id, Concert.external_id)
+        .join(Concert, Purchase.concert_id == Concert.id)
+        .where(Purchase.user_external_id.in_(user_external_ids), Concert.external_id.is_not(None))
+        .distinct()
+    ).all()
+    for user, external_id in rows:
+        purchased[user].append(external_id)
+    return purchased
+
+
+def iter_recommendations_batch(
+    session: Session,
+    requests: Iterable[dict],
+    top_n: int = 10,
+    batch_size: int = RECOMMENDATION_BATCH_SIZE
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """
+    Подборки для множества пользователей (рассылки, офлайн-оценка) — потоковый итератор.
+    Каталог, рейтинги, маска доступности и индексы берутся один раз на весь поток;
+    на каждую порцию запросов покупки и составы маршрутов читаются одним запросом,
+    одинаковые (после нормализации) анкеты считаются один раз,
+    а альтернативы по покупкам всех запросов порции — матричными операциями (most_similar_routes_batch)
+
+    Args:
+        session: Сессия базы данных
+        requests: Запросы {"id": ключ результата (по умолчанию user_external_id),
+                  "user_external_id": покупатель (для альтернатив по покупкам), "preferences": анкета}
+        top_n: Размер подборок
+        batch_size: Размер порции запросов
+
+    Returns:
+        Iterator[Tuple[Any, Dict[str, Any]]]: Пары (ключ запроса, подборки как в get_recommendations)
+    """
+    catalog = route_service.get_route_catalog(session)
+    available = _availability_mask(session, catalog) if len(catalog) else None
+    requests = iter(requests)
+    total = 0
+
+    while True:
+        chunk = list(islice(requests, batch_size))
+        if not chunk:
+            break
+        if not len(catalog):
+            for request in chunk:
+                yield request.get("id", request.get("user_external_id")), {name: [] for name in _EMPTY_RECOMMENDATIONS}
+            continue
+
+        # Концерты для альтернатив как в _planned_concert_ids: planned_concerts, затем concerts анкеты
+        # (внешние ID всех анкет порции одним запросом), а если их нет — покупки
+        preferences_list = [request.get("preferences") or {} for request in chunk]
+        selected = [_int_list(preferences.get('concerts')) for preferences in preferences_list]
+        external_by_id = _concert_external_ids_batch(
+            session, (concert_id for concert_ids in selected for concert_id in concert_ids)
+        )
+        planned_list = []
+        for preferences, concert_ids in zip(preferences_list, selected):
+            planned = _int_list(preferences.get('planned_concerts'))
+            if not planned:
+                planned = [external_by_id[concert_id] for concert_id in concert_ids if concert_id in external_by_id]
+            planned_list.append(planned)
+
+        # Альтернативы по покупкам: покупки всех пользователей порции одним запросом
+        buyers = sorted({
+            str(request["user_external_id"]) for request, planned in zip(chunk, planned_list)
+            if request.get("user_external_id") and not planned
+        })
+        purchases = _purchased_concert_ids_batch(session, buyers)
+
+        # Подборки не зависят от покупок: одинаковые анкеты считаются один раз
+        keys, planned_sets, memo = [], [], {}
+        for request, preferences, planned in zip(chunk, preferences_list, planned_list):
+            if not planned and request.get("user_external_id"):
+                planned = purchases.get(str(request["user_external_id"]), [])
+            key = recommendation_cache_key(preferences, top_n, [], catalog.key)
+            if key not in memo:
+                memo[key] = _select_recommendations(session, catalog, available, preferences, top_n, [])
+            keys.append(key)
+            planned_sets.append(planned)
+
+        # Альтернативы всех запросов порции — одним матричным проходом по LSH индексу
+        alternatives = most_similar_routes_batch(
+            get_route_similarity_index(catalog), route_service.get_route_index(session), planned_sets, top_n,
+            allowed=available
+        )
+
+        positions = np.concatenate(
+            [p for selection in memo.values() for p, _ in selection.values()]
+            + [p for p, _ in alternatives]
+        )
+        sostav_by_id = _route_sostav(session, catalog, positions)
+        rendered = {key: _render_recommendations(catalog, selection, sostav_by_id) for key, selection in memo.items()}
+        for request, key, alternative in zip(chunk, keys, alternatives):
+            result = copy.deepcopy(rendered[key])
+            result["alternatives"] = _render_recommendations(
+                catalog, {"alternatives": alternative}, sostav_by_id
+            )["alternatives"]
+            yield request.get("id", request.get("user_external_id")), result
+
+        total += len(chunk)
+        logger.info(f"Пакетные подборки: обработано {total} запросов, уникальных анкет в порции {len(memo)}")
+
+
+def complete_route_recommendations(
+    session: Session,
+    user_external_id: Optional[str] = None,
+    concert_ids: Optional[List[int]] = None,
+    metric: str = "balanced",
+    top_n: int = 10
+) -> Dict[str, Any]:
+    """
+    Маршруты, дополняющие уже купленные концерты: содержат их все и добавляют новые.
+    Кандидаты — пересечение списков концерт → маршруты (от самого редкого концерта),
+    они ранжируются по выбранному рейтингу без просмотра всего каталога
+
+    Args:
+        session: Сессия базы данных
+        user_external_id: Покупатель, по покупкам которого подбираются маршруты
+        concert_ids: Концерты (ID в терминах состава маршрута) вместо покупок, необязательно
+        metric: Рейтинг: intellect, comfort, balanced или приоритет анкеты (balance — взвешенный балл)
+        top_n: Количество маршрутов
+
+    Returns:
+        Dict[str, Any]: purchased_concerts, metric, candidates (число подходящих маршрутов), routes
+    """
+    if concert_ids is None:
+        concert_ids = _purchased_concert_ids(session, user_external_id) if user_external_id else []
+    catalog = route_service.get_route_catalog(session)
+    index = route_service.get_route_index(session)
+    ranking = get_route_ranking_index(catalog)
+    if metric not in ranking.scores:
+        metric = f"weighted_{metric}" if metric in PRIORITY_WEIGHTS else "balanced"
+
+    # Концерты вне каталога маршрутов (например, вне фестиваля) не ограничивают подбор
+    purchased = sorted({int(c) for c in concert_ids} & set(index.concert_ids.tolist()))
+    result = {"purchased_concerts": purchased, "metric": metric, "candidates": 0, "routes": []}
+    if not purchased:
+        return result
+
+    positions = index.routes_containing_all(purchased)
+    positions = positions[index.route_sizes[positions] > len(purchased)]
+    available = route_service.get_route_availability_mask(session)
+    if len(available) == len(catalog):
+        positions = positions[available[positions]]
+    result["candidates"] = int(len(positions))
+
+    best = positions[top_k_positions(ranking.scores[metric][positions], top_n)]
+    sostav_by_id = dict(session.exec(
+        select(Route.id, Route.Sostav).where(Route.id.in_(catalog.route_ids[best].tolist()))
+    ).all())
+    purchased_set = set(purchased)
+    for position in best.tolist():
+        route = catalog_route_to_dict(catalog, position, sostav_by_id.get(int(catalog.route_ids[position])))
+        route_concerts = catalog.concert_ids[catalog.concert_indptr[position]:catalog.concert_indptr[position + 1]]
+        route["new_concerts"] = [int(c) for c in route_concerts if int(c) not in purchased_set]
+        result["routes"].append(route)
+
+    logger.info(f"Дополнение маршрута для {purchased}: {result['candidates']} кандидатов, отобрано {len(best)}")
+    return result
+
 
-    # 6. Сортировка и подборки
-    top_weighted = [route_to_dict(r, score) for r, score in sorted(weighted_routes, key=lambda x: x[1], reverse=True)[:top_n]]
-    top_intellect = [route_to_dict(r) for r in sorted(filtered, key=lambda r: getattr(r, 'IntellectScore', 0), reverse=True)[:top_n]]
-    top_comfort = [route_to_dict(r) for r in sorted(filtered, key=lambda r: getattr(r, 'ComfortScore', 0), reverse=True)[:top_n]]
-    top_balanced = [route_to_dict(r) for r in sorted(filtered, key=lambda r: abs(getattr(r, 'IntellectScore', 0) - getattr(r, 'ComfortScore', 0)))[:top_n]]
+def _catalog_value(value):
+    """Значение метрики каталога как число Python (NaN -> None)"""
+    value = value.item()
+    return None if isinstance(value, float) and np.isnan(value) else value
 
-    # 7. Альтернативы (по planned_concerts)
-    # TODO: реализовать Jaccard-поиск альтернатив
-    alternatives = []
 
-    logger.info(f"Результат: top_weighted={len(top_weighted)}, top_intellect={len(top_intellect)}, top_comfort={len(top_comfort)}, top_balanced={len(top_balanced)}")
+def catalog_route_to_dict(catalog, position: int, sostav: Optional[str],
+                          weighted_score: Optional[float] = None) -> dict:
+    """Преобразует маршрут каталога (по позиции) в словарь для фронта, как route_to_dict"""
+    def metric(name, default=0):
+        return _catalog_value(catalog.column(name)[position]) if name in catalog.columns else default
 
-    # 8. Формируем результат
     return {
-        "top_weighted": top_weighted,
-        "top_intellect": top_intellect,
-        "top_comfort": top_comfort,
-        "top_balanced": top_balanced,
-        "alternatives": alternatives
+        "id": int(catalog.route_ids[position]),
+        "concerts": sostav if sostav is not None else [],
+        "concerts_count": metric('Concerts'),
+        "intellect": metric('IntellectScore'),
+        "comfort": metric('ComfortScore'),
+        "weighted": weighted_score,
+        "trans_time": metric('TransTime'),
+        "wait_time": metric('WaitTime'),
+        "costs": metric('Costs'),
+        "composers_count": metric('DistinctComposers'),
+        "top_composer_share": metric('TopComposerShare', None),
+        "skyline_layer": metric('SkylineLayer', None),
     }
 
 
@@ -0,0 +1,217 @@
+"""
+Колоночный каталог маршрутов в памяти.
+
+Каждая числовая метрика маршрута хранится отдельным массивом NumPy,
+состав маршрутов — упакованным массивом ID концертов в CSR-формате.
+Каталог строится один раз на версию каталога маршрутов и сохраняется
+в файлы .npy, которые все процессы (uvicorn, Celery) открывают через
+mmap: страницы файла разделяются между процессами, а загрузка не копирует данные.
+"""
+import os
+import shutil
+import logging
+import tempfile
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Служебные массивы каталога (не метрики маршрутов)
+_ROUTE_IDS_FILE = "route_ids"
+_CONCERT_INDPTR_FILE = "concert_indptr"
+_CONCERT_IDS_FILE = "concert_ids"
+
+
+class RouteCatalog:
+    """
+    Колоночное представление каталога маршрутов.
+
+    key            - ключ версии каталога, по которому он сохраняется на диск
+    route_ids      - ID маршрутов по возрастанию, shape (n_routes,)
+    columns        - метрики маршрутов {имя поля Route: массив shape (n_routes,)};
+                     целые обязательные поля хранятся как int64, остальные как float64 (NaN вместо None)
+    concert_indptr - границы составов: концерты маршрута i —
+                     concert_ids[concert_indptr[i]:concert_indptr[i + 1]] (по возрастанию)
+    """
+
+    def __init__(self, key: str, route_ids: np.ndarray, columns: Dict[str, np.ndarray],
+                 concert_indptr: np.ndarray, concert_ids: np.ndarray):
+        self.key = key
+        self.route_ids = route_ids
+        self.columns = columns
+        self.concert_indptr = concert_indptr
+        self.concert_ids = concert_ids
+
+    def __len__(self) -> int:
+        return len(self.route_ids)
+
+    @property
+    def route_sizes(self) -> np.ndarray:
+        return np.diff(self.concert_indptr)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Возвращает массив метрики маршрутов
+
+        Args:
+            name: Имя поля Route (например: "IntellectScore")
+
+        Returns:
+            np.ndarray: Значения метрики в порядке route_ids
+        """
+        return self.columns[name]
+
+    def concerts_of(self, position: int) -> np.ndarray:
+        """
+        Возвращает состав маршрута по его позиции в каталоге
+
+        Args:
+            position: Позиция маршрута
+
+        Returns:
+            np.ndarray: ID концертов маршрута по возрастанию
+        """
+        return self.concert_ids[self.concert_indptr[position]:self.concert_indptr[position + 1]]
+
+    def compositions(self) -> Iterable[np.ndarray]:
+        """Составы всех маршрутов в порядке route_ids"""
+        return (self.concerts_of(position) for position in range(len(self)))
+
+    def positions(self, route_ids: Iterable[int]) -> np.ndarray:
+        """
+        Возвращает позиции маршрутов в каталоге
+
+        Args:
+            route_ids: ID маршрутов
+
+        Returns:
+            np.ndarray: Позиции найденных маршрутов (неизвестные ID отбрасываются)
+        """
+        ids = np.asarray(list(route_ids), dtype=np.int64)
+        if not len(ids) or not len(self.route_ids):
+            return np.empty(0, dtype=np.int64)
+        positions = np.searchsorted(self.route_ids, ids)
+        known = positions < len(self.route_ids)
+        known[known] = self.route_ids[positions[known]] == ids[known]
+        return positions[known]
+
+    @classmethod
+    def from_rows(cls, key: str, column_names: Sequence[str], int_columns: Iterable[str],
+                  rows: Sequence[tuple]) -> "RouteCatalog":
+        """
+        Строит каталог по строкам выборки маршрутов
+
+        Args:
+            key: Ключ версии каталога
+            column_names: Имена метрик в порядке значений строки
+            int_columns: Метрики, которые хранятся как int64
+            rows: Строки вида (id, состав (список ID концертов), метрика_1, ..., метрика_n), по возрастанию id
+
+        Returns:
+            RouteCatalog: Построенный каталог
+        """
+        int_columns = set(int_columns)
+        n_routes = len(rows)
+        route_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n_routes)
+
+        sizes = np.fromiter((len(row[1]) for row in rows), dtype=np.int64, count=n_routes)
+        concert_indptr = np.zeros(n_routes + 1, dtype=np.int64)
+        np.cumsum(sizes, out=concert_indptr[1:])
+        concert_ids = np.fromiter(
+            (cid for row in rows for cid in row[1]), dtype=np.int64, count=int(concert_indptr[-1])
+        )
+
+        columns = {}
+        for offset, name in enumerate(column_names, start=2):
+            if name in int_columns:
+                columns[name] = np.fromiter((row[offset] for row in rows), dtype=np.int64, count=n_routes)
+            else:
+                columns[name] = np.fromiter(
+                    (np.nan if row[offset] is None else row[offset] for row in rows),
+                    dtype=np.float64, count=n_routes
+                )
+
+        logger.info(f"Построен колоночный каталог маршрутов {key}: {n_routes} маршрутов, {len(columns)} метрик")
+        return cls(key, route_ids, columns, concert_indptr, concert_ids)
+
+    def save(self, directory: str) -> None:
+        """
+        Сохраняет каталог в каталог файловой системы.
+        Файлы пишутся во временную папку, которая затем атомарно переименовывается,
+        поэтому другие процессы никогда не видят частично записанный каталог
+
+        Args:
+            directory: Папка каталога (обычно <базовая папка>/<key>)
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+        try:
+            np.save(os.path.join(tmp_dir, f"{_ROUTE_IDS_FILE}.npy"), self.route_ids)
+            np.save(os.path.join(tmp_dir, f"{_CONCERT_INDPTR_FILE}.npy"), self.concert_indptr)
+            np.save(os.path.join(tmp_dir, f"{_CONCERT_IDS_FILE}.npy"), self.concert_ids)
+            for name, values in self.columns.items():
+                np.save(os.path.join(tmp_dir, f"col_{name}.npy"), values)
+            os.rename(tmp_dir, directory)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # Каталог этой версии мог успеть сохранить другой процесс
+            if not os.path.isdir(directory):
+                raise
+
+    @classmethod
+    def load(cls, key: str, directory: str) -> Optional["RouteCatalog"]:
+        """
+        Открывает сохранённый каталог через mmap (без копирования данных в память процесса)
+
+        Args:
+            key: Ключ версии каталога
+            directory: Папка каталога
+
+        Returns:
+            Optional[RouteCatalog]: Каталог или None, если он не сохранён
+        """
+        if not os.path.isdir(directory):
+            return None
+
+        def _open(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        columns = {
+            file_name[len("col_"):-len(".npy")]: _open(file_name[:-len(".npy")])
+            for file_name in os.listdir(directory)
+            if file_name.startswith("col_") and file_name.endswith(".npy")
+        }
+        return cls(key, _open(_ROUTE_IDS_FILE), columns, _open(_CONCERT_INDPTR_FILE), _open(_CONCERT_IDS_FILE))
+
+
+def remove_stale_catalogs(base_dir: str, keep_key: str) -> None:
+    """
+    Удаляет сохранённые каталоги других версий.
+    Процессы, у которых старые файлы открыты через mmap, продолжают работать до перехода на новую версию
+
+    Args:
+        base_dir: Базовая папка каталогов
+        keep_key: Ключ текущей версии
+    """
+    if not os.path.isdir(base_dir):
+        return
+    for name in os.listdir(base_dir):
+        if name != keep_key and not name.startswith(".tmp-"):
+            shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+
+
+def ordered_by_ids(items: List, ids: Sequence[int]) -> List:
+    """
+    Упорядочивает загруженные из базы объекты в порядке заданных ID
+
+    Args:
+        items: Объекты с атрибутом id
+        ids: ID в нужном порядке
+
+    Returns:
+        List: Объекты в порядке ids (отсутствующие пропускаются)
+    """
+    by_id = {item.id: item for item in items}
+    return [by_id[i] for i in ids if i in by_id]
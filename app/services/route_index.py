@@ -0,0 +1,387 @@
+"""
+Битовый индекс маршрутов для быстрой проверки доступности.
+
+Каждый маршрут хранится как битовая маска над позициями концертов,
+поэтому проверка доступности всего каталога сводится к одной
+векторной операции AND/ANY над массивами NumPy. Обратный индекс
+концерт → маршруты позволяет перепроверять только затронутые маршруты.
+Тот же индекс строится над композиторами и артистами маршрутов для фильтров анкеты.
+"""
+import re
+import logging
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SOSTAV_NUMBER_RE = re.compile(r'\d+')
+
+# Во сколько раз длинный список маршрутов должен превосходить короткий, чтобы пересекать бинарным поиском
+GALLOP_RATIO = 8
+
+# Нечётные множители хэша масок маршрутов (слово j умножается на множитель j по модулю 2^64)
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_HASH_STEP = np.uint64(0xBF58476D1CE4E5B9)
+
+
+def bitset_hashes(bits: np.ndarray) -> np.ndarray:
+    """
+    64-битные хэши строк битовых масок (одинаковые составы — одинаковый хэш)
+
+    Args:
+        bits: Маски shape (n, n_words), dtype uint64
+
+    Returns:
+        np.ndarray: Хэши shape (n,), dtype uint64
+    """
+    hashes = np.zeros(bits.shape[0], dtype=np.uint64)
+    multiplier = _HASH_MULTIPLIER
+    with np.errstate(over='ignore'):
+        for word in range(bits.shape[1]):
+            hashes ^= bits[:, word] * multiplier
+            hashes = (hashes ^ (hashes >> np.uint64(31))) * _HASH_STEP
+            multiplier = multiplier * _HASH_STEP + _HASH_MULTIPLIER
+    return hashes
+
+
+def intersect_sorted(small: np.ndarray, large: np.ndarray) -> np.ndarray:
+    """
+    Пересечение отсортированных массивов уникальных значений.
+    Если второй массив намного длиннее, каждый элемент короткого ищется бинарным поиском
+    в окне длинного между первым и последним элементом короткого (галопирующее пересечение:
+    O(m log n) вместо O(m + n)), иначе массивы сливаются
+
+    Args:
+        small: Более короткий массив
+        large: Более длинный массив
+
+    Returns:
+        np.ndarray: Общие значения по возрастанию
+    """
+    if not len(small) or not len(large):
+        return small[:0]
+    if len(large) < GALLOP_RATIO * len(small):
+        return np.intersect1d(small, large, assume_unique=True)
+    lo, hi = np.searchsorted(large, [small[0], small[-1]], side='left')
+    window = large[lo:hi + 1]
+    probe = np.searchsorted(window, small)
+    found = probe < len(window)
+    found[found] = window[probe[found]] == small[found]
+    return small[found]
+
+
+def parse_sostav(sostav: str) -> List[int]:
+    """
+    Разбирает строку состава маршрута (например: "1,2,3,4") в отсортированный список ID концертов
+
+    Args:
+        sostav: Строка состава маршрута
+
+    Returns:
+        List[int]: Уникальные ID концертов по возрастанию
+    """
+    if not sostav:
+        return []
+    return sorted({int(x) for x in _SOSTAV_NUMBER_RE.findall(sostav)})
+
+
+def route_concert_ids(route) -> List[int]:
+    """
+    Возвращает состав маршрута в виде списка ID концертов.
+    Используется сохранённый массив SostavIds, строка Sostav разбирается только если массива нет
+
+    Args:
+        route: Маршрут (Route или AvailableRoute)
+
+    Returns:
+        List[int]: ID концертов маршрута по возрастанию
+    """
+    sostav_ids = getattr(route, 'SostavIds', None)
+    if sostav_ids is not None:
+        return list(sostav_ids)
+    return parse_sostav(route.Sostav)
+
+
+class RouteBitsetIndex:
+    """
+    Индекс маршрутов в виде битовых масок.
+
+    route_ids    - ID маршрутов, shape (n_routes,)
+    concert_ids  - отсортированные ID концертов; позиция концерта = номер бита
+    route_bits   - маски маршрутов, shape (n_routes, n_words), dtype uint64
+    route_sizes  - количество концертов в маршруте, shape (n_routes,)
+
+    Обратный индекс хранится в CSR-формате: маршруты концерта с позицией p —
+    это concert_routes[concert_indptr[p]:concert_indptr[p + 1]] (позиции маршрутов по возрастанию).
+    """
+
+    WORD_BITS = 64
+
+    def __init__(self, route_ids: np.ndarray, concert_ids: np.ndarray,
+                 route_bits: np.ndarray, route_sizes: np.ndarray,
+                 concert_indptr: np.ndarray, concert_routes: np.ndarray):
+        self.route_ids = route_ids
+        self.concert_ids = concert_ids
+        self.route_bits = route_bits
+        self.route_sizes = route_sizes
+        self.concert_indptr = concert_indptr
+        self.concert_routes = concert_routes
+        # Хэш-таблица составов для точного совпадения (строится при первом запросе)
+        self._exact_lookup = None
+
+    @property
+    def n_routes(self) -> int:
+        return len(self.route_ids)
+
+    @property
+    def n_words(self) -> int:
+        return self.route_bits.shape[1]
+
+    @classmethod
+    def from_compositions(cls, route_ids: Sequence[int],
+                          compositions: Iterable[Sequence[int]]) -> "RouteBitsetIndex":
+        """
+        Строит индекс по списку составов маршрутов
+
+        Args:
+            route_ids: ID маршрутов
+            compositions: Составы маршрутов (ID концертов) в том же порядке
+
+        Returns:
+            RouteBitsetIndex: Построенный индекс
+        """
+        # Дубликаты концертов внутри состава не должны завышать размер маршрута
+        compositions = [sorted(set(c)) for c in compositions]
+        sizes = np.fromiter((len(c) for c in compositions), dtype=np.int64, count=len(compositions))
+
+        # Плоское представление: номер маршрута и ID концерта для каждой пары
+        flat_concerts = np.fromiter(
+            (cid for c in compositions for cid in c), dtype=np.int64, count=int(sizes.sum())
+        )
+        flat_routes = np.repeat(np.arange(len(compositions), dtype=np.int64), sizes)
+        return cls.from_pairs(route_ids, flat_routes, flat_concerts)
+
+    @classmethod
+    def from_pairs(cls, route_ids: Sequence[int], route_positions: np.ndarray,
+                   concert_ids: np.ndarray) -> "RouteBitsetIndex":
+        """
+        Строит индекс по уникальным парам (позиция маршрута, ID концерта).
+        Вместо концертов могут использоваться любые сущности маршрута (композиторы, артисты)
+
+        Args:
+            route_ids: ID маршрутов
+            route_positions: Позиции маршрутов пар
+            concert_ids: ID концертов (сущностей) пар
+
+        Returns:
+            RouteBitsetIndex: Построенный индекс
+        """
+        route_ids_arr = np.asarray(route_ids, dtype=np.int64)
+        n_routes = len(route_ids_arr)
+        flat_routes = np.asarray(route_positions, dtype=np.int64)
+        flat_concerts = np.asarray(concert_ids, dtype=np.int64)
+        sizes = np.bincount(flat_routes, minlength=n_routes).astype(np.int64)
+
+        unique_concert_ids = np.unique(flat_concerts)
+        n_words = max(1, (len(unique_concert_ids) + cls.WORD_BITS - 1) // cls.WORD_BITS)
+        route_bits = np.zeros((n_routes, n_words), dtype=np.uint64)
+
+        positions = np.searchsorted(unique_concert_ids, flat_concerts)
+        if len(flat_concerts):
+            words = positions // cls.WORD_BITS
+            bits = np.left_shift(np.uint64(1), (positions % cls.WORD_BITS).astype(np.uint64))
+            np.bitwise_or.at(route_bits, (flat_routes, words), bits)
+
+        # Обратный индекс: стабильная сортировка сохраняет порядок маршрутов внутри концерта
+        order = np.lexsort((flat_routes, positions))
+        concert_routes = flat_routes[order]
+        concert_indptr = np.zeros(len(unique_concert_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(positions, minlength=len(unique_concert_ids)), out=concert_indptr[1:])
+
+        logger.info(f"Построен битовый индекс: {n_routes} маршрутов, {len(unique_concert_ids)} концертов, {n_words} слов на маршрут")
+        return cls(route_ids_arr, unique_concert_ids, route_bits, sizes, concert_indptr, concert_routes)
+
+    def concert_positions(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Возвращает позиции известных индексу концертов
+
+        Args:
+            concert_ids: ID концертов
+
+        Returns:
+            np.ndarray: Позиции концертов (неизвестные ID отбрасываются)
+        """
+        ids = np.asarray(list(concert_ids), dtype=np.int64)
+        if not len(ids) or not len(self.concert_ids):
+            return np.empty(0, dtype=np.int64)
+        positions = np.searchsorted(self.concert_ids, ids)
+        known = positions < len(self.concert_ids)
+        known[known] = self.concert_ids[positions[known]] == ids[known]
+        return positions[known]
+
+    def routes_for_concerts(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Возвращает позиции маршрутов, содержащих хотя бы один из концертов
+
+        Args:
+            concert_ids: ID концертов
+
+        Returns:
+            np.ndarray: Отсортированные уникальные позиции маршрутов
+        """
+        positions = self.concert_positions(concert_ids)
+        if not len(positions):
+            return np.empty(0, dtype=np.int64)
+        postings = [self.concert_routes[self.concert_indptr[p]:self.concert_indptr[p + 1]] for p in positions]
+        return np.unique(np.concatenate(postings))
+
+    def routes_containing_all(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Возвращает позиции маршрутов, содержащих все концерты, пересечением списков концерт → маршруты.
+        Пересечение начинается с самого короткого списка, поэтому время зависит от самого редкого концерта,
+        а не от размера каталога
+
+        Args:
+            concert_ids: ID концертов
+
+        Returns:
+            np.ndarray: Отсортированные позиции маршрутов (пусто, если концерт не входит ни в один маршрут)
+        """
+        concert_ids = {int(c) for c in concert_ids}
+        positions = self.concert_positions(concert_ids)
+        if not concert_ids or len(positions) < len(concert_ids):
+            return np.empty(0, dtype=np.int64)
+        postings = sorted(
+            (self.concert_routes[self.concert_indptr[p]:self.concert_indptr[p + 1]] for p in positions), key=len
+        )
+        result = postings[0]
+        for posting in postings[1:]:
+            if not len(result):
+                break
+            result = intersect_sorted(result, posting)
+        return result.astype(np.int64, copy=False)
+
+    def _exact_table(self):
+        """Отсортированные хэши составов и позиции маршрутов в том же порядке"""
+        if self._exact_lookup is None:
+            hashes = bitset_hashes(self.route_bits)
+            # Стабильная сортировка: при одинаковых составах первым идёт маршрут с меньшей позицией
+            order = np.argsort(hashes, kind='stable')
+            self._exact_lookup = (hashes[order], order)
+        return self._exact_lookup
+
+    def exact_route(self, concert_ids: Iterable[int]) -> Optional[int]:
+        """
+        Позиция маршрута с составом ровно из указанных концертов по хэшу маски состава
+
+        Args:
+            concert_ids: ID концертов
+
+        Returns:
+            Optional[int]: Позиция маршрута (наименьшая при одинаковых составах) или None
+        """
+        concert_ids = {int(c) for c in concert_ids}
+        positions = self.concert_positions(concert_ids)
+        if not concert_ids or len(positions) < len(concert_ids):
+            return None
+        query = self.concert_mask(concert_ids)
+        sorted_hashes, order = self._exact_table()
+        key = bitset_hashes(query.reshape(1, -1))[0]
+        start = np.searchsorted(sorted_hashes, key, side='left')
+        stop = np.searchsorted(sorted_hashes, key, side='right')
+        # Совпадение хэша проверяется по самой маске
+        for position in order[start:stop]:
+            if np.array_equal(self.route_bits[position], query):
+                return int(position)
+        return None
+
+    def concert_mask(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Возвращает битовую маску для набора концертов (неизвестные индексу концерты игнорируются)
+
+        Args:
+            concert_ids: ID концертов
+
+        Returns:
+            np.ndarray: Маска shape (n_words,), dtype uint64
+        """
+        mask = np.zeros(self.n_words, dtype=np.uint64)
+        positions = self.concert_positions(concert_ids)
+        if len(positions):
+            bits = np.left_shift(np.uint64(1), (positions % self.WORD_BITS).astype(np.uint64))
+            np.bitwise_or.at(mask, positions // self.WORD_BITS, bits)
+        return mask
+
+    def any_mask(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Маршруты, содержащие хотя бы один из концертов (AND с маской и проверка на ненулевое слово)
+
+        Args:
+            concert_ids: ID концертов (сущностей)
+
+        Returns:
+            np.ndarray: Булев массив по всем маршрутам
+        """
+        mask = self.concert_mask(concert_ids)
+        found = np.zeros(self.n_routes, dtype=bool)
+        for word in np.nonzero(mask)[0]:
+            found |= (self.route_bits[:, word] & mask[word]) != 0
+        return found
+
+    def all_mask(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Маршруты, содержащие все концерты (неизвестный индексу концерт не содержит ни один маршрут)
+
+        Args:
+            concert_ids: ID концертов (сущностей)
+
+        Returns:
+            np.ndarray: Булев массив по всем маршрутам
+        """
+        concert_ids = {int(c) for c in concert_ids}
+        if len(self.concert_positions(concert_ids)) < len(concert_ids):
+            return np.zeros(self.n_routes, dtype=bool)
+        mask = self.concert_mask(concert_ids)
+        found = np.ones(self.n_routes, dtype=bool)
+        for word in np.nonzero(mask)[0]:
+            found &= (self.route_bits[:, word] & mask[word]) == mask[word]
+        return found
+
+    def blocked_concerts(self, available_concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Возвращает концерты индекса, которых нет среди доступных (нет билетов или концерт не найден)
+
+        Args:
+            available_concert_ids: ID концертов, на которые есть билеты
+
+        Returns:
+            np.ndarray: ID недоступных концертов
+        """
+        available = np.asarray(list(available_concert_ids), dtype=np.int64)
+        return self.concert_ids[~np.isin(self.concert_ids, available)]
+
+    def available_mask(self, blocked_concert_ids: Iterable[int],
+                       route_positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Вычисляет доступность маршрутов одним векторным проходом
+
+        Args:
+            blocked_concert_ids: ID недоступных концертов
+            route_positions: Позиции маршрутов для проверки (по умолчанию весь каталог)
+
+        Returns:
+            np.ndarray: Булев массив (по всем маршрутам или по route_positions), True если маршрут доступен
+        """
+        if route_positions is None:
+            route_bits, route_sizes = self.route_bits, self.route_sizes
+        else:
+            route_bits, route_sizes = self.route_bits[route_positions], self.route_sizes[route_positions]
+
+        blocked_mask = self.concert_mask(blocked_concert_ids)
+        blocked = np.zeros(len(route_sizes), dtype=bool)
+        # Проходим по словам, чтобы не создавать временную матрицу размером с индекс
+        for word in np.nonzero(blocked_mask)[0]:
+            blocked |= (route_bits[:, word] & blocked_mask[word]) != 0
+        # Маршруты без концертов считаются недоступными
+        return ~blocked & (route_sizes > 0)
@@ -0,0 +1,217 @@
+"""
+Предварительно отсортированные рейтинги маршрутов по корзинам количества концертов.
+
+Для каждого значения Concerts (корзины) позиции маршрутов каталога заранее
+упорядочены по каждому рейтингу: IntellectScore, ComfortScore, сбалансированность
+(слой Парето, затем разрыв между баллами) и взвешенный балл каждого приоритета анкеты. Рейтинги строятся один раз на версию
+каталога; запрос top-N берёт головы нужных корзин и сливает их, не сортируя каталог.
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Рейтинги, которые строятся всегда (взвешенные добавляются по приоритетам анкеты)
+BASE_RANKINGS = ("intellect", "comfort", "balanced")
+
+
+def concert_count_mask(concerts: np.ndarray, min_concerts: Optional[int] = None,
+                       max_concerts: Optional[int] = None) -> np.ndarray:
+    """
+    Маска маршрутов по количеству концертов.
+    Если маршрутов с количеством концертов от min_concerts нет, min_concerts понижается
+    до ближайшего количества, для которого маршруты есть (за один проход вместо перебора значений)
+
+    Args:
+        concerts: Количество концертов маршрутов
+        min_concerts: Желаемое минимальное количество концертов
+        max_concerts: Максимальное количество концертов
+
+    Returns:
+        np.ndarray: Булева маска маршрутов
+    """
+    upper = concerts <= max_concerts if max_concerts is not None else np.ones(len(concerts), dtype=bool)
+    if min_concerts is None or min_concerts < 0:
+        return upper
+    eligible = concerts[upper & (concerts >= 0)]
+    if not len(eligible):
+        return upper
+    relaxed_min = min(min_concerts, int(eligible.max()))
+    if relaxed_min < min_concerts:
+        logger.info(f"Маршрутов от {min_concerts} концертов нет, min_concerts понижен до {relaxed_min}")
+    return upper & (concerts >= relaxed_min)
+
+
+def top_k_positions(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Позиции k наибольших значений по убыванию за O(n) (argpartition) плюс сортировка только отобранных.
+    При равных значениях порядок позиций сохраняется, как при стабильной сортировке
+
+    Args:
+        scores: Значения (без NaN)
+        k: Количество позиций
+
+    Returns:
+        np.ndarray: Позиции лучших значений
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    # Все значения не хуже k-го: при повторах порогового значения их может быть больше k
+    candidates = np.flatnonzero(scores >= threshold)
+    return candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+
+
+def allowed_head(positions: np.ndarray, allowed: np.ndarray, k: int) -> np.ndarray:
+    """
+    Первые k допустимых позиций упорядоченного списка.
+    Список просматривается срезами растущей длины (k, 2k, 4k, ...): проверяется в среднем
+    не больше удвоенного числа позиций до k-й допустимой, а не весь список
+
+    Args:
+        positions: Позиции маршрутов в порядке рейтинга
+        allowed: Маска допустимых позиций каталога
+        k: Количество позиций
+
+    Returns:
+        np.ndarray: Допустимые позиции в исходном порядке (не больше k)
+    """
+    heads, found, start, step = [], 0, 0, max(k, 1)
+    while found < k and start < len(positions):
+        chunk = positions[start:start + step]
+        chunk = chunk[allowed[chunk]]
+        heads.append(chunk)
+        found += len(chunk)
+        start += step
+        step *= 2
+    if not heads:
+        return positions[:0]
+    return np.concatenate(heads)[:k]
+
+
+class RouteRankingIndex:
+    """
+    Рейтинги маршрутов каталога, разбитые на корзины по количеству концертов.
+
+    key           - ключ версии каталога, по которому построены рейтинги
+    bucket_values - значения Concerts корзин по возрастанию
+    bucket_indptr - границы корзин: позиции корзины b в рейтинге — order[bucket_indptr[b]:bucket_indptr[b + 1]]
+    scores        - баллы рейтингов {имя: массив shape (n_routes,)}, больше — лучше
+    orders        - позиции маршрутов {имя: массив}: по корзинам, внутри корзины по убыванию балла,
+                    при равных баллах — по позиции в каталоге
+    """
+
+    def __init__(self, key: str, bucket_values: np.ndarray, bucket_indptr: np.ndarray,
+                 scores: Dict[str, np.ndarray], orders: Dict[str, np.ndarray]):
+        self.key = key
+        self.bucket_values = bucket_values
+        self.bucket_indptr = bucket_indptr
+        self.scores = scores
+        self.orders = orders
+
+    @classmethod
+    def from_catalog(cls, catalog, weights: Dict[str, Tuple[float, float]]) -> "RouteRankingIndex":
+        """
+        Строит рейтинги по колоночному каталогу маршрутов
+
+        Args:
+            catalog: RouteCatalog
+            weights: Веса приоритетов анкеты {приоритет: (вес IntellectScore, вес ComfortScore)};
+                     для каждого строится рейтинг weighted_<приоритет>
+
+        Returns:
+            RouteRankingIndex: Построенные рейтинги
+        """
+        concerts = np.asarray(catalog.column('Concerts'))
+        intellect = np.nan_to_num(catalog.column('IntellectScore'))
+        comfort = np.nan_to_num(catalog.column('ComfortScore'))
+        gap = np.abs(intellect - comfort)
+        if 'SkylineLayer' in catalog.columns:
+            # Сначала недоминируемые маршруты (слой Парето), внутри слоя — меньший разрыв между баллами:
+            # доля разрыва < 1, поэтому слой всегда важнее
+            layers = np.asarray(catalog.column('SkylineLayer'), dtype=np.float64)
+            balanced = -(layers + gap / (gap.max(initial=0.0) + 1.0))
+        else:
+            balanced = -gap
+        scores = {
+            "intellect": intellect,
+            "comfort": comfort,
+            "balanced": balanced,
+        }
+        for priority, (w_i, w_c) in weights.items():
+            scores[f"weighted_{priority}"] = w_i * intellect + w_c * comfort
+
+        bucket_values, counts = np.unique(concerts, return_counts=True)
+        bucket_indptr = np.zeros(len(bucket_values) + 1, dtype=np.int64)
+        np.cumsum(counts, out=bucket_indptr[1:])
+        positions = np.arange(len(concerts))
+        # lexsort: последний ключ главный — корзина, затем балл по убыванию, затем позиция
+        orders = {name: np.lexsort((positions, -values, concerts)) for name, values in scores.items()}
+
+        logger.info(f"Построены рейтинги маршрутов {catalog.key}: {len(orders)} рейтингов, {len(bucket_values)} корзин")
+        return cls(catalog.key, bucket_values, bucket_indptr, scores, orders)
+
+    def restricted(self, available: np.ndarray) -> "RouteRankingIndex":
+        """
+        Рейтинги только по допустимым маршрутам (например, доступным): порядок внутри корзин сохраняется,
+        корзины и их значения Concerts не меняются, пустые корзины остаются пустыми
+
+        Args:
+            available: Маска допустимых позиций каталога
+
+        Returns:
+            RouteRankingIndex: Рейтинги с теми же баллами и отфильтрованными порядками
+        """
+        orders = {name: order[available[order]] for name, order in self.orders.items()}
+        # Набор маршрутов корзины одинаков во всех рейтингах: границы считаются по любому из них
+        kept = np.concatenate(([0], np.cumsum(available[next(iter(self.orders.values()))], dtype=np.int64)))
+        return RouteRankingIndex(self.key, self.bucket_values, kept[self.bucket_indptr], self.scores, orders)
+
+    def window(self, min_concerts: Optional[int] = None, max_concerts: Optional[int] = None) -> slice:
+        """
+        Корзины окна количества концертов (с понижением min_concerts, как concert_count_mask)
+
+        Returns:
+            slice: Диапазон номеров корзин
+        """
+        selected = np.flatnonzero(concert_count_mask(self.bucket_values, min_concerts, max_concerts))
+        if not len(selected):
+            return slice(0, 0)
+        return slice(int(selected[0]), int(selected[-1]) + 1)
+
+    def window_size(self, buckets: slice) -> int:
+        """Количество маршрутов в корзинах окна"""
+        return int(self.bucket_indptr[buckets.stop] - self.bucket_indptr[buckets.start])
+
+    def top(self, name: str, k: int, buckets: slice, allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Лучшие маршруты рейтинга в корзинах окна: слияние голов корзин (не более k из каждой).
+        С маской allowed голова корзины набирается срезами растущей длины, а не фильтрацией всей корзины
+
+        Args:
+            name: Имя рейтинга (например: "intellect", "weighted_balance")
+            k: Количество маршрутов
+            buckets: Корзины окна (window)
+            allowed: Маска допустимых позиций каталога (фильтры анкеты), необязательно
+
+        Returns:
+            np.ndarray: Позиции маршрутов в каталоге в порядке рейтинга
+        """
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        order = self.orders[name]
+        heads = []
+        for bucket in range(buckets.start, buckets.stop):
+            positions = order[self.bucket_indptr[bucket]:self.bucket_indptr[bucket + 1]]
+            heads.append(positions[:k] if allowed is None else allowed_head(positions, allowed, k))
+        if not heads:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate(heads)
+        # k-way слияние голов: по убыванию балла, при равных — по позиции в каталоге
+        merged = candidates[np.lexsort((candidates, -self.scores[name][candidates]))]
+        return merged[:k]
@@ -0,0 +1,281 @@
+"""
+Поиск маршрутов, похожих по составу (коэффициент Жаккара), через MinHash LSH.
+
+Для каждого маршрута каталога вычисляется MinHash-сигнатура состава, сигнатура
+делится на полосы, и маршруты с совпадающей полосой попадают в одну корзину.
+Запрос находит кандидатов несколькими бинарными поисками по полосам,
+после чего кандидаты ранжируются по точному коэффициенту Жаккара
+(пересечение считается по битовым маскам RouteBitsetIndex).
+"""
+import logging
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.route_index import RouteBitsetIndex
+from services.route_ranking import top_k_positions
+
+logger = logging.getLogger(__name__)
+
+# Параметры MinHash: 16 полос по 2 значения (порог сходства кандидатов ~ (1/16) ** (1/2) = 0.25)
+NUM_PERM = 32
+BAND_ROWS = 2
+N_BANDS = NUM_PERM // BAND_ROWS
+
+# Простое число Мерсенна 2^31 - 1: (a * x + b) и ключ полосы sig0 * P + sig1 помещаются в int64
+_PRIME = (1 << 31) - 1
+
+# Порция маршрутов при вычислении сигнатур (ограничивает временную матрицу хэшей)
+_SIGNATURE_CHUNK = 20000
+
+
+def _hash_params(seed: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return (rng.integers(1, _PRIME, size=NUM_PERM, dtype=np.int64),
+            rng.integers(0, _PRIME, size=NUM_PERM, dtype=np.int64))
+
+
+# Количество единичных битов в каждом байте
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """Количество установленных битов в каждой строке матрицы слов uint64"""
+    return _BYTE_POPCOUNT[np.ascontiguousarray(words).view(np.uint8)].sum(axis=-1)
+
+
+class RouteSimilarityIndex:
+    """
+    MinHash LSH индекс составов маршрутов каталога.
+
+    key        - ключ версии каталога
+    band_keys  - ключи полос, отсортированные внутри каждой полосы, shape (N_BANDS, n)
+    band_order - позиции маршрутов в каталоге в порядке band_keys, shape (N_BANDS, n)
+    """
+
+    def __init__(self, key: str, band_keys: np.ndarray, band_order: np.ndarray):
+        self.key = key
+        self.band_keys = band_keys
+        self.band_order = band_order
+        self._a, self._b = _hash_params()
+
+    @staticmethod
+    def _band_keys(signatures: np.ndarray) -> np.ndarray:
+        """Ключи полос: пара значений сигнатуры, упакованная в одно int64 без коллизий"""
+        return signatures[..., 0::BAND_ROWS] * _PRIME + signatures[..., 1::BAND_ROWS]
+
+    @classmethod
+    def from_catalog(cls, catalog) -> "RouteSimilarityIndex":
+        """
+        Строит индекс по составам маршрутов колоночного каталога
+
+        Args:
+            catalog: RouteCatalog
+
+        Returns:
+            RouteSimilarityIndex: Построенный индекс
+        """
+        a, b = _hash_params()
+        n_routes = len(catalog)
+        indptr = np.asarray(catalog.concert_indptr)
+        concert_ids = np.asarray(catalog.concert_ids) % _PRIME
+        # Маршруты без концертов получают сигнатуру из _PRIME, которой не бывает у запроса
+        signatures = np.full((n_routes, NUM_PERM), _PRIME, dtype=np.int64)
+
+        for start in range(0, n_routes, _SIGNATURE_CHUNK):
+            end = min(start + _SIGNATURE_CHUNK, n_routes)
+            lo, hi = indptr[start], indptr[end]
+            if hi == lo:
+                continue
+            hashes = (concert_ids[lo:hi, None] * a + b) % _PRIME
+            sizes = np.diff(indptr[start:end + 1])
+            nonempty = np.flatnonzero(sizes > 0)
+            signatures[start + nonempty] = np.minimum.reduceat(hashes, indptr[start + nonempty] - lo, axis=0)
+
+        keys = cls._band_keys(signatures).T
+        band_order = np.argsort(keys, axis=1, kind='stable')
+        if n_routes < np.iinfo(np.int32).max:
+            band_order = band_order.astype(np.int32)
+        band_keys = np.take_along_axis(keys, band_order, axis=1)
+        logger.info(f"Построен MinHash LSH индекс {catalog.key}: {n_routes} маршрутов, {N_BANDS} полос")
+        return cls(catalog.key, band_keys, band_order)
+
+    def signature(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """MinHash-сигнатура набора концертов"""
+        ids = np.unique(np.asarray(list(concert_ids), dtype=np.int64)) % _PRIME
+        return ((ids[:, None] * self._a + self._b) % _PRIME).min(axis=0)
+
+    def candidates(self, concert_ids: Iterable[int]) -> np.ndarray:
+        """
+        Кандидаты в похожие маршруты: совпадение хотя бы одной полосы сигнатуры
+
+        Args:
+            concert_ids: ID концертов запроса (в терминах состава маршрута)
+
+        Returns:
+            np.ndarray: Отсортированные позиции маршрутов в каталоге
+        """
+        concert_ids = list(concert_ids)
+        if not concert_ids or not self.band_keys.shape[1]:
+            return np.empty(0, dtype=np.int64)
+        query_keys = self._band_keys(self.signature(concert_ids))
+        found = []
+        for band, key in enumerate(query_keys):
+            lo, hi = np.searchsorted(self.band_keys[band], [key, key + 1])
+            if hi > lo:
+                found.append(self.band_order[band, lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found)).astype(np.int64)
+
+
+def exact_jaccard(index: RouteBitsetIndex, positions: np.ndarray, concert_ids: Iterable[int]) -> np.ndarray:
+    """
+    Точный коэффициент Жаккара между составами маршрутов и набором концертов
+
+    Args:
+        index: Битовый индекс маршрутов (позиции совпадают с каталогом)
+        positions: Позиции маршрутов
+        concert_ids: ID концертов запроса
+
+    Returns:
+        np.ndarray: Коэффициенты Жаккара в порядке positions
+    """
+    query = set(int(c) for c in concert_ids)
+    if not len(positions) or not query:
+        return np.zeros(len(positions), dtype=np.float64)
+    mask = index.concert_mask(query)
+    # Пересечение считается только по словам маски, в которых есть концерты запроса
+    words = np.flatnonzero(mask)
+    intersection = _popcount(index.route_bits[np.ix_(positions, words)] & mask[words])
+    union = index.route_sizes[positions] + len(query) - intersection
+    return np.divide(intersection, union, out=np.zeros(len(positions), dtype=np.float64), where=union > 0)
+
+
+def most_similar_routes(similarity: RouteSimilarityIndex, index: RouteBitsetIndex,
+                        concert_ids: Iterable[int], k: int,
+                        allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Маршруты, наиболее похожие по составу на набор концертов
+
+    Кандидаты берутся из LSH; если их меньше k, добавляются все маршруты,
+    пересекающиеся с запросом (по обратному индексу), чтобы вернуть k маршрутов с ненулевым сходством
+
+    Args:
+        similarity: MinHash LSH индекс
+        index: Битовый индекс маршрутов
+        concert_ids: ID концертов запроса
+        k: Количество маршрутов
+        allowed: Маска допустимых позиций каталога (например, доступных маршрутов), необязательно
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Позиции маршрутов в каталоге и их коэффициенты Жаккара (по убыванию)
+    """
+    concert_ids = sorted({int(c) for c in concert_ids})
+    candidates = similarity.candidates(concert_ids)
+    if allowed is not None:
+        candidates = candidates[allowed[candidates]]
+    if len(candidates) < k:
+        candidates = np.union1d(candidates, index.routes_for_concerts(concert_ids))
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+    jaccard = exact_jaccard(index, candidates, concert_ids)
+    similar = jaccard > 0
+    candidates, jaccard = candidates[similar], jaccard[similar]
+    best = top_k_positions(jaccard, k)
+    return candidates[best], jaccard[best]
+
+
+def most_similar_routes_batch(similarity: RouteSimilarityIndex, index: RouteBitsetIndex,
+                              concert_sets: Sequence[Iterable[int]], k: int,
+                              allowed: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    most_similar_routes для многих наборов концертов матричными операциями:
+    сигнатуры всех наборов считаются одним reduceat, кандидаты каждой полосы находятся
+    одним searchsorted по всем наборам, а точный Жаккар — по плоскому списку пар (набор, маршрут).
+    Наборы, у которых меньше k кандидатов LSH, дополняются по обратному индексу, как в most_similar_routes
+
+    Args:
+        similarity: MinHash LSH индекс
+        index: Битовый индекс маршрутов
+        concert_sets: Наборы ID концертов
+        k: Количество маршрутов на набор
+        allowed: Маска допустимых позиций каталога, необязательно
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: Для каждого набора — позиции маршрутов и коэффициенты Жаккара
+    """
+    sets = [np.array(sorted({int(c) for c in concert_ids}), dtype=np.int64) for concert_ids in concert_sets]
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+    results = [empty] * len(sets)
+    users = np.flatnonzero([len(ids) > 0 for ids in sets])
+    if not len(users) or k <= 0 or not similarity.band_keys.shape[1]:
+        return results
+
+    # Сигнатуры всех наборов: минимум хэшей по концертам набора
+    sizes = np.array([len(sets[u]) for u in users], dtype=np.int64)
+    flat_ids = np.concatenate([sets[u] for u in users])
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    hashes = ((flat_ids % _PRIME)[:, None] * similarity._a + similarity._b) % _PRIME
+    query_keys = similarity._band_keys(np.minimum.reduceat(hashes, starts, axis=0))
+
+    # Кандидаты: совпадение хотя бы одной полосы, пары (номер набора, позиция маршрута)
+    pair_users, pair_routes = [], []
+    for band in range(N_BANDS):
+        keys = similarity.band_keys[band]
+        lo = np.searchsorted(keys, query_keys[:, band], side='left')
+        hi = np.searchsorted(keys, query_keys[:, band], side='right')
+        counts = hi - lo
+        total = int(counts.sum())
+        if not total:
+            continue
+        owner = np.repeat(np.arange(len(users)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_users.append(owner)
+        pair_routes.append(similarity.band_order[band, lo[owner] + offsets].astype(np.int64))
+    n_routes = len(index.route_ids)
+    if pair_users:
+        pairs = np.sort(np.concatenate(pair_users) * n_routes + np.concatenate(pair_routes))
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+    else:
+        pairs = np.empty(0, dtype=np.int64)
+    pair_user, pair_route = pairs // n_routes, pairs % n_routes
+    if allowed is not None:
+        keep = allowed[pair_route]
+        pair_user, pair_route = pair_user[keep], pair_route[keep]
+
+    # Точный Жаккар по парам: для каждого концерта набора проверяется один бит маски маршрута
+    # (позиции концертов наборов в индексе — матрица shape (наборы, наибольший набор), -1 для неизвестных)
+    positions = np.searchsorted(index.concert_ids, flat_ids)
+    known = positions < len(index.concert_ids)
+    known[known] = index.concert_ids[positions[known]] == flat_ids[known]
+    query_positions = np.full((len(users), int(sizes.max())), -1, dtype=np.int64)
+    ranks = np.arange(len(flat_ids)) - np.repeat(starts, sizes)
+    query_positions[np.repeat(np.arange(len(users)), sizes)[known], ranks[known]] = positions[known]
+    intersection = np.zeros(len(pair_route), dtype=np.int64)
+    flat_bits = index.route_bits.reshape(-1)
+    for rank in range(query_positions.shape[1]):
+        bit = query_positions[pair_user, rank]
+        valid = np.flatnonzero(bit >= 0)
+        bit = bit[valid]
+        words = flat_bits.take(pair_route[valid] * index.n_words + bit // RouteBitsetIndex.WORD_BITS)
+        intersection[valid] += ((words >> (bit % RouteBitsetIndex.WORD_BITS).astype(np.uint64)) & np.uint64(1)).astype(np.int64)
+    union = index.route_sizes[pair_route] + sizes[pair_user] - intersection
+    jaccard = np.divide(intersection, union, out=np.zeros(len(pair_route), dtype=np.float64), where=union > 0)
+
+    # Наборы с недостаточным числом кандидатов считаются по одному с дополнением по обратному индексу
+    short = np.bincount(pair_user, minlength=len(users)) < k
+    similar = (jaccard > 0) & ~short[pair_user]
+    pair_user, pair_route, jaccard = pair_user[similar], pair_route[similar], jaccard[similar]
+    # Пары уже упорядочены по (набор, маршрут): один стабильный argsort по ключу «набор, затем 1 - Жаккар»
+    # даёт порядок по убыванию Жаккара внутри набора, при равных — по позиции маршрута
+    order = np.argsort(pair_user * 2.0 + (1.0 - jaccard), kind='stable')
+    pair_user, pair_route, jaccard = pair_user[order], pair_route[order], jaccard[order]
+    bounds = np.searchsorted(pair_user, np.arange(len(users) + 1))
+    for i, user in enumerate(users.tolist()):
+        if short[i]:
+            results[user] = most_similar_routes(similarity, index, sets[user].tolist(), k, allowed)
+        else:
+            lo, hi = bounds[i], min(bounds[i + 1], bounds[i] + k)
+            results[user] = (pair_route[lo:hi], jaccard[lo:hi])
+    return results
@@ -0,0 +1,113 @@
+"""
+Слои Парето (skyline) маршрутов по IntellectScore, ComfortScore и Costs.
+
+Маршрут доминирует другой, если у него не ниже оба балла, не выше стоимость
+и хотя бы по одному критерию он строго лучше. Слой 0 — маршруты, которые никто
+не доминирует; слой k — маршруты, доминируемые только маршрутами слоёв < k.
+Слои считаются внутри каждой корзины количества концертов одним проходом
+по маршрутам в порядке убывания IntellectScore (алгоритм Кунга): для каждого
+слоя хранится «лестница» недоминируемых пар (ComfortScore, Costs), и проверка
+доминирования — бинарный поиск по ней. Слои монотонны (если маршрут доминирует
+слой k, его доминирует и слой k - 1), поэтому слой маршрута ищется бинарным
+поиском по слоям: O(n log n · log L) на корзину.
+"""
+import logging
+from bisect import bisect_left
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Сколько слоёв различается: более глубокие маршруты получают слой SKYLINE_MAX_LAYERS
+SKYLINE_MAX_LAYERS = 16
+
+
+class _Staircase:
+    """
+    Недоминируемые пары (comfort, cost) одного слоя: comfort по возрастанию, cost строго возрастает.
+    Пара с наименьшей стоимостью среди comfort >= c — первая с comfort >= c
+    """
+
+    def __init__(self):
+        self.comfort: List[float] = []
+        self.cost: List[float] = []
+
+    def dominates(self, comfort: float, cost: float) -> bool:
+        i = bisect_left(self.comfort, comfort)
+        return i < len(self.comfort) and self.cost[i] <= cost
+
+    def add(self, comfort: float, cost: float) -> None:
+        i = bisect_left(self.comfort, comfort)
+        # Пары слева с comfort <= comfort и cost >= cost больше не нужны — они идут подряд до позиции вставки
+        j = i
+        while j > 0 and self.cost[j - 1] >= cost:
+            j -= 1
+        if i < len(self.comfort) and self.comfort[i] == comfort:
+            i += 1
+        self.comfort[j:i] = [comfort]
+        self.cost[j:i] = [cost]
+
+
+def _group_layers(intellect: np.ndarray, comfort: np.ndarray, costs: np.ndarray, max_layers: int) -> np.ndarray:
+    """Слои Парето одной корзины"""
+    points = np.column_stack((intellect, comfort, costs))
+    # Одинаковые маршруты не доминируют друг друга: слой считается по уникальным точкам
+    unique, inverse = np.unique(points, axis=0, return_inverse=True)
+    # Доминирующая точка всегда обрабатывается раньше доминируемой
+    order = np.lexsort((unique[:, 2], -unique[:, 1], -unique[:, 0]))
+    layers = np.full(len(unique), max_layers, dtype=np.int32)
+    staircases: List[_Staircase] = []
+
+    for point in order.tolist():
+        c, cost = float(unique[point, 1]), float(unique[point, 2])
+        # Большинство маршрутов глубже последнего слоя — проверяем его первым
+        if len(staircases) == max_layers and staircases[-1].dominates(c, cost):
+            continue
+        lo, hi = 0, len(staircases)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if staircases[mid].dominates(c, cost):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(staircases):
+            staircases.append(_Staircase())
+        staircases[lo].add(c, cost)
+        layers[point] = lo
+
+    return layers[np.asarray(inverse).reshape(-1)]
+
+
+def skyline_layers(intellect: np.ndarray, comfort: np.ndarray, costs: np.ndarray,
+                   groups: Optional[np.ndarray] = None, max_layers: int = SKYLINE_MAX_LAYERS) -> np.ndarray:
+    """
+    Номера слоёв Парето маршрутов (больше баллы и меньше стоимость — лучше)
+
+    Args:
+        intellect: IntellectScore маршрутов (NaN считается 0)
+        comfort: ComfortScore маршрутов (NaN считается 0)
+        costs: Costs маршрутов (NaN считается худшей стоимостью)
+        groups: Корзины (например, количество концертов), слои считаются внутри каждой; необязательно
+        max_layers: Количество различаемых слоёв
+
+    Returns:
+        np.ndarray: Слой каждого маршрута (int32, от 0 до max_layers)
+    """
+    intellect = np.nan_to_num(np.asarray(intellect, dtype=np.float64))
+    comfort = np.nan_to_num(np.asarray(comfort, dtype=np.float64))
+    costs = np.nan_to_num(np.asarray(costs, dtype=np.float64), nan=np.inf)
+    layers = np.full(len(intellect), max_layers, dtype=np.int32)
+    if not len(layers):
+        return layers
+    if groups is None:
+        groups = np.zeros(len(layers), dtype=np.int64)
+
+    order = np.argsort(groups, kind='stable')
+    _, starts = np.unique(np.asarray(groups)[order], return_index=True)
+    for members in np.split(order, starts[1:]):
+        layers[members] = _group_layers(intellect[members], comfort[members], costs[members], max_layers)
+
+    logger.info(f"Слои Парето: {int((layers == 0).sum())} маршрутов в первом слое, "
+                f"{int((layers < max_layers).sum())} в {max_layers} слоях из {len(layers)}")
+    return layers
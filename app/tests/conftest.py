@@ -1,6 +1,7 @@
 import pytest
 import sys
 import os
+import tempfile
 from pathlib import Path
 
 # Добавляем путь к приложению в Python path
@@ -12,6 +13,7 @@ os.environ["TESTING"] = "True"
 os.environ["DATABASE_URL"] = "sqlite:///:memory:"
 os.environ["SECRET_KEY"] = "test_secret_key_for_testing_only"  # Добавляем SECRET_KEY для тестов
 os.environ["COOKIE_NAME"] = "access_token"  # Добавляем COOKIE_NAME для тестов
+os.environ["ROUTE_CATALOG_DIR"] = tempfile.mkdtemp(prefix="route_catalog_")  # Каталог маршрутов не пишется в data/
 
 # Переопределяем функцию get_settings ДО импорта модулей
 def override_get_settings():
@@ -225,4 +227,50 @@ def test_purchase(db_session, test_user, test_concert):
     db_session.add(purchase)
     db_session.commit()
     db_session.refresh(purchase)
-    return purchase 
\ No newline at end of file
+    return purchase 
+
+@pytest.fixture
+def route_catalog(db_session, test_hall):
+    """Небольшой каталог маршрутов с концертами для проверки доступности и рекомендаций"""
+    from datetime import datetime, timedelta
+    from sqlmodel import delete
+    from models import Concert, Route, AvailableRoute, Statistics, RouteConcertLink
+    from services.crud import route_service
+
+    concerts = [
+        Concert(
+            name=f"Концерт {external_id}",
+            datetime=datetime.now() + timedelta(days=1),
+            duration=timedelta(hours=1),
+            hall_id=test_hall.id,
+            external_id=external_id,
+            tickets_available=True
+        )
+        for external_id in (901, 902, 903)
+    ]
+    routes = [
+        Route(Sostav=sostav, Days=1, Concerts=len(sostav.split(',')), Halls=1,
+              ShowTime=60.0, TransTime=0.0, WaitTime=0.0, Costs=100.0,
+              IntellectScore=intellect, ComfortScore=comfort)
+        for sostav, intellect, comfort in (
+            ("901,902", 60.0, 40.0), ("902,903", 80.0, 20.0), ("903", 50.0, 50.0), ("901,904", 90.0, 90.0)
+        )
+    ]
+    db_session.add_all(concerts + routes)
+    db_session.commit()
+    route_service.bump_route_catalog_version(db_session)
+    route_service.ensure_route_sostav_ids(db_session)
+    route_service.rebuild_route_concert_links(db_session)
+
+    yield {"concerts": concerts, "routes": routes}
+
+    db_session.exec(delete(AvailableRoute))
+    db_session.exec(delete(RouteConcertLink))
+    db_session.exec(delete(Route))
+    db_session.exec(delete(Statistics))
+    for concert in concerts:
+        db_session.delete(concert)
+    db_session.commit()
+    route_service.clear_route_index_cache()
+    from services.recommendation import clear_recommendation_cache
+    clear_recommendation_cache()
@@ -162,4 +162,74 @@ class TestPurchaseAPI:
             headers=auth_headers
         )
         # Проверяем, что эндпоинт существует (может быть 200, 403 или 404)
-        assert response.status_code in [status.HTTP_200_OK, status.HTTP_403_FORBIDDEN, status.HTTP_404_NOT_FOUND] 
\ No newline at end of file
+        assert response.status_code in [status.HTTP_200_OK, status.HTTP_403_FORBIDDEN, status.HTTP_404_NOT_FOUND] 
+
+class TestRouteStatistics:
+    """Тесты сгруппированного расчёта статистики популярности маршрутов"""
+
+    def test_popularity_last_purchase_and_daily_stats(self, db_session, route_catalog):
+        """Тест статистики по CustomerRouteMatch и покупкам: популярность, последняя покупка, дни"""
+        from sqlmodel import delete, select
+        from sqlalchemy import func, text
+        from models import Concert, CustomerRouteMatch, Purchase
+        from services.crud import route_service
+        from services.crud.purchase import compute_route_statistics, get_route_statistics, clear_route_statistics_cache
+
+        routes, concerts = route_catalog["routes"], route_catalog["concerts"]
+        bought_at = datetime(2025, 6, 1, 12, 0)
+        purchases = [("s1", 0, 0), ("s1", 1, 1), ("s1", 1, 2), ("s2", 0, 3), ("s3", 2, 4)]
+        db_session.add_all([
+            Purchase(external_op_id=801 + number, user_external_id=user_id, concert_id=concerts[concert].id,
+                     purchased_at=bought_at + timedelta(hours=hours), price=100)
+            for number, (user_id, concert, hours) in enumerate(purchases)
+        ])
+        # Таблица до уникального индекса по user_external_id (ensure_route_indexes) могла содержать повторы
+        db_session.exec(text("DROP INDEX ix_customerroutematch_user_external_id"))
+        db_session.add_all([
+            CustomerRouteMatch(user_external_id=user_id, found=route is not None, match_type="exact" if route else "none",
+                               customer_concerts="", customer_concerts_count=0,
+                               best_route_id=routes[route].id if route is not None else None)
+            # s2 встречается дважды: учитывается последняя запись
+            for user_id, route in (("s1", 0), ("s2", 1), ("s2", 0), ("s3", None))
+        ])
+        db_session.commit()
+        try:
+            stats = compute_route_statistics(db_session)
+            assert stats["total_purchases"] == db_session.exec(select(func.count(Purchase.id))).one()
+            assert (stats["matched_customers"], stats["unmatched_customers"], stats["unique_routes"]) == (2, 1, 1)
+
+            top = stats["popular_routes"][0]
+            assert (top["route_id"], top["purchase_count"]) == (routes[0].id, 2)
+            assert top["last_purchase"] == bought_at + timedelta(hours=3)
+            assert top["route_details"]["concerts"] == 2
+
+            festival_day = concerts[0].datetime.date()
+            day = next(day for day in stats["daily_stats"] if day["date"] == festival_day)
+            expected_purchases = sum(
+                1 for concert_datetime in db_session.exec(
+                    select(Concert.datetime).join(Purchase, Purchase.concert_id == Concert.id)
+                ).all()
+                if concert_datetime and concert_datetime.date() == festival_day
+            )
+            assert expected_purchases >= 5
+            assert (day["purchases"], day["routes"]) == (expected_purchases, 1)
+
+            clear_route_statistics_cache()
+            assert get_route_statistics(db_session)["popular_routes"] == stats["popular_routes"]
+
+            # При запуске повторы удаляются (остаётся последняя запись) и создаётся уникальный индекс
+            route_service.ensure_route_indexes(db_session)
+            assert db_session.exec(
+                select(CustomerRouteMatch.best_route_id).where(CustomerRouteMatch.user_external_id == "s2")
+            ).all() == [routes[0].id]
+            assert compute_route_statistics(db_session)["popular_routes"] == stats["popular_routes"]
+        finally:
+            clear_route_statistics_cache()
+            db_session.exec(delete(Purchase).where(Purchase.external_op_id.between(801, 805)))
+            db_session.exec(delete(CustomerRouteMatch))
+            db_session.exec(text("DROP INDEX IF EXISTS ux_customerroutematch_user_external_id"))
+            db_session.exec(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ix_customerroutematch_user_external_id "
+                "ON customerroutematch (user_external_id)"
+            ))
+            db_session.commit()
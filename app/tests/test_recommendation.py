@@ -0,0 +1,277 @@
+import pytest
+
+from services import recommendation
+
+
+@pytest.fixture
+def all_routes_available(db_session, route_catalog, test_hall):
+    """Добавляет концерт 904, чтобы все маршруты каталога были доступны"""
+    from datetime import datetime, timedelta
+    from models import Concert
+
+    concert = Concert(name="Концерт 904", datetime=datetime.now() + timedelta(days=1), duration=timedelta(hours=1),
+                      hall_id=test_hall.id, external_id=904, tickets_available=True)
+    db_session.add(concert)
+    db_session.commit()
+    yield concert
+    db_session.delete(concert)
+    db_session.commit()
+
+
+class TestRecommendations:
+    """Тесты подборок маршрутов по анкете пользователя"""
+
+    def test_get_recommendations_uses_catalog(self, db_session, route_catalog, all_routes_available):
+        """Тест подборок по колоночному каталогу маршрутов"""
+        routes = route_catalog["routes"]
+        result = recommendation.get_recommendations(db_session, {"priority": "intellect"}, top_n=2)
+
+        assert [r["id"] for r in result["top_weighted"]] == [routes[3].id, routes[1].id]
+        assert result["top_weighted"][0]["weighted"] == 90.0
+        assert [r["id"] for r in result["top_comfort"]] == [routes[3].id, routes[2].id]
+        # Равные баллы: порядок маршрутов сохраняется
+        assert [r["id"] for r in result["top_balanced"]] == [routes[2].id, routes[3].id]
+        assert result["top_intellect"][0]["concerts"] == "901,904"
+
+    def test_min_concerts_is_relaxed(self, db_session, route_catalog):
+        """Тест понижения min_concerts, если маршрутов нужной длины нет"""
+        routes = route_catalog["routes"]
+        result = recommendation.get_recommendations(
+            db_session, {"priority": "comfort", "min_concerts": 5, "max_concerts": 1}
+        )
+        assert [r["id"] for r in result["top_comfort"]] == [routes[2].id]
+
+    def test_alternatives_by_planned_concerts(self, db_session, route_catalog, all_routes_available):
+        """Тест альтернатив: маршруты, похожие по составу на запланированные концерты"""
+        routes = route_catalog["routes"]
+        result = recommendation.get_recommendations(db_session, {"planned_concerts": "901, 902"}, top_n=3)
+
+        alternatives = result["alternatives"]
+        assert [r["id"] for r in alternatives] == [routes[0].id, routes[1].id, routes[3].id]
+        assert [r["jaccard"] for r in alternatives] == [1.0, 0.3333, 0.3333]
+        assert alternatives[0]["concerts"] == "901,902"
+        assert recommendation.get_recommendations(db_session, {"planned_concerts": [999]})["alternatives"] == []
+
+    def test_include_exclude_filters(self, db_session, route_catalog, all_routes_available):
+        """Тест фильтров анкеты по композиторам, артистам и концертам"""
+        from sqlmodel import delete
+        from models import Author, Composition, ConcertCompositionLink, Artist, ConcertArtistLink
+
+        routes = route_catalog["routes"]
+        concerts = {concert.external_id: concert for concert in route_catalog["concerts"]}
+        bach, mozart = Author(name="Бах"), Author(name="Моцарт")
+        artist = Artist(name="Оркестр")
+        db_session.add_all([bach, mozart, artist])
+        db_session.commit()
+        fugue, sonata = Composition(name="Фуга", author_id=bach.id), Composition(name="Соната", author_id=mozart.id)
+        db_session.add_all([fugue, sonata])
+        db_session.commit()
+        db_session.add_all([
+            ConcertCompositionLink(concert_id=concerts[901].id, composition_id=fugue.id),
+            ConcertCompositionLink(concert_id=concerts[903].id, composition_id=sonata.id),
+            ConcertArtistLink(concert_id=concerts[902].id, artist_id=artist.id),
+        ])
+        db_session.commit()
+
+        def ids(preferences):
+            result = recommendation.get_recommendations(db_session, {"priority": "intellect", **preferences})
+            return sorted(r["id"] for r in result["top_intellect"])
+
+        try:
+            assert ids({"composers": [bach.id]}) == [routes[0].id, routes[3].id]
+            assert ids({"exclude_composers": [mozart.id]}) == [routes[0].id, routes[3].id]
+            assert ids({"artists": [artist.id], "exclude_composers": [bach.id]}) == [routes[1].id]
+            assert ids({"concerts": [concerts[903].id], "exclude_artists": [artist.id]}) == [routes[2].id]
+            assert ids({"composers": [bach.id], "exclude_concerts": [concerts[901].id]}) == []
+        finally:
+            db_session.exec(delete(ConcertCompositionLink))
+            db_session.exec(delete(ConcertArtistLink))
+            for item in (fugue, sonata, bach, mozart, artist):
+                db_session.delete(item)
+            db_session.commit()
+
+    def test_diversity_uses_catalog_columns(self, db_session, route_catalog, all_routes_available):
+        """Тест фильтра разнообразия по предвычисленным метрикам композиторов маршрутов"""
+        from sqlmodel import delete
+        from models import Author, Composition, ConcertCompositionLink
+        from services.crud import route_service
+
+        routes = route_catalog["routes"]
+        concerts = {concert.external_id: concert for concert in route_catalog["concerts"]}
+        authors = {name: Author(name=name) for name in ("Бах", "Моцарт", "Гайдн")}
+        db_session.add_all(authors.values())
+        db_session.commit()
+        programs = {901: ["Бах", "Бах"], 902: ["Моцарт", "Гайдн"], 903: ["Моцарт"]}
+        compositions = []
+        for external_id, names in programs.items():
+            for number, name in enumerate(names):
+                composition = Composition(name=f"Опус {external_id}-{number}", author_id=authors[name].id)
+                db_session.add(composition)
+                db_session.commit()
+                db_session.add(ConcertCompositionLink(concert_id=concerts[external_id].id, composition_id=composition.id))
+                compositions.append(composition)
+        db_session.commit()
+        route_service.bump_route_catalog_version(db_session)
+
+        def ids(diversity):
+            result = recommendation.get_recommendations(db_session, {"priority": "intellect", "diversity": diversity})
+            return sorted(r["id"] for r in result["top_intellect"])
+
+        try:
+            catalog = route_service.get_route_catalog(db_session)
+            assert catalog.column("DistinctComposers").tolist() == [3, 2, 1, 1]
+            assert catalog.column("TopComposerShare").tolist() == [0.5, 2 / 3, 1.0, 1.0]
+            assert ids("diverse") == [routes[0].id]
+            assert ids("mono") == [routes[1].id, routes[2].id, routes[3].id]
+            assert len(ids("flexible")) == 4
+        finally:
+            db_session.exec(delete(ConcertCompositionLink))
+            for item in compositions + list(authors.values()):
+                db_session.delete(item)
+            db_session.commit()
+
+    def test_sold_out_routes_are_masked(self, db_session, route_catalog):
+        """Тест доступности: маршруты с распроданными или отсутствующими концертами не попадают в подборки"""
+        from services.crud import route_service
+
+        routes = route_catalog["routes"]
+        concerts = {concert.external_id: concert for concert in route_catalog["concerts"]}
+
+        def ids(result, name):
+            return sorted(r["id"] for r in result[name])
+
+        # Концерта 904 нет в базе — маршрут 901,904 недоступен
+        result = recommendation.get_recommendations(db_session, {"priority": "intellect", "planned_concerts": [901]})
+        assert ids(result, "top_intellect") == [routes[0].id, routes[1].id, routes[2].id]
+        assert ids(result, "alternatives") == [routes[0].id]
+
+        concerts[902].tickets_available = False
+        db_session.add(concerts[902])
+        db_session.commit()
+        route_service.on_concert_availability_changed(db_session, [902])
+        result = recommendation.get_recommendations(db_session, {"priority": "intellect"})
+        assert ids(result, "top_intellect") == [routes[2].id]
+
+        # Рейтинги доступных маршрутов строятся один раз на версию маски доступности
+        catalog = route_service.get_route_catalog(db_session)
+        available = route_service.get_route_availability_mask(db_session)
+        ranking = recommendation.get_available_route_ranking_index(catalog, available)
+        assert recommendation.get_available_route_ranking_index(catalog, available) is ranking
+        assert ranking.window_size(ranking.window()) == int(available.sum())
+
+    def test_complete_route_by_purchases(self, db_session, route_catalog, all_routes_available):
+        """Тест дополнения маршрута: маршруты, содержащие все купленные концерты и ещё хотя бы один"""
+        from datetime import datetime
+        from models import Purchase
+
+        routes = route_catalog["routes"]
+        concerts = {concert.external_id: concert for concert in route_catalog["concerts"]}
+        purchase = Purchase(external_op_id=1, user_external_id="complete-1", concert_id=concerts[902].id,
+                            purchased_at=datetime.now(), price=1000)
+        db_session.add(purchase)
+        db_session.commit()
+        try:
+            result = recommendation.complete_route_recommendations(db_session, "complete-1", metric="intellect")
+            assert result["purchased_concerts"] == [902]
+            assert [r["id"] for r in result["routes"]] == [routes[1].id, routes[0].id]
+            assert [r["new_concerts"] for r in result["routes"]] == [[903], [901]]
+
+            result = recommendation.complete_route_recommendations(db_session, concert_ids=[901], metric="comfort")
+            assert [r["id"] for r in result["routes"]] == [routes[3].id, routes[0].id]
+            # Маршрут, совпадающий с купленным набором, ничего не добавляет
+            assert recommendation.complete_route_recommendations(db_session, concert_ids=[903])["candidates"] == 1
+            assert recommendation.complete_route_recommendations(db_session, concert_ids=[901, 903])["routes"] == []
+        finally:
+            db_session.delete(purchase)
+            db_session.commit()
+
+    def test_batch_matches_single_requests(self, db_session, route_catalog, all_routes_available):
+        """Тест пакетных подборок: те же результаты, что и по одному запросу, в порядке запросов"""
+        from datetime import datetime
+        from models import Purchase
+
+        concerts = {concert.external_id: concert for concert in route_catalog["concerts"]}
+        purchase = Purchase(external_op_id=2, user_external_id="batch-1", concert_id=concerts[903].id,
+                            purchased_at=datetime.now(), price=500)
+        db_session.add(purchase)
+        db_session.commit()
+        requests = [
+            {"user_external_id": "batch-1", "preferences": {"priority": "comfort"}},
+            {"id": "anon", "preferences": {"priority": "comfort"}},
+            {"user_external_id": "batch-2", "preferences": {"priority": "intellect", "planned_concerts": [901, 902]}},
+            {"user_external_id": "batch-3", "preferences": {"max_concerts": 1}},
+            # Концерты анкеты без внешних ID не мешают альтернативам по покупкам
+            {"id": "unknown-concerts", "user_external_id": "batch-1",
+             "preferences": {"priority": "comfort", "concerts": [987654321]}},
+            {"user_external_id": "batch-4", "preferences": {"priority": "comfort", "concerts": [concerts[902].id]}},
+        ]
+        try:
+            batch = list(recommendation.iter_recommendations_batch(db_session, iter(requests), top_n=3, batch_size=2))
+            assert [key for key, _ in batch] == ["batch-1", "anon", "batch-2", "batch-3", "unknown-concerts", "batch-4"]
+            for request, (_, result) in zip(requests, batch):
+                expected = recommendation.get_recommendations(
+                    db_session, request["preferences"], top_n=3, user_external_id=request.get("user_external_id")
+                )
+                assert result == expected
+            assert batch[0][1]["alternatives"] and not batch[1][1]["alternatives"]
+            assert batch[4][1]["alternatives"] == batch[0][1]["alternatives"]
+            assert batch[5][1]["alternatives"]
+        finally:
+            db_session.delete(purchase)
+            db_session.commit()
+
+    def test_result_cache_hits_and_invalidation(self, db_session, route_catalog):
+        """Тест кэша подборок: попадание по нормализованной анкете и сброс при смене версии данных"""
+        from services.crud import route_service
+
+        recommendation.clear_recommendation_cache()
+        first = recommendation.get_recommendations(db_session, {"priority": "comfort", "planned_concerts": [902, 901]})
+        # Порядок и повторы ID, пустые значения не меняют ключ
+        second = recommendation.get_recommendations(
+            db_session, {"planned_concerts": "901, 902, 901", "priority": "comfort", "diversity": None}
+        )
+        assert second == first
+        # Возвращается копия: изменения вызывающего кода не портят кэш
+        second["top_weighted"].clear()
+        assert recommendation.get_recommendations(db_session, {"priority": "comfort", "planned_concerts": [901, 902]}) == first
+        stats = recommendation.get_recommendation_cache_stats()
+        assert (stats["hits"], stats["misses"], stats["size"]) == (2, 1, 1)
+
+        route_service.bump_route_catalog_version(db_session)
+        recommendation.get_recommendations(db_session, {"priority": "comfort", "planned_concerts": [901, 902]})
+        route_service.update_available_routes_cache(db_session, 0)
+        recommendation.get_recommendations(db_session, {"priority": "comfort", "planned_concerts": [901, 902]})
+        stats = recommendation.get_recommendation_cache_stats()
+        assert (stats["hits"], stats["misses"]) == (2, 3)
+
+    def test_precomputed_discrete_preferences(self, db_session, route_catalog):
+        """Тест предвычисленных подборок: те же результаты, что у живого расчёта, и отказ при смене версии"""
+        from services.crud import route_service
+
+        recommendation.clear_recommendation_cache()
+        preferences = [
+            {"priority": "intellect"},
+            {"priority": "comfort", "min_concerts": 5, "max_concerts": 1},
+            {"priority": "balance", "min_concerts": 2},
+        ]
+        live = [recommendation.get_recommendations(db_session, dict(p)) for p in preferences]
+        recommendation.clear_recommendation_cache()
+
+        # Корзины каталога: 1 и 2 концерта — 3 окна на каждый из 3 приоритетов
+        assert recommendation.precompute_recommendations(db_session) == 9
+        assert recommendation.precompute_recommendations(db_session) == 0
+        assert [recommendation.get_recommendations(db_session, dict(p)) for p in preferences] == live
+        # Свободные поля анкеты считаются живым движком
+        recommendation.get_recommendations(db_session, {"priority": "intellect", "planned_concerts": [901]})
+        assert recommendation.get_precompute_status()["hits"] == 3
+        assert recommendation.get_recommendation_cache_stats()["misses"] == 1
+
+        route_service.update_available_routes_cache(db_session, 0)
+        recommendation.get_recommendations(db_session, {"priority": "intellect"})
+        assert recommendation.get_precompute_status()["hits"] == 3
+
+    def test_empty_catalog(self, db_session):
+        """Тест рекомендаций без маршрутов"""
+        result = recommendation.get_recommendations(db_session, {})
+        assert result["top_weighted"] == []
+        assert result["alternatives"] == []
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+from services.route_catalog import RouteCatalog
+
+
+class TestRouteCatalog:
+    """Тесты колоночного каталога маршрутов"""
+
+    def test_from_rows_and_mmap_roundtrip(self, tmp_path):
+        """Тест построения каталога, сохранения и загрузки через mmap"""
+        rows = [
+            (1, [1, 2], 2, 60.0),
+            (5, [3], 1, None),
+            (7, [], 0, 10.5),
+        ]
+        catalog = RouteCatalog.from_rows("v1", ["Concerts", "IntellectScore"], ["Concerts"], rows)
+        assert len(catalog) == 3
+        assert catalog.column("Concerts").dtype == np.int64
+        assert np.isnan(catalog.column("IntellectScore")[1])
+        assert catalog.concerts_of(0).tolist() == [1, 2]
+        assert catalog.route_sizes.tolist() == [2, 1, 0]
+        assert catalog.positions([7, 2, 1]).tolist() == [2, 0]
+
+        directory = str(tmp_path / "v1")
+        catalog.save(directory)
+        loaded = RouteCatalog.load("v1", directory)
+        assert isinstance(loaded.route_ids, np.memmap)
+        assert loaded.route_ids.tolist() == [1, 5, 7]
+        assert loaded.column("IntellectScore")[2] == 10.5
+        assert [c.tolist() for c in loaded.compositions()] == [[1, 2], [3], []]
+
+        # Повторное сохранение той же версии (другим процессом) не ломает каталог
+        catalog.save(directory)
+        assert RouteCatalog.load("v1", str(tmp_path / "missing")) is None
+
+    def test_catalog_follows_route_catalog_version(self, db_session, route_catalog):
+        """Тест кэширования каталога по версии и его сохранения для других процессов"""
+        from services.crud import route_service
+
+        catalog = route_service.get_route_catalog(db_session)
+        assert catalog.route_ids.tolist() == [route.id for route in route_catalog["routes"]]
+        assert catalog.concerts_of(3).tolist() == [901, 904]
+        assert catalog.column("IntellectScore").tolist() == [60.0, 80.0, 50.0, 90.0]
+        assert route_service.get_route_catalog(db_session) is catalog
+        assert os.path.isdir(os.path.join(route_service.get_route_catalog_dir(), catalog.key))
+
+        # Другой процесс открывает сохранённые файлы, не обращаясь к маршрутам
+        route_service.clear_route_catalog_cache()
+        reopened = route_service.get_route_catalog(db_session)
+        assert reopened.key == catalog.key
+        assert isinstance(reopened.route_ids, np.memmap)
+
+        route_service.bump_route_catalog_version(db_session)
+        assert route_service.get_route_catalog(db_session).key != catalog.key
+        assert not os.path.isdir(os.path.join(route_service.get_route_catalog_dir(), catalog.key))
+
+    def test_route_diversity_columns(self):
+        """Тест метрик разнообразия маршрутов по произведениям композиторов"""
+        from services.crud.route_service import route_diversity_columns
+
+        pairs = np.array([[0, 1], [0, 1], [0, 2], [1, 5]])
+        columns = route_diversity_columns(3, pairs)
+        assert columns["DistinctComposers"].tolist() == [2, 1, 0]
+        assert columns["TopComposerShare"][:2].tolist() == [2 / 3, 1.0]
+        assert np.isnan(columns["TopComposerShare"][2])
+        assert np.allclose(columns["ComposerEntropy"], [0.9183, 0.0, 0.0], atol=1e-4)
+        assert route_diversity_columns(2, np.empty((0, 2), dtype=np.int64))["DistinctComposers"].tolist() == [0, 0]
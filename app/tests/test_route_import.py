@@ -0,0 +1,164 @@
+import pytest
+
+ROUTES_CSV_HEADER = "Sostav,Days,Concerts,Halls,Genre,ShowTime,TransTime,WaitTime,Costs,ComfortScore,TransTime_%\n"
+
+
+@pytest.fixture
+def clean_routes(db_session):
+    """Очистка маршрутов после теста импорта"""
+    yield
+    from sqlmodel import delete
+    from models import Route, AvailableRoute, Statistics, RouteConcertLink
+    from services.crud import route_service
+
+    db_session.exec(delete(AvailableRoute))
+    db_session.exec(delete(RouteConcertLink))
+    db_session.exec(delete(Route))
+    db_session.exec(delete(Statistics))
+    db_session.commit()
+    route_service.clear_route_index_cache()
+
+
+class TestRouteImport:
+    """Тесты потокового импорта маршрутов из CSV"""
+
+    def test_import_and_upsert_by_composition(self, db_session, clean_routes, tmp_path):
+        """Тест добавления, обновления по составу и пропуска некорректных строк"""
+        from sqlmodel import select
+        from models import Route
+        from services.crud.route_import import import_routes_csv
+
+        path = tmp_path / "routes.csv"
+        path.write_text(
+            ROUTES_CSV_HEADER
+            + '"3, 1,2",1,3,2,Классика,180,10.5,5,1500,70.5,12.5\n'
+            + '"5",1,1,1,,60,0,0,500,,\n'
+            + '"",1,1,1,,60,0,0,500,,\n'            # пустой состав
+            + '"7",x,1,1,,60,0,0,500,,\n'           # некорректное обязательное поле
+            + '"2,1,3",2,3,2,Джаз,180,10.5,5,1600,,\n',  # тот же состав, что в первой строке
+            encoding="utf-8"
+        )
+        status = {}
+        result = import_routes_csv(db_session, str(path), chunk_size=2, status_dict=status)
+        assert (result["added"], result["updated"], result["skipped"]) == (2, 1, 2)
+        assert status["progress"] == status["total"] == 5
+        assert status["added"] == 2
+
+        route = db_session.exec(select(Route).where(Route.Sostav == "1,2,3")).one()
+        assert route.SostavIds == [1, 2, 3]
+        assert (route.Days, route.Genre, route.Costs) == (2, "Джаз", 1600.0)
+        # Строка файла заменяет маршрут целиком: пустые значения очищают сохранённые
+        assert route.ComfortScore is None
+        assert route.TransTime_percent is None
+
+        path.write_text(ROUTES_CSV_HEADER + '"5",2,1,1,Опера,60,0,0,700,,\n', encoding="utf-8")
+        result = import_routes_csv(db_session, str(path))
+        assert (result["added"], result["updated"], result["skipped"]) == (0, 1, 0)
+        db_session.expire_all()
+        route = db_session.exec(select(Route).where(Route.Sostav == "5")).one()
+        assert (route.Days, route.Genre, route.Costs) == (2, "Опера", 700.0)
+
+        # Повторная загрузка того же файла ничего не меняет
+        result = import_routes_csv(db_session, str(path))
+        assert (result["updated"], result["unchanged"]) == (0, 1)
+
+        # Очищенное в файле значение очищается и в базе, отпечаток соответствует строке
+        path.write_text(ROUTES_CSV_HEADER + '"5",2,1,1,,60,0,0,700,,\n', encoding="utf-8")
+        result = import_routes_csv(db_session, str(path))
+        assert result["updated"] == 1
+        db_session.expire_all()
+        route = db_session.exec(select(Route).where(Route.Sostav == "5")).one()
+        assert (route.Days, route.Genre, route.Costs) == (2, None, 700.0)
+        result = import_routes_csv(db_session, str(path))
+        assert (result["updated"], result["unchanged"]) == (0, 1)
+
+    def test_load_routes_from_csv_keeps_status_contract(self, db_session, clean_routes, tmp_path):
+        """Тест загрузки маршрутов с обновлением каталога и статуса загрузки"""
+        from services.crud import data_loader, route_service
+
+        path = tmp_path / "routes.csv"
+        path.write_text(ROUTES_CSV_HEADER + '"10,9",1,2,1,,60,0,0,500,,\n', encoding="utf-8")
+        status = {"in_progress": True}
+        version = route_service.get_route_catalog_version(db_session)
+
+        result = data_loader.load_routes_from_csv(db_session, str(path), status_dict=status)
+        assert (result["added"], result["updated"], result["skipped"]) == (1, 0, 0)
+        assert result["delta_applied"] is False
+        assert status["in_progress"] is False
+        assert status["added"] == 1
+        assert route_service.get_route_catalog_version(db_session) == version + 1
+        assert route_service.get_route_catalog(db_session).concerts_of(0).tolist() == [9, 10]
+
+        missing = data_loader.load_routes_from_csv(db_session, str(tmp_path / "missing.csv"), status_dict=status)
+        assert (missing["added"], missing["updated"], missing["skipped"]) == (0, 0, 0)
+        assert status["error"]
+
+    def test_reupload_applies_only_delta(self, db_session, clean_routes, tmp_path):
+        """Тест повторной загрузки: удалённые маршруты удаляются, неизменённые не трогаются"""
+        from sqlmodel import select
+        from models import Route, AvailableRoute, RouteConcertLink
+        from services.crud import data_loader, route_service
+
+        path = tmp_path / "routes.csv"
+        path.write_text(
+            ROUTES_CSV_HEADER
+            + '"901,902",1,2,1,,60,0,0,500,,\n'
+            + '"903",1,1,1,,60,0,0,300,,\n',
+            encoding="utf-8"
+        )
+        data_loader.load_routes_from_csv(db_session, str(path))
+        kept = db_session.exec(select(Route).where(Route.Sostav == "901,902")).one()
+        kept_id, kept_hash = kept.id, kept.RowHash
+        version = route_service.get_route_catalog_version(db_session)
+
+        path.write_text(
+            ROUTES_CSV_HEADER
+            + '"901,902",1,2,1,,60,0,0,500,,\n'
+            + '"902",1,1,1,,60,0,0,200,,\n',
+            encoding="utf-8"
+        )
+        result = data_loader.load_routes_from_csv(db_session, str(path))
+        assert (result["added"], result["updated"], result["unchanged"], result["removed"]) == (1, 0, 1, 1)
+        assert result["delta_applied"] is True
+        assert route_service.get_route_catalog_version(db_session) == version + 1
+
+        db_session.expire_all()
+        sostavs = sorted(db_session.exec(select(Route.Sostav)).all())
+        assert sostavs == ["901,902", "902"]
+        kept = db_session.get(Route, kept_id)
+        assert kept.RowHash == kept_hash
+        linked = set(db_session.exec(select(RouteConcertLink.concert_id)).all())
+        assert 903 not in linked
+        assert route_service.get_route_catalog(db_session).route_ids.tolist() == sorted(
+            db_session.exec(select(Route.id)).all()
+        )
+        # Повторная загрузка без изменений не меняет версию каталога
+        data_loader.load_routes_from_csv(db_session, str(path))
+        assert route_service.get_route_catalog_version(db_session) == version + 1
+        available_ids = set(db_session.exec(select(AvailableRoute.original_route_id)).all())
+        assert available_ids <= set(db_session.exec(select(Route.id)).all())
+
+    def test_parallel_parse_keeps_file_order(self, db_session, clean_routes, tmp_path):
+        """Тест параллельного разбора по диапазонам байтов: последняя строка состава побеждает"""
+        from sqlmodel import select
+        from models import Route
+        from services.crud.route_import import import_routes_csv, read_csv_header, split_byte_ranges
+
+        path = tmp_path / "routes.csv"
+        rows = [f'"{i},{i + 1}",1,2,1,,60,0,0,{100 + i},,\n' for i in range(1, 41)]
+        rows.append('"2,1",3,2,1,,60,0,0,999,,\n')  # повтор первого маршрута в последнем диапазоне
+        path.write_text(ROUTES_CSV_HEADER + "".join(rows), encoding="utf-8")
+
+        header, data_start = read_csv_header(str(path))
+        assert header[0] == "Sostav" and header[-1] == "TransTime_%"
+        ranges = split_byte_ranges(str(path), data_start, 200)
+        assert len(ranges) > 2
+        assert ranges[0][0] == data_start and ranges[-1][1] == path.stat().st_size
+        content = path.read_bytes()
+        # Каждый диапазон начинается с новой строки
+        assert all(content[start - 1:start] == b"\n" for start, _ in ranges)
+
+        result = import_routes_csv(db_session, str(path), chunk_size=7, workers=2, range_bytes=200)
+        assert (result["added"], result["updated"], result["skipped"]) == (40, 1, 0)
+        route = db_session.exec(select(Route).where(Route.Sostav == "1,2")).one()
+        assert (route.Days, route.Costs) == (3, 999.0)
@@ -0,0 +1,448 @@
+import numpy as np
+import pytest
+
+from services.route_index import RouteBitsetIndex, intersect_sorted, parse_sostav
+
+
+class TestRouteBitsetIndex:
+    """Тесты битового индекса маршрутов"""
+
+    def test_parse_sostav(self):
+        """Тест разбора состава маршрута"""
+        assert parse_sostav("3,1,2") == [1, 2, 3]
+        assert parse_sostav(" 10, 2 ,2") == [2, 10]
+        assert parse_sostav("") == []
+        assert parse_sostav(None) == []
+
+    def test_available_mask_single_pass(self):
+        """Тест вычисления доступности всего каталога"""
+        index = RouteBitsetIndex.from_compositions(
+            [1, 2, 3, 4],
+            [[1, 2], [2, 3], [70, 1], []]
+        )
+        assert index.n_words == 1
+        assert index.route_sizes.tolist() == [2, 2, 2, 0]
+
+        # Все концерты доступны: недоступен только пустой маршрут
+        assert index.available_mask([]).tolist() == [True, True, True, False]
+
+        # Концерт 2 распродан
+        assert index.available_mask([2]).tolist() == [False, False, True, False]
+
+        # Неизвестные индексу концерты игнорируются
+        assert index.available_mask([999]).tolist() == [True, True, True, False]
+
+    def test_many_concerts_span_several_words(self):
+        """Тест индекса, в котором концерты занимают несколько 64-битных слов"""
+        compositions = [[i, i + 100] for i in range(1, 101)]
+        index = RouteBitsetIndex.from_compositions(list(range(1, 101)), compositions)
+        assert index.n_words > 1
+
+        available = index.available_mask([150])
+        assert not available[49]
+        assert available.sum() == 99
+
+    def test_any_and_all_masks(self):
+        """Тест масок «хотя бы один» и «все» по набору концертов"""
+        index = RouteBitsetIndex.from_pairs([1, 2, 3], np.array([2, 0, 0, 1]), np.array([200, 5, 200, 5]))
+        assert index.route_sizes.tolist() == [2, 1, 1]
+        assert index.any_mask([200]).tolist() == [True, False, True]
+        assert index.any_mask([5, 999]).tolist() == [True, True, False]
+        assert index.all_mask([5, 200]).tolist() == [True, False, False]
+        assert index.all_mask([5, 999]).tolist() == [False, False, False]
+        assert index.any_mask([]).tolist() == [False, False, False]
+
+    def test_routes_for_concerts(self):
+        """Тест обратного индекса концерт → маршруты"""
+        index = RouteBitsetIndex.from_compositions(
+            [10, 20, 30, 40],
+            [[1, 2], [2, 3], [3], [1, 3]]
+        )
+        assert index.routes_for_concerts([2]).tolist() == [0, 1]
+        assert index.routes_for_concerts([1, 3]).tolist() == [0, 1, 2, 3]
+        assert index.routes_for_concerts([999]).tolist() == []
+
+        # Проверка только подмножества маршрутов
+        positions = index.routes_for_concerts([3])
+        assert index.available_mask([3], positions).tolist() == [False, False, False]
+        assert index.available_mask([2], positions).tolist() == [False, True, True]
+
+    def test_routes_containing_all_by_posting_lists(self):
+        """Тест пересечения списков концерт → маршруты: совпадает с проверкой по битовым маскам"""
+        rng = np.random.default_rng(3)
+        # Концерт 1 входит почти во все маршруты, остальные — редкие
+        compositions = [sorted({1, *rng.integers(2, 60, size=rng.integers(0, 5)).tolist()}) for _ in range(400)]
+        index = RouteBitsetIndex.from_compositions(list(range(400)), compositions)
+        for query in ([1], [1, 5], [5, 7], [1, 5, 9], [2, 3, 4], [999], [1, 999]):
+            expected = np.flatnonzero(index.all_mask(query))
+            assert index.routes_containing_all(query).tolist() == expected.tolist()
+
+        large = np.arange(0, 1000, 3)
+        for small in (np.array([0, 4, 9, 500, 999]), np.arange(0, 1000, 2), np.array([], dtype=np.int64)):
+            assert intersect_sorted(small, large).tolist() == np.intersect1d(small, large).tolist()
+
+    def test_exact_route_and_top_supersets(self):
+        """Тест точного совпадения по хэшу состава и лучших надмножеств: как полный перебор составов"""
+        from services.crud.customer_match import top_superset_routes
+
+        rng = np.random.default_rng(5)
+        compositions = [sorted(set(rng.integers(1, 150, size=rng.integers(1, 6)).tolist())) for _ in range(600)]
+        index = RouteBitsetIndex.from_compositions(list(range(100, 700)), compositions)
+        for query in [compositions[0], compositions[17], [1], [5, 7], [999], compositions[3][:1]]:
+            expected_exact = next((i for i, c in enumerate(compositions) if c == sorted(set(query))), None)
+            assert index.exact_route(query) == expected_exact
+            supersets = sorted((len(c), i) for i, c in enumerate(compositions) if set(query) <= set(c))
+            positions, total = top_superset_routes(index, query, 3)
+            assert positions.tolist() == [i for _, i in supersets[:3]]
+            assert total == len(supersets)
+            if supersets:
+                assert top_superset_routes(index, query, 1)[0].tolist() == [supersets[0][1]]
+
+    def test_blocked_concerts(self):
+        """Тест определения недоступных концертов (нет билетов или концерт не найден)"""
+        index = RouteBitsetIndex.from_compositions([1, 2], [[1, 2], [3]])
+        blocked = index.blocked_concerts([1, 3, 5])
+        assert blocked.tolist() == [2]
+        assert index.available_mask(blocked).tolist() == [False, True]
+
+    def test_matches_row_by_row_check(self):
+        """Тест совпадения векторной проверки с построчной"""
+        rng = np.random.default_rng(42)
+        compositions = [sorted(set(rng.integers(1, 130, size=rng.integers(1, 8)).tolist())) for _ in range(500)]
+        index = RouteBitsetIndex.from_compositions(list(range(500)), compositions)
+        blocked = set(rng.integers(1, 130, size=20).tolist())
+
+        expected = [not (set(c) & blocked) for c in compositions]
+        assert index.available_mask(blocked).tolist() == expected
+
+
+class TestAvailableRoutesRefresh:
+    """Тесты обновления AvailableRoute по битовому индексу"""
+
+    def test_init_and_update_write_only_delta(self, db_session, route_catalog):
+        """Тест инициализации и дельта-обновления AvailableRoute"""
+        from sqlmodel import select
+        from models import AvailableRoute
+        from services.crud import route_service
+
+        routes = route_catalog["routes"]
+        result = route_service.init_available_routes(db_session)
+        # Маршрут с концертом 904 недоступен: такого концерта нет
+        assert result["available_routes"] == 3
+        assert result["unavailable_routes"] == 1
+
+        concert = route_catalog["concerts"][1]
+        concert.tickets_available = False
+        db_session.add(concert)
+        db_session.commit()
+
+        result = route_service.update_available_routes(db_session)
+        assert result["deleted_count"] == 2
+        assert result["added_count"] == 0
+        assert result["current_count"] == 1
+
+        original_ids = db_session.exec(
+            select(AvailableRoute.original_route_id).order_by(AvailableRoute.original_route_id)
+        ).all()
+        assert original_ids == [routes[2].id]
+
+        concert.tickets_available = True
+        db_session.add(concert)
+        db_session.commit()
+
+        result = route_service.update_available_routes(db_session)
+        assert result["added_count"] == 2
+        assert result["current_count"] == 3
+
+    def test_sql_refresh_matches_bitset_index(self, db_session, route_catalog):
+        """Тест совпадения SQL-обновления с вычислением по битовому индексу"""
+        from sqlmodel import select
+        from models import AvailableRoute, RouteConcertLink
+        from services.crud import route_service
+
+        links = db_session.exec(select(RouteConcertLink)).all()
+        assert len(links) == 7
+
+        concert = route_catalog["concerts"][0]
+        concert.tickets_available = False
+        db_session.add(concert)
+        db_session.commit()
+
+        delta = route_service.refresh_available_routes_sql(db_session)
+        db_session.commit()
+        assert delta == {'deleted_count': 0, 'added_count': 2}
+
+        available = set(db_session.exec(select(AvailableRoute.original_route_id)).all())
+        index = route_service.get_route_index(db_session)
+        mask = index.available_mask(index.blocked_concerts(route_service.get_available_concert_ids(db_session)))
+        assert available == set(index.route_ids[mask].tolist())
+
+    def test_concert_change_touches_only_affected_routes(self, db_session, route_catalog):
+        """Тест инкрементального обновления по изменившимся концертам"""
+        from services.crud import route_service
+
+        route_service.init_available_routes(db_session)
+
+        concert = route_catalog["concerts"][2]
+        concert.tickets_available = False
+        db_session.add(concert)
+        db_session.commit()
+
+        result = route_service.on_concert_availability_changed(db_session, [concert.external_id])
+        # Концерт 903 входит в два маршрута
+        assert result == {'affected_routes': 2, 'deleted_count': 2, 'added_count': 0}
+
+        concert.tickets_available = True
+        db_session.add(concert)
+        db_session.commit()
+
+        result = route_service.on_concert_availability_changed(db_session, [concert.external_id])
+        assert result == {'affected_routes': 2, 'deleted_count': 0, 'added_count': 2}
+
+        result = route_service.on_concert_availability_changed(db_session, [12345678])
+        assert result['affected_routes'] == 0
+
+
+class TestRouteContainment:
+    """Тесты поиска маршрутов по составу"""
+
+    def test_sostav_ids_filled_from_sostav(self, db_session, route_catalog):
+        """Тест заполнения SostavIds для маршрутов без массива состава"""
+        from services.crud import route_service
+        from services.route_index import route_concert_ids
+
+        routes = route_catalog["routes"]
+        for route in routes:
+            db_session.refresh(route)
+        assert [route.SostavIds for route in routes] == [[901, 902], [902, 903], [903], [901, 904]]
+        assert route_concert_ids(routes[0]) == [901, 902]
+        assert route_service.ensure_route_sostav_ids(db_session) == 0
+
+    def test_find_routes_containing_concerts(self, db_session, route_catalog):
+        """Тест поиска маршрутов, содержащих все указанные концерты"""
+        from services.crud import route_service
+
+        routes = route_catalog["routes"]
+        found = route_service.find_routes_containing_concerts(db_session, [903])
+        assert [route.id for route in found] == [routes[2].id, routes[1].id]
+
+        found = route_service.find_routes_containing_concerts(db_session, [902, 901])
+        assert [route.id for route in found] == [routes[0].id]
+
+        assert route_service.find_routes_containing_concerts(db_session, [901, 903]) == []
+        assert route_service.find_routes_containing_concerts(db_session, []) == []
+
+        # Среди доступных маршрутов нет маршрута с отсутствующим концертом 904
+        route_service.init_available_routes(db_session)
+        assert route_service.find_routes_containing_concerts(db_session, [901], available_only=True)[0].original_route_id == routes[0].id
+        assert len(route_service.find_routes_containing_concerts(db_session, [901], available_only=True)) == 1
+
+    def test_customer_matches_from_superset_search(self, db_session, route_catalog):
+        """Тест ночного сопоставления: кратчайший маршрут-надмножество по спискам концерт → маршруты"""
+        from sqlmodel import select
+        from models import CustomerRouteMatch
+        from services.crud import route_service
+        from services.crud.customer_match import fill_customer_route_matches
+        from services.crud.shadow_table import shadow_table
+
+        routes = route_catalog["routes"]
+        customers = [("a", [903]), ("b", [902, 901]), ("c", [901]), ("d", [901, 903]), ("e", [])]
+        index = route_service.get_route_index(db_session)
+        with shadow_table(db_session, CustomerRouteMatch.__table__) as shadow:
+            assert fill_customer_route_matches(db_session, shadow, customers, index) == 5
+
+        matches = {
+            match.user_external_id: (match.match_type, match.best_route_id, match.match_percentage)
+            for match in db_session.exec(select(CustomerRouteMatch)).all()
+        }
+        assert matches == {
+            "a": ("exact", routes[2].id, 100.0),
+            "b": ("exact", routes[0].id, 100.0),
+            "c": ("partial", routes[0].id, 50.0),
+            "d": ("none", None, None),
+            "e": ("none", None, None),
+        }
+        db_session.exec(CustomerRouteMatch.__table__.delete())
+        db_session.commit()
+
+    def test_new_purchases_rematch_only_their_buyers(self, db_session, route_catalog):
+        """Тест пересчёта сопоставлений после новых покупок: меняются только строки их покупателей"""
+        from datetime import datetime
+        import pandas as pd
+        from sqlmodel import select, delete
+        from models import CustomerRouteMatch, Purchase
+        from services.crud.data_loader import on_purchases_added, load_purchases
+
+        routes, concerts = route_catalog["routes"], route_catalog["concerts"]
+        untouched = CustomerRouteMatch(user_external_id="other", found=False, match_type="none",
+                                       customer_concerts="", customer_concerts_count=0, total_routes_checked=0)
+        db_session.add(untouched)
+        db_session.add(Purchase(external_op_id=501, user_external_id="buyer", concert_id=903,
+                                purchased_at=datetime.now(), price=500))
+        db_session.commit()
+        try:
+            assert on_purchases_added(db_session, ["buyer"]) == 1
+            match = db_session.exec(select(CustomerRouteMatch).where(CustomerRouteMatch.user_external_id == "buyer")).one()
+            assert (match.match_type, match.best_route_id, match.total_routes_checked) == ("exact", routes[2].id, 4)
+
+            # Вторая покупка меняет сопоставление покупателя: 903 + 902 — маршрут routes[1]
+            db_session.add(Purchase(external_op_id=502, user_external_id="buyer", concert_id=902,
+                                    purchased_at=datetime.now(), price=500))
+            db_session.commit()
+            assert on_purchases_added(db_session, ["buyer"]) == 1
+            db_session.expire_all()
+            matches = {match.user_external_id: match for match in db_session.exec(select(CustomerRouteMatch)).all()}
+            assert (matches["buyer"].match_type, matches["buyer"].best_route_id) == ("exact", routes[1].id)
+            assert matches["other"].total_routes_checked == 0
+
+            # Загрузка покупок пересчитывает только покупателей с новыми операциями
+            df_ops = pd.DataFrame([{"OpId": 503, "ClientId": "loaded", "ShowId": concerts[0].external_id,
+                                    "OpDate": datetime.now(), "Price": 100}])
+            load_purchases(db_session, df_ops)
+            loaded = db_session.exec(select(CustomerRouteMatch).where(CustomerRouteMatch.user_external_id == "loaded")).one()
+            updated_at = loaded.updated_at
+            load_purchases(db_session, df_ops)
+            db_session.expire_all()
+            assert db_session.exec(
+                select(CustomerRouteMatch).where(CustomerRouteMatch.user_external_id == "loaded")
+            ).one().updated_at == updated_at
+            assert len(db_session.exec(select(CustomerRouteMatch.id)).all()) == 3
+        finally:
+            db_session.exec(delete(Purchase).where(Purchase.external_op_id.in_([501, 502, 503])))
+            db_session.exec(delete(CustomerRouteMatch))
+            db_session.commit()
+
+    def test_rematch_updates_existing_row(self, db_session, route_catalog):
+        """Тест повторного пересчёта: строка покупателя обновляется на месте, дубли не появляются"""
+        from datetime import datetime
+        from sqlmodel import select, delete
+        from sqlalchemy.exc import IntegrityError
+        from models import CustomerRouteMatch, Purchase
+        from services.crud.data_loader import rematch_customers
+
+        routes = route_catalog["routes"]
+        db_session.add(Purchase(external_op_id=601, user_external_id="twice", concert_id=903,
+                                purchased_at=datetime.now(), price=500))
+        db_session.commit()
+        try:
+            assert rematch_customers(db_session, ["twice"]) == 1
+            first = db_session.exec(select(CustomerRouteMatch).where(CustomerRouteMatch.user_external_id == "twice")).one()
+            first_id, created_at = first.id, first.created_at
+
+            db_session.add(Purchase(external_op_id=602, user_external_id="twice", concert_id=902,
+                                    purchased_at=datetime.now(), price=500))
+            db_session.commit()
+            assert rematch_customers(db_session, ["twice", "twice"]) == 1
+            db_session.expire_all()
+            match = db_session.exec(select(CustomerRouteMatch).where(CustomerRouteMatch.user_external_id == "twice")).one()
+            assert (match.id, match.created_at) == (first_id, created_at)
+            assert (match.match_type, match.best_route_id, match.customer_concerts) == ("exact", routes[1].id, "902,903")
+
+            # Второй строки того же покупателя не допускает уникальный индекс
+            db_session.add(CustomerRouteMatch(user_external_id="twice", found=False, customer_concerts="",
+                                              customer_concerts_count=0))
+            with pytest.raises(IntegrityError):
+                db_session.commit()
+            db_session.rollback()
+        finally:
+            db_session.exec(delete(Purchase).where(Purchase.external_op_id.in_([601, 602])))
+            db_session.exec(delete(CustomerRouteMatch))
+            db_session.commit()
+
+    def test_parallel_rebuild_matches_sequential(self, db_session, route_catalog):
+        """Тест полного перестроения: пул процессов по разделам даёт те же строки, прогресс доходит до конца"""
+        from datetime import datetime
+        from sqlmodel import select, delete
+        from models import CustomerRouteMatch, Purchase
+        from services.crud import route_service
+        from services.crud.customer_match import count_customers, customer_partition, fill_customer_route_matches
+        from services.crud.data_loader import update_customer_route_matches
+        from services.crud.shadow_table import shadow_table
+
+        routes = route_catalog["routes"]
+        customers = [(f"c{number}", [[903], [902, 901], [901], [901, 903]][number % 4]) for number in range(11)]
+        assert customer_partition("c1", 3) == customer_partition("c1", 3)
+
+        def rebuilt(**kwargs):
+            index = route_service.get_route_index(db_session)
+            status = {}
+            with shadow_table(db_session, CustomerRouteMatch.__table__) as shadow:
+                assert fill_customer_route_matches(db_session, shadow, iter(customers), index,
+                                                   total=len(customers), status_dict=status, **kwargs) == 11
+            assert (status["matches_progress"], status["matches_total"]) == (11, 11)
+            return {
+                match.user_external_id: (match.match_type, match.best_route_id, match.customer_concerts)
+                for match in db_session.exec(select(CustomerRouteMatch)).all()
+            }
+
+        sequential = rebuilt(workers=1)
+        assert rebuilt(workers=2, chunk_size=2) == sequential
+        assert sequential["c1"] == ("exact", routes[0].id, "901,902")
+        assert sequential["c3"] == ("none", None, "901,903")
+
+        # Перестроение из покупок: покупатели читаются потоком, старые сопоставления заменяются
+        db_session.add_all([
+            Purchase(external_op_id=601 + number, user_external_id=user_id, concert_id=concert_id,
+                     purchased_at=datetime.now(), price=100)
+            for number, (user_id, concert_id) in enumerate([("p1", 903), ("p2", 901), ("p2", 902), ("p2", 901)])
+        ])
+        db_session.commit()
+        status = {}
+        try:
+            customers_count = count_customers(db_session)
+            assert update_customer_route_matches(db_session, status_dict=status, workers=1) == customers_count
+            assert status["matches_progress"] == customers_count
+            matches = {match.user_external_id: (match.match_type, match.best_route_id, match.customer_concerts_count)
+                       for match in db_session.exec(select(CustomerRouteMatch)).all()}
+            assert len(matches) == customers_count
+            assert matches["p1"] == ("exact", routes[2].id, 1)
+            assert matches["p2"] == ("exact", routes[0].id, 2)
+            assert "c1" not in matches
+        finally:
+            db_session.exec(delete(Purchase).where(Purchase.external_op_id.between(601, 604)))
+            db_session.exec(delete(CustomerRouteMatch))
+            db_session.commit()
+
+    def test_find_customer_route_match_from_index(self, db_session, route_catalog):
+        """Тест сопоставления покупателя по индексу составов: только top-k маршрутов с подробностями"""
+        from datetime import datetime
+        from sqlmodel import delete
+        from models import Purchase, Route
+        from services.crud import route_service
+        from services.crud.purchase import find_customer_route_match
+
+        concerts = route_catalog["concerts"]
+        first, second = concerts[0].id, concerts[1].id
+        db_session.add_all([
+            Route(Sostav=sostav, Days=1, Concerts=len(sostav.split(',')), Halls=1, ShowTime=60.0,
+                  TransTime=0.0, WaitTime=0.0, Costs=100.0)
+            for sostav in (f"{first},{second}", f"{first},{second},{concerts[2].id}", f"{first}")
+        ])
+        db_session.add(Purchase(external_op_id=701, user_external_id="sheet", concert_id=first,
+                                purchased_at=datetime.now(), price=100))
+        db_session.commit()
+        route_service.bump_route_catalog_version(db_session)
+        route_service.ensure_route_sostav_ids(db_session)
+        try:
+            match = find_customer_route_match(db_session, "sheet")
+            assert match["found"] and match["match_type"] == "exact"
+            assert [route["route_composition"] for route in match["matched_routes"]] == [f"{first}"]
+
+            db_session.add(Purchase(external_op_id=702, user_external_id="sheet", concert_id=second,
+                                    purchased_at=datetime.now(), price=100))
+            db_session.commit()
+            match = find_customer_route_match(db_session, "sheet")
+            assert match["match_type"] == "exact" and match["best_match"]["route_composition"] == f"{first},{second}"
+
+            match = find_customer_route_match(db_session, "sheet", top_k=1)
+            assert len(match["matched_routes"]) == 1 and match["total_matches"] == 1
+
+            db_session.exec(delete(Purchase).where(Purchase.external_op_id == 701))
+            db_session.commit()
+            match = find_customer_route_match(db_session, "sheet")
+            assert match["match_type"] == "partial" and match["total_matches"] == 2
+            assert [route["match_percentage"] for route in match["matched_routes"]] == pytest.approx([50.0, 100 / 3])
+            assert match["best_match"]["missing_concerts"] == [first]
+        finally:
+            db_session.exec(delete(Purchase).where(Purchase.external_op_id.in_([701, 702])))
+            db_session.commit()
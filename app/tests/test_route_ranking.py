@@ -0,0 +1,94 @@
+import numpy as np
+
+from services import route_ranking
+from services.route_ranking import RouteRankingIndex
+from services.route_catalog import RouteCatalog
+
+
+class TestRouteRanking:
+    """Тесты рейтингов маршрутов по корзинам количества концертов"""
+
+    def test_top_k_positions_matches_stable_sort(self):
+        """Тест частичного отбора top-k: совпадает со стабильной сортировкой, в том числе при равных значениях"""
+        rng = np.random.default_rng(7)
+        scores = rng.integers(0, 5, size=200).astype(float)
+        for k in (1, 3, 10, 199, 200, 500):
+            expected = np.argsort(-scores, kind='stable')[:k]
+            assert route_ranking.top_k_positions(scores, k).tolist() == expected.tolist()
+        assert route_ranking.top_k_positions(scores, 0).tolist() == []
+
+    def test_concert_count_mask_relaxes_min(self):
+        """Тест понижения min_concerts до ближайшего количества концертов в каталоге"""
+        concerts = np.array([1, 2, 2, 5, 7])
+        assert route_ranking.concert_count_mask(concerts, 3, 4).tolist() == [False, True, True, False, False]
+        assert route_ranking.concert_count_mask(concerts, 4).tolist() == [False, False, False, True, True]
+        assert route_ranking.concert_count_mask(concerts, 9).tolist() == [False, False, False, False, True]
+        assert route_ranking.concert_count_mask(concerts, 3, 0).tolist() == [False] * 5
+        assert route_ranking.concert_count_mask(concerts).all()
+
+    def test_bucket_merge_matches_full_sort(self):
+        """Тест слияния корзин: результат совпадает с сортировкой маршрутов окна"""
+        rng = np.random.default_rng(11)
+        n = 300
+        concerts = rng.integers(1, 8, size=n)
+        intellect = rng.integers(0, 10, size=n).astype(float)
+        comfort = rng.integers(0, 10, size=n).astype(float)
+        comfort[::17] = np.nan
+        rows = [(i + 1, [], int(concerts[i]), intellect[i], comfort[i]) for i in range(n)]
+        catalog = RouteCatalog.from_rows("v1", ["Concerts", "IntellectScore", "ComfortScore"], ["Concerts"], rows)
+        ranking = RouteRankingIndex.from_catalog(catalog, {"balance": (0.5, 0.5)})
+
+        buckets = ranking.window(3, 5)
+        mask = (concerts >= 3) & (concerts <= 5)
+        assert ranking.window_size(buckets) == int(mask.sum())
+        for name in ("intellect", "comfort", "balanced", "weighted_balance"):
+            scores = np.where(mask, ranking.scores[name], -np.inf)
+            expected = np.argsort(-scores, kind='stable')[:15]
+            assert ranking.top(name, 15, buckets).tolist() == expected.tolist()
+
+        # Маска допустимых маршрутов применяется внутри корзин
+        allowed = np.arange(n) % 2 == 0
+        scores = np.where(mask & allowed, ranking.scores["intellect"], -np.inf)
+        expected = np.argsort(-scores, kind='stable')[:10]
+        assert ranking.top("intellect", 10, buckets, allowed).tolist() == expected.tolist()
+        assert ranking.top("intellect", 5, ranking.window(3, 0)).tolist() == []
+
+    def test_allowed_mask_removes_bucket_head(self):
+        """Тест маски, убирающей голову корзины: допустимые маршруты набираются из продолжения корзины"""
+        n = 100
+        intellect = np.arange(n, 0, -1).astype(float)
+        rows = [(i + 1, [], 3, intellect[i], 0.0) for i in range(n)]
+        catalog = RouteCatalog.from_rows("v1", ["Concerts", "IntellectScore", "ComfortScore"], ["Concerts"], rows)
+        ranking = RouteRankingIndex.from_catalog(catalog, {})
+        buckets = ranking.window()
+
+        # Лучшие 40 маршрутов корзины недоступны, из остальных допустим каждый третий
+        allowed = (np.arange(n) >= 40) & (np.arange(n) % 3 == 0)
+        assert ranking.top("intellect", 5, buckets, allowed).tolist() == [42, 45, 48, 51, 54]
+        assert ranking.top("intellect", 50, buckets, allowed).tolist() == np.flatnonzero(allowed).tolist()
+        assert ranking.top("intellect", 5, buckets, np.zeros(n, dtype=bool)).tolist() == []
+
+        assert route_ranking.allowed_head(np.arange(n), allowed, 3).tolist() == [42, 45, 48]
+
+    def test_restricted_ranking_matches_masked_top(self):
+        """Тест рейтингов доступных маршрутов: те же подборки, что и с маской, корзины и окно не меняются"""
+        rng = np.random.default_rng(5)
+        n = 200
+        concerts = rng.integers(1, 6, size=n)
+        rows = [(i + 1, [], int(concerts[i]), float(rng.integers(0, 10)), float(rng.integers(0, 10)))
+                for i in range(n)]
+        catalog = RouteCatalog.from_rows("v1", ["Concerts", "IntellectScore", "ComfortScore"], ["Concerts"], rows)
+        ranking = RouteRankingIndex.from_catalog(catalog, {"balance": (0.5, 0.5)})
+
+        # Корзина 5 концертов целиком недоступна
+        available = (rng.random(n) < 0.6) & (concerts != 5)
+        allowed = rng.random(n) < 0.5
+        restricted = ranking.restricted(available)
+        assert restricted.bucket_values.tolist() == ranking.bucket_values.tolist()
+        assert restricted.window_size(restricted.window()) == int(available.sum())
+        for buckets in (ranking.window(), ranking.window(2, 4), ranking.window(5)):
+            for name in ("intellect", "comfort", "balanced", "weighted_balance"):
+                assert restricted.top(name, 7, buckets).tolist() == ranking.top(name, 7, buckets, available).tolist()
+                assert (restricted.top(name, 7, buckets, allowed).tolist()
+                        == ranking.top(name, 7, buckets, allowed & available).tolist())
+        assert restricted.top("intellect", 7, ranking.window(5)).tolist() == []
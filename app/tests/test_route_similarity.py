@@ -0,0 +1,59 @@
+import numpy as np
+
+from services.route_catalog import RouteCatalog
+from services.route_index import RouteBitsetIndex
+from services.route_similarity import (
+    RouteSimilarityIndex, exact_jaccard, most_similar_routes, most_similar_routes_batch
+)
+
+
+class TestRouteSimilarity:
+    """Тесты поиска похожих маршрутов через MinHash LSH"""
+
+    def test_lsh_candidates_and_exact_reranking(self):
+        """Тест кандидатов LSH и точного ранжирования по Жаккару"""
+        rng = np.random.default_rng(3)
+        compositions = [sorted(rng.choice(np.arange(1, 60), size=rng.integers(2, 7), replace=False).tolist())
+                        for _ in range(500)]
+        compositions.append([])
+        rows = [(i + 1, composition, len(composition)) for i, composition in enumerate(compositions)]
+        catalog = RouteCatalog.from_rows("v1", ["Concerts"], ["Concerts"], rows)
+        similarity = RouteSimilarityIndex.from_catalog(catalog)
+        index = RouteBitsetIndex.from_compositions(catalog.route_ids, catalog.compositions())
+
+        # Маршрут с тем же составом всегда попадает в кандидаты
+        for position in (0, 17, 250):
+            assert position in similarity.candidates(compositions[position]).tolist()
+        assert similarity.candidates([]).tolist() == []
+
+        query = compositions[42]
+        positions, jaccard = most_similar_routes(similarity, index, query, 5)
+        assert positions[0] == 42 and jaccard[0] == 1.0
+        assert np.all(np.diff(jaccard) <= 0)
+
+        # Точный Жаккар по битовым маскам совпадает с подсчётом по множествам
+        everything = np.arange(len(compositions))
+        expected = [len(set(c) & set(query)) / len(set(c) | set(query)) for c in compositions]
+        assert np.allclose(exact_jaccard(index, everything, query), expected)
+        assert jaccard[-1] == np.sort(expected)[-5]
+
+    def test_batch_matches_single_queries(self):
+        """Тест пакетного поиска: совпадает с поиском по одному набору, в том числе с маской и дополнением"""
+        rng = np.random.default_rng(9)
+        compositions = [sorted(rng.choice(np.arange(1, 40), size=rng.integers(1, 6), replace=False).tolist())
+                        for _ in range(400)]
+        rows = [(i + 1, composition, len(composition)) for i, composition in enumerate(compositions)]
+        catalog = RouteCatalog.from_rows("v1", ["Concerts"], ["Concerts"], rows)
+        similarity = RouteSimilarityIndex.from_catalog(catalog)
+        index = RouteBitsetIndex.from_compositions(catalog.route_ids, catalog.compositions())
+        allowed = rng.random(len(compositions)) < 0.7
+
+        queries = [compositions[i] for i in range(0, 400, 7)] + [[], [999], [3, 999], [5, 6, 7, 8, 9]]
+        for mask in (None, allowed):
+            batch = most_similar_routes_batch(similarity, index, queries, 6, mask)
+            for query, (positions, jaccard) in zip(queries, batch):
+                expected_positions, expected_jaccard = (
+                    most_similar_routes(similarity, index, query, 6, mask) if query else ([], [])
+                )
+                assert positions.tolist() == list(expected_positions)
+                assert np.allclose(jaccard, expected_jaccard)
@@ -0,0 +1,61 @@
+import numpy as np
+
+from services.route_skyline import skyline_layers
+from services.route_ranking import RouteRankingIndex
+from services.route_catalog import RouteCatalog
+
+
+def _brute_force_layers(points, max_layers):
+    """Слои Парето снятием недоминируемых маршрутов по одному слою"""
+    layers = np.full(len(points), max_layers)
+    remaining = list(range(len(points)))
+    for layer in range(max_layers):
+        front = [
+            p for p in remaining
+            if not any(
+                np.all(points[q] >= points[p]) and np.any(points[q] > points[p])
+                for q in remaining if q != p
+            )
+        ]
+        layers[front] = layer
+        remaining = [p for p in remaining if p not in front]
+    return layers
+
+
+class TestRouteSkyline:
+    """Тесты слоёв Парето маршрутов по баллам и стоимости"""
+
+    def test_layers_match_brute_force(self):
+        """Тест слоёв: совпадают с последовательным снятием фронтов, включая равные маршруты и NaN"""
+        rng = np.random.default_rng(5)
+        n = 150
+        intellect = rng.integers(0, 8, size=n).astype(float)
+        comfort = rng.integers(0, 8, size=n).astype(float)
+        costs = rng.integers(0, 8, size=n).astype(float)
+        comfort[::23] = np.nan
+        costs[::19] = np.nan
+        groups = rng.integers(1, 4, size=n)
+
+        layers = skyline_layers(intellect, comfort, costs, groups=groups, max_layers=6)
+        points = np.column_stack((np.nan_to_num(intellect), np.nan_to_num(comfort), -np.nan_to_num(costs, nan=np.inf)))
+        for group in np.unique(groups):
+            members = np.flatnonzero(groups == group)
+            assert layers[members].tolist() == _brute_force_layers(points[members], 6).tolist()
+
+    def test_balanced_ranking_prefers_skyline(self):
+        """Тест сбалансированного рейтинга: доминируемый маршрут с меньшим разрывом идёт после недоминируемых"""
+        rows = [
+            (1, [], 2, 50.0, 50.0, 100.0),  # доминируется маршрутом 3
+            (2, [], 2, 90.0, 60.0, 100.0),
+            (3, [], 2, 60.0, 60.0, 90.0),
+        ]
+        catalog = RouteCatalog.from_rows(
+            "v1", ["Concerts", "IntellectScore", "ComfortScore", "Costs"], ["Concerts"], rows
+        )
+        catalog.columns["SkylineLayer"] = skyline_layers(
+            catalog.column('IntellectScore'), catalog.column('ComfortScore'), catalog.column('Costs'),
+            groups=catalog.column('Concerts')
+        )
+        assert catalog.column("SkylineLayer").tolist() == [1, 0, 0]
+        ranking = RouteRankingIndex.from_catalog(catalog, {})
+        assert ranking.top("balanced", 3, ranking.window()).tolist() == [2, 1, 0]
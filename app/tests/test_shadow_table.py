@@ -0,0 +1,51 @@
+import pytest
+from sqlmodel import select
+from sqlalchemy import insert, text
+
+
+def _table_exists(db_session, name):
+    return db_session.exec(
+        text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name"), params={"name": name}
+    ).first() is not None
+
+
+class TestShadowTable:
+    """Тесты перестроения производных таблиц через теневую копию"""
+
+    def test_rebuild_available_routes_swaps_in_new_content(self, db_session, route_catalog):
+        """Тест перестроения AvailableRoute: устаревшие записи заменяются, теневая таблица удаляется"""
+        from models import AvailableRoute, Route
+        from services.crud import route_service
+
+        routes = route_catalog["routes"]
+        stale = Route(Sostav="999", Days=1, Concerts=1, Halls=1, ShowTime=0.0, TransTime=0.0,
+                      WaitTime=0.0, Costs=0.0)
+        db_session.add(AvailableRoute(**stale.model_dump(exclude={"id"}), id=10_000, original_route_id=10_000))
+        db_session.commit()
+
+        result = route_service.rebuild_available_routes(db_session)
+        assert result["available_routes"] == 3
+        db_session.expire_all()
+        available = db_session.exec(select(AvailableRoute.original_route_id).order_by(AvailableRoute.id)).all()
+        assert available == [route.id for route in routes[:3]]
+        assert route_service.get_cached_available_routes_count(db_session) == 3
+        assert not _table_exists(db_session, "availableroute__shadow")
+
+    def test_failed_rebuild_keeps_live_table(self, db_session, route_catalog):
+        """Тест ошибки при заполнении: живая таблица не меняется"""
+        from models import RouteConcertLink
+        from services.crud.shadow_table import shadow_table
+
+        links_before = db_session.exec(select(RouteConcertLink.route_id, RouteConcertLink.concert_id)).all()
+        with pytest.raises(RuntimeError):
+            with shadow_table(db_session, RouteConcertLink.__table__) as shadow:
+                db_session.exec(insert(shadow), params=[{"route_id": 1, "concert_id": 1}])
+                db_session.commit()
+                # Пока теневая таблица заполняется, читатели видят прежние связи
+                assert db_session.exec(
+                    select(RouteConcertLink.route_id, RouteConcertLink.concert_id)
+                ).all() == links_before
+                raise RuntimeError("ошибка заполнения")
+
+        assert db_session.exec(select(RouteConcertLink.route_id, RouteConcertLink.concert_id)).all() == links_before
+        assert not _table_exists(db_session, "routeconcertlink__shadow")
@@ -15,5 +15,6 @@ celery_app = Celery(
 )
 
 celery_app.conf.task_routes = {
-    'worker.tasks.send_telegram_message': {'queue': 'telegram'}
+    'worker.tasks.send_telegram_message': {'queue': 'telegram'},
+    'worker.tasks.rematch_customers_task': {'queue': 'routes'}
 } 
\ No newline at end of file
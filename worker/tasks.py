@@ -310,4 +310,22 @@ def format_route_summary_task(self, concerts_data: dict):
         
     except Exception as e:
         logger.error(f"[Celery] Ошибка при форматировании статистики: {e}")
-        raise self.retry(exc=e) 
\ No newline at end of file
+        raise self.retry(exc=e)
+
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=10)
+def rematch_customers_task(self, user_external_ids: list):
+    """Пересчитывает сопоставления с маршрутами покупателей с новыми покупками через Celery"""
+    logger.info(f"[Celery] Пересчёт сопоставлений {len(user_external_ids)} покупателей")
+    
+    try:
+        from app.services.crud.data_loader import rematch_customers
+        from sqlmodel import Session
+        from app.database.simple_engine import simple_engine
+        
+        with Session(simple_engine) as session:
+            return rematch_customers(session, user_external_ids)
+            
+    except Exception as e:
+        logger.error(f"[Celery] Ошибка при пересчёте сопоставлений покупателей: {e}")
+        raise self.retry(exc=e)